@@ -1,28 +1,50 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request, Form, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
+from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, StreamingResponse, Response
 import uvicorn
 import os
 import shutil
 from PIL import Image, ImageEnhance, ImageFilter, ImageDraw, ImageFont
 import io
 import uuid
-from typing import Optional, List, Dict, Any, Union
-import numpy as np
-import torch
-import cv2
+from typing import Optional, List, Dict, Any, Union, Callable, Awaitable, AsyncIterator
 import gc
 import logging
 import sys
 from fastapi.middleware.gzip import GZipMiddleware
 from dotenv import load_dotenv
-import requests
-from segmind_api import SegmindVirtualTryOn
+import http_client
+import deadline
+import upstream_guard
+from upstream_guard import UpstreamUnavailable
+from result_cache import (ResultCache, make_tryon_key, make_prompt_key, normalize_prompt, RESULT_CACHE_ENABLED,
+                          PROMPT_CACHE_ENABLED, PROMPT_CACHE_MAX_BYTES)
+from job_queue import JobQueue, JobQueueFull, SUCCEEDED, CANCELLED, TERMINAL_STATES
+from ingest import ingest_upload, ingest_local_file, UploadTooLarge, UnsupportedImage
+from image_normalize import ensure_normalized, normalized_path_for, NORMALIZED_SUFFIX
+from http_cache import cached_file_response
+from image_variants import negotiate_format, snap_width, variant_name, render_variant, media_type_for
+import blob_store
+from blob_store import make_key
+from warmup import readiness, READY, PENDING
+import executors
+from executors import cpu_pool, upstream_pool, disk_pool, BulkheadFull
+from singleflight import SingleFlight, COALESCE_ENABLED
+from storage import janitor, JANITOR_ENABLED
+import progress
+import tracing
+from log_pipeline import configure_logging
+import cpu_tasks
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+import metrics
 import asyncio
+import hmac
+import anyio
+import threading
 import base64
 import random
 import time
-import aiohttp
 import hashlib
 import json
 from datetime import datetime
@@ -30,7 +52,9 @@ from pydantic import BaseModel
 from concurrent.futures import ThreadPoolExecutor
 import string
 import re
-import traceback
+import math
+from functools import lru_cache
+from contextlib import contextmanager
 
 # Utility functions for file handling
 def secure_filename(filename):
@@ -55,17 +79,14 @@ def cleanup_temp_file(file_path):
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('server.log')
-    ]
-)
+# Logging is configured per process (callers only enqueue records; a background thread formats and writes them):
+# by the startup hook, or by serve.py before it forks its workers
 logger = logging.getLogger(__name__)
 
+# Segmind endpoints (see .env.example)
+SEGMIND_API_BASE = os.environ.get("SEGMIND_API_BASE", "https://api.segmind.com/v1").rstrip("/")
+SEGMIND_TRYON_URL = f"{SEGMIND_API_BASE}/try-on-diffusion"
+
 # Import our virtual try-on modules
 # Comment these out for testing if modules are not available
 # from nodes.preprocessing import ModelPreprocessor, ClothPreprocessor
@@ -73,37 +94,25 @@ logger = logging.getLogger(__name__)
 # from nodes.fusion import ImageFusionNode
 # from nodes.postprocessing import PostProcessor
 
+# Heavy subsystems (torch, OpenCV, numpy, the Segmind client, the fashion advisor and CLIP)
+# are imported where they are first used so the API starts serving without them
+
 def cleanup_memory():
     """Clean up memory to prevent memory leaks."""
     gc.collect()
-    if torch.cuda.is_available():
+    # Only touch CUDA if something has already loaded torch
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
         torch.cuda.empty_cache()
 
 def load_image(image_path):
     """Load an image and convert it to the format expected by our nodes."""
+    import cv2
+    import numpy as np
+    import torch
     try:
-        # Increase PIL's decompression bomb limit
-        Image.MAX_IMAGE_PIXELS = None  # Disable the limit (use with caution)
-        
-        img = Image.open(image_path).convert('RGB')
-        
-        # Check if image is too large and resize if necessary
-        max_dimension = 1024  # Maximum dimension for width or height
-        if img.width > max_dimension or img.height > max_dimension:
-            logger.info(f"Resizing large image: {img.width}x{img.height}")
-            # Calculate new dimensions while maintaining aspect ratio
-            if img.width > img.height:
-                new_width = max_dimension
-                new_height = int(img.height * (max_dimension / img.width))
-            else:
-                new_height = max_dimension
-                new_width = int(img.width * (max_dimension / img.height))
-            
-            img = img.resize((new_width, new_height), Image.LANCZOS)
-            logger.info(f"Resized to: {img.width}x{img.height}")
-            
-            # Save the resized image back to the same path
-            img.save(image_path)
+        # Read the working-resolution copy made at ingest (created now for older files)
+        img = Image.open(ensure_normalized(image_path)).convert('RGB')
             
         img_np = np.array(img)
         # Ensure we're in RGB format (OpenCV uses BGR)
@@ -113,11 +122,6 @@ def load_image(image_path):
         img_tensor = torch.from_numpy(img_np).float() / 255.0
         img_tensor = img_tensor.permute(2, 0, 1).unsqueeze(0)
         
-        # Clean up
-        del img
-        del img_np
-        cleanup_memory()
-        
         return img_tensor
     except Exception as e:
         logger.error(f"Error loading image {image_path}: {str(e)}")
@@ -125,6 +129,8 @@ def load_image(image_path):
 
 def save_image(tensor, output_path):
     """Save a tensor as an image."""
+    import numpy as np
+    import torch
     if isinstance(tensor, torch.Tensor):
         # Convert from BCHW to HWC
         img_np = tensor[0].permute(1, 2, 0).cpu().numpy()
@@ -140,24 +146,23 @@ def download_image(url, save_path):
     try:
         logger.info(f"Downloading image from {url} to {save_path}")
         
-        # Create a session with proper headers to avoid 403 errors
-        session = requests.Session()
-        session.headers.update({
+        # Send browser-like headers to avoid 403 errors
+        headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.9',
             'Referer': 'https://www.google.com/'
-        })
+        }
         
-        response = session.get(url, stream=True, timeout=15)
-        response.raise_for_status()
+        response = http_client.request_blocking("GET", url, headers=headers, timeout=15)
+        if response.status_code >= 400:
+            raise Exception(f"Download failed with status {response.status_code}")
         
         # Ensure the directory exists
         os.makedirs(os.path.dirname(save_path), exist_ok=True)
         
         with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+            f.write(response.content)
                 
         logger.info(f"Image downloaded successfully to {save_path}")
         return save_path
@@ -167,6 +172,10 @@ def download_image(url, save_path):
 
 app = FastAPI(title="Virtual Try-On API")
 
+# Per-request deadline (X-Request-Timeout) and cancellation on client disconnect; added first so it
+# sits innermost and its 499/504 responses still pass through CORS, gzip and the request metrics
+app.add_middleware(deadline.DeadlineMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -174,18 +183,143 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
+# Add gzip compression
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
 # Create upload directories if they don't exist
 os.makedirs("uploads/models", exist_ok=True)
 os.makedirs("uploads/clothes", exist_ok=True)
 os.makedirs("results", exist_ok=True)
 
-def process_tryon(model_path: str, cloth_path: str, use_segmind: bool = True, clothing_category: str = "Upper body") -> str:
+def normalized_or_original(image_path: str) -> str:
+    """Return the normalized variant of an image, or the image itself if it cannot be decoded."""
+    try:
+        return ensure_normalized(image_path)
+    except Exception as e:
+        logger.warning(f"Using original image {image_path}; normalization failed: {str(e)}")
+        return image_path
+
+# Content-addressed cache of finished try-on results (results/tryon_<sha256>.png)
+result_cache = ResultCache(store=blob_store.store)
+
+# Opt-in cache of text-to-image results keyed on prompt, style, size and seed (generated/prompt_<sha256>.png)
+prompt_cache = ResultCache(directory="generated", prefix="prompt_", max_bytes=PROMPT_CACHE_MAX_BYTES,
+                           store=blob_store.store)
+
+# Bounded worker pool for try-on jobs; started with the app
+job_queue = JobQueue()
+
+# Identical text-to-clothing prompts in flight share one Segmind call
+clothing_flight = SingleFlight("generate_clothing")
+
+# Concurrent requests for a variant that is not stored yet share one encode
+variant_flight = SingleFlight("image_variants")
+
+@app.on_event("startup")
+async def start_services():
+    configure_logging()
+    await http_client.startup()
+    readiness.mark("http_client", READY)
+    await job_queue.start()
+    readiness.mark("job_queue", READY)
+    if JANITOR_ENABLED:
+        janitor.start()
+    start_warmup()
+
+@app.on_event("shutdown")
+async def stop_services():
+    # Report unready first so the load balancer drains this process
+    readiness.mark("job_queue", PENDING)
+    await job_queue.stop()
+    janitor.stop()
+    executors.shutdown()
+    await http_client.shutdown()
+    tracing.exporter.close()
+
+# Per-route request latency; the route template keeps label cardinality bounded
+HTTP_REQUEST_DURATION = metrics.Histogram(
+    "http_request_duration_seconds", "Request latency by method, route template and status", ("method", "route", "status")
+)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = "500"
+    # Every request gets an id (the client's X-Request-ID if it sent one), echoed back and put on its trace
+    request_id = tracing.request_id_from(request.headers.get("x-request-id"))
+    with tracing.request_span(f"{request.method} {request.url.path}", request_id,
+                              **{"http.method": request.method, "http.target": request.url.path}) as root:
+        try:
+            response = await call_next(request)
+            status = str(response.status_code)
+            response.headers["X-Request-ID"] = request_id
+            if not readiness.begun and response.background is None:
+                # Components warm up only after the first response is out, so they don't slow it down
+                response.background = BackgroundTask(readiness.begin)
+            return response
+        finally:
+            route_path = getattr(request.scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_DURATION.labels(request.method, route_path, status).observe(time.perf_counter() - started)
+            if root:
+                root.name = f"{request.method} {route_path}"
+                root.set(**{"http.route": route_path, "http.status_code": int(status)})
+
+def collect_service_metrics():
+    """Read job queue, executor and cache occupancy at scrape time."""
+    queue = job_queue.stats()
+    yield "job_queue_depth", "gauge", "Jobs waiting for a worker", [({}, queue["queue_depth"])]
+    yield "job_queue_running", "gauge", "Jobs currently running", [({}, queue["running"])]
+    yield "job_queue_workers", "gauge", "Configured job workers", [({}, queue["workers"])]
+    yield "job_queue_max_pending", "gauge", "Maximum number of queued jobs", [({}, queue["max_pending"])]
+
+    try:
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        yield "threadpool_busy_threads", "gauge", "Threads in use by the request thread pool", [({}, limiter.borrowed_tokens)]
+        yield "threadpool_max_threads", "gauge", "Size of the request thread pool", [({}, limiter.total_tokens)]
+    except RuntimeError:
+        # Only readable from the event loop
+        pass
+
+    caches = {"tryon": result_cache.stats(), "prompt": prompt_cache.stats()}
+    for name, metric_type, field, documentation in (
+        ("cache_hits_total", "counter", "hits", "Cache lookups that found an entry"),
+        ("cache_misses_total", "counter", "misses", "Cache lookups that missed"),
+        ("cache_hit_ratio", "gauge", "hit_ratio", "Hits over lookups since start"),
+        ("cache_evictions_total", "counter", "evictions", "Entries evicted to stay within budget"),
+        ("cache_entries", "gauge", "entries", "Entries currently cached"),
+        ("cache_bytes", "gauge", "bytes", "Bytes currently cached"),
+        ("cache_max_bytes", "gauge", "max_bytes", "Cache disk budget in bytes"),
+    ):
+        yield name, metric_type, documentation, [({"cache": cache}, stats[field]) for cache, stats in caches.items()]
+
+metrics.REGISTRY.register_collector(collect_service_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Expose metrics in the Prometheus text format."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# Batch try-on limits (see .env.example)
+TRYON_BATCH_CONCURRENCY = int(os.environ.get("TRYON_BATCH_CONCURRENCY", "4"))
+TRYON_BATCH_MAX_ITEMS = int(os.environ.get("TRYON_BATCH_MAX_ITEMS", "500"))
+
+# Inference parameters a client may pin; anything else in the request body is ignored
+TRYON_PARAM_NAMES = ("num_inference_steps", "guidance_scale", "seed")
+
+@tracing.traced("process_tryon")
+def process_tryon(model_path: str, cloth_path: str, use_segmind: bool = True, clothing_category: str = "Upper body",
+                  params: Optional[Dict[str, Any]] = None) -> str:
     """Process the virtual try-on and return the result image path."""
     try:
         logger.info(f"Processing try-on with model: {model_path}, cloth: {cloth_path}, clothing_category: {clothing_category}")
         
+        # Inputs are blob keys (or local paths); fetch local copies if the store is remote
+        model_path = blob_store.store.localize(model_path)
+        cloth_path = blob_store.store.localize(cloth_path)
+        
         # Check if files exist
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Model image not found at {model_path}")
@@ -193,44 +327,192 @@ def process_tryon(model_path: str, cloth_path: str, use_segmind: bool = True, cl
         if not os.path.exists(cloth_path):
             raise FileNotFoundError(f"Cloth image not found at {cloth_path}")
         
+        params = {name: value for name, value in (params or {}).items() if name in TRYON_PARAM_NAMES}
+        
+        # Serve repeat try-ons of the same images, category and parameters from the cache
+        cache_key = None
+        if RESULT_CACHE_ENABLED:
+            cache_key = make_tryon_key(model_path, cloth_path, clothing_category, params)
+            cached_path = result_cache.get(cache_key)
+            if cached_path:
+                logger.info(f"Result cache hit for try-on, returning {cached_path}")
+                progress.report(progress.SAVED, cached=True)
+                return cached_path
+        
         # Always use Segmind regardless of the use_segmind parameter
         # Set up Segmind client with identity rotation
+        from segmind_api import SegmindVirtualTryOn
         segmind_client = SegmindVirtualTryOn()
         logger.info("Using Segmind API for virtual try-on (always enforced)")
         
+        # Stop here if the client has gone or the deadline passed while this waited for a worker
+        deadline.check()
+        
+        # Send the working-resolution copies made at ingest rather than the raw uploads
+        model_input = normalized_or_original(model_path)
+        cloth_input = normalized_or_original(cloth_path)
+        
         # Process using direct Segmind API call
-        result_path = segmind_client.process_tryon(model_path, cloth_path, category=clothing_category)
+        result_path = segmind_client.process_tryon(model_input, cloth_input, category=clothing_category, **params)
         logger.info(f"Segmind processing complete, result saved to {result_path}")
+        
+        if cache_key:
+            result_path = result_cache.put(cache_key, result_path)
+        progress.report(progress.SAVED)
         return result_path
             
+    except (deadline.Cancelled, deadline.DeadlineExceeded):
+        # Nobody is waiting for the result any more; not an error in the try-on itself
+        raise
     except Exception as e:
-        logger.error(f"Error in process_tryon: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.error(f"Error in process_tryon: {str(e)}", exc_info=True)
         # Still raise the error to caller
         raise
 
-@app.post("/api/upload/model")
-async def upload_model(file: UploadFile = File(...)) -> dict:
-    """Upload a model image."""
+async def store_upload(file: UploadFile, kind: str) -> dict:
+    """Ingest an upload by content and return the response body for the upload endpoints."""
     try:
-        file_path = f"uploads/models/{uuid.uuid4()}_{file.filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        return {"filename": file_path}
+        stored = await ingest_upload(file, kind)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedImage as e:
+        raise HTTPException(status_code=415, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "filename": stored["key"],
+        "content_id": stored["content_id"],
+        "size": stored["size"],
+        "duplicate": stored["duplicate"]
+    }
+
+@app.post("/api/upload/model")
+async def upload_model(file: UploadFile = File(...)) -> dict:
+    """Upload a model image. Identical images are stored once, under their content hash."""
+    return await store_upload(file, "models")
 
 @app.post("/api/upload/cloth")
 async def upload_cloth(file: UploadFile = File(...)) -> dict:
-    """Upload a clothing image."""
+    """Upload a clothing image. Identical images are stored once, under their content hash."""
+    return await store_upload(file, "clothes")
+
+def parse_tryon_request(data: dict):
+    """Validate a try-on JSON body and return (model_path, cloth_path, clothing_category, params)."""
+    model_path = data.get("model_path")
+    cloth_path = data.get("cloth_path")
+    clothing_category = data.get("clothing_category", "Upper body")  # Default to "Upper body" if not provided
+    params = {name: data[name] for name in TRYON_PARAM_NAMES if data.get(name) is not None}
+    
+    # Validate inputs
+    if not model_path:
+        raise HTTPException(status_code=400, detail="Model path is required")
+    
+    if not cloth_path:
+        raise HTTPException(status_code=400, detail="Cloth path is required")
+    
+    return model_path, cloth_path, clothing_category, params
+
+async def submit_tryon_job(model_path: str, cloth_path: str, clothing_category: str, params: dict,
+                           budget: Optional[deadline.Budget] = None, detached: bool = False):
+    """
+    Queue a try-on on the job workers; the job result is {"result": <result filename>}.
+    
+    Identical try-ons (same image contents, category and parameters) submitted while
+    one is already queued or running share that job instead of calling Segmind again.
+    The job gets the current request's deadline unless a budget is given, and is
+    cancelled when every request waiting on it has gone, unless detached.
+    """
+    def run():
+        result_path = process_tryon(model_path, cloth_path, True, clothing_category, params)
+        return {"result": os.path.basename(result_path)}
+    
+    def tryon_key():
+        # Inputs are usually blob keys; hash the local copies
+        return make_tryon_key(blob_store.store.localize(model_path), blob_store.store.localize(cloth_path),
+                              clothing_category, params)
+    
+    key = None
+    if COALESCE_ENABLED:
+        try:
+            key = await disk_pool.run(tryon_key)
+        except (OSError, BulkheadFull) as e:
+            # Missing files fail inside the job as before; a busy disk pool just skips coalescing
+            logger.debug(f"Not coalescing try-on: {str(e)}")
+    
     try:
-        file_path = f"uploads/clothes/{uuid.uuid4()}_{file.filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        return {"filename": file_path}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        return job_queue.submit("tryon", run, key=key, budget=budget or deadline.current(), detached=detached)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+def job_failure(job, error_prefix: str = "") -> HTTPException:
+    """
+    The error response for a failed job: 503 with Retry-After if Segmind was unavailable,
+    504 if the request deadline passed, 499 if it was cancelled, otherwise 500.
+    """
+    if job.retry_after is not None:
+        return HTTPException(status_code=503, detail=f"{error_prefix}{job.error}",
+                             headers={"Retry-After": str(math.ceil(job.retry_after))})
+    if job.status == CANCELLED:
+        return HTTPException(status_code=deadline.CLIENT_CLOSED_REQUEST, detail=f"{error_prefix}{job.error}")
+    return HTTPException(status_code=job.error_status or 500, detail=f"{error_prefix}{job.error}")
+
+def wants_event_stream(request: Request) -> bool:
+    """Whether the client asked for server-sent progress events instead of a single JSON response."""
+    return "text/event-stream" in request.headers.get("accept", "")
+
+def event_stream_response(events: AsyncIterator[str]) -> StreamingResponse:
+    # no-cache and X-Accel-Buffering keep proxies from holding events back
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def job_events(job, format_result: Callable[[Any], Any] = lambda result: result,
+                     error_prefix: str = "") -> AsyncIterator[str]:
+    """
+    Server-sent events for a job: a "progress" event per stage (queued, encoding, upstream_submitted,
+    upstream_complete, saved), then a "result" event with the response body or an "error" event.
+    """
+    sent = 0
+    snapshot = job.to_dict()
+    async for snapshot in job_queue.stream(job):
+        stages = snapshot["stages"]
+        if len(stages) == sent and snapshot["status"] not in TERMINAL_STATES:
+            yield progress.SSE_HEARTBEAT
+        for stage in stages[sent:]:
+            yield progress.sse_event("progress", stage)
+        sent = len(stages)
+    if snapshot["status"] == SUCCEEDED:
+        yield progress.sse_event("result", format_result(snapshot["result"]))
+    elif snapshot.get("retry_after") is not None:
+        yield progress.sse_event("error", {"status_code": 503, "detail": f"{error_prefix}{snapshot['error']}",
+                                           "retry_after": math.ceil(snapshot["retry_after"])})
+    else:
+        status_code = deadline.CLIENT_CLOSED_REQUEST if snapshot["status"] == CANCELLED else snapshot.get("error_status") or 500
+        yield progress.sse_event("error", {"status_code": status_code, "detail": f"{error_prefix}{snapshot['error']}"})
+
+async def progress_events(work: Callable[[], Awaitable[Any]]) -> AsyncIterator[str]:
+    """
+    Run work with its progress reported to this stream: a "progress" event per stage reached,
+    then a "result" event with the response body or an "error" event with the status code and detail.
+    """
+    tracker = progress.Progress()
+    with progress.reporting_to(tracker):
+        task = asyncio.ensure_future(work())
+    task.add_done_callback(lambda _: tracker.finish())
+    try:
+        async for stage in tracker.follow():
+            yield progress.SSE_HEARTBEAT if stage is None else progress.sse_event("progress", stage)
+        try:
+            result = await task
+        except HTTPException as e:
+            yield progress.sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+            return
+        except Exception as e:
+            yield progress.sse_event("error", {"status_code": 500, "detail": str(e)})
+            return
+        yield progress.sse_event("result", result)
+    finally:
+        # Client went away: stop work nobody is waiting for (coalesced work continues for the others)
+        task.cancel()
 
 @app.post("/api/tryon")
 async def virtual_tryon(
@@ -244,52 +526,197 @@ async def virtual_tryon(
     - cloth_path: Path to the cloth image
     - use_segmind: Whether to use the Segmind API (always enforced to true)
     - clothing_category: Category of clothing (optional, default: "Upper body")
+    - num_inference_steps, guidance_scale, seed: Pinned inference parameters (optional)
+    
+    Identical requests are answered from the result cache. The work runs on the
+    shared job workers; use /api/jobs/tryon to avoid holding the connection open.
+    With "Accept: text/event-stream" the response is a stream of progress events
+    ending in a "result" (or "error") event instead.
     """
     try:
         # Get request data from JSON body
         data = await request.json()
-        
-        model_path = data.get("model_path")
-        cloth_path = data.get("cloth_path")
-        clothing_category = data.get("clothing_category", "Upper body")  # Default to "Upper body" if not provided
-        
-        # Validate inputs
-        if not model_path:
-            raise HTTPException(status_code=400, detail="Model path is required")
-        
-        if not cloth_path:
-            raise HTTPException(status_code=400, detail="Cloth path is required")
+        model_path, cloth_path, clothing_category, params = parse_tryon_request(data)
         
         logger.info(f"Processing try-on: model={model_path}, cloth={cloth_path}, category={clothing_category}")
         
-        # Process the try-on request with Segmind only
-        try:
-            # Use a separate thread to avoid blocking the server
-            loop = asyncio.get_event_loop()
-            result_path = await loop.run_in_executor(
-                None, 
-                lambda: process_tryon(model_path, cloth_path, True, clothing_category)
-            )
-            
-            # Return the result file
-            result_file = os.path.basename(result_path)
-            
-            logger.info(f"Try-on complete, returning result: {result_file}")
-            return {"result": result_file}
-            
-        except Exception as e:
-            logger.error(f"Error processing try-on with Segmind: {str(e)}")
+        # Process the try-on request with Segmind only, on the bounded job workers
+        job = await submit_tryon_job(model_path, cloth_path, clothing_category, params)
+        if wants_event_stream(request):
+            return event_stream_response(job_events(job, error_prefix="Segmind API error: "))
+        await job_queue.wait(job)
+        
+        if job.status != SUCCEEDED:
+            logger.error(f"Error processing try-on with Segmind: {job.error}")
             # Instead of falling back, raise the error
-            raise HTTPException(status_code=500, detail=f"Segmind API error: {str(e)}")
+            raise job_failure(job, "Segmind API error: ")
+        
+        logger.info(f"Try-on complete, returning result: {job.result['result']}")
+        return job.result
             
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error processing try-on request: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.error(f"Error processing try-on request: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+def resolve_upload_ref(kind: str, ref: str) -> str:
+    """Resolve an upload reference (a path or a content id from /api/upload/*) to a blob key or path."""
+    if re.fullmatch(r"[0-9a-f]{64}", ref):
+        for name, _, _ in blob_store.store.list(f"uploads/{kind}", ref):
+            if not name.endswith(NORMALIZED_SUFFIX):
+                return make_key(f"uploads/{kind}", name)
+    return ref
+
+def resolve_upload_refs(kind: str, refs: List[str]) -> Dict[str, str]:
+    """Resolve each distinct upload reference once; lists the store, so run it off the event loop."""
+    return {ref: resolve_upload_ref(kind, ref) for ref in dict.fromkeys(refs)}
+
+@app.post("/api/tryon/batch")
+async def batch_tryon(request: Request):
+    """
+    Render every garment on every model and stream results as NDJSON as they finish.
+    
+    This endpoint accepts a JSON body with the following parameters:
+    - models: List of model image paths or content ids
+    - clothes: List of cloth image paths or content ids
+    - categories: One category per cloth, or a single category for all (default: "Upper body")
+    - concurrency: Maximum try-ons in flight for this batch (optional, capped by TRYON_BATCH_CONCURRENCY)
+    - num_inference_steps, guidance_scale, seed: Pinned inference parameters (optional)
+    
+    Each line is one item with its index, inputs, status and result or error;
+    the final line is a summary.
+    """
+    data = await request.json()
+    models = data.get("models") or []
+    clothes = data.get("clothes") or []
+    categories = data.get("categories", "Upper body")
+    params = {name: data[name] for name in TRYON_PARAM_NAMES if data.get(name) is not None}
+    
+    if not isinstance(models, list) or not isinstance(clothes, list) or not models or not clothes:
+        raise HTTPException(status_code=400, detail="models and clothes must be non-empty lists")
+    if isinstance(categories, str):
+        categories = [categories] * len(clothes)
+    if len(categories) != len(clothes):
+        raise HTTPException(status_code=400, detail="categories must be a string or have one entry per cloth")
+    if len(models) * len(clothes) > TRYON_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {TRYON_BATCH_MAX_ITEMS} try-ons")
+    
+    if not all(isinstance(ref, str) for ref in models + clothes):
+        raise HTTPException(status_code=400, detail="models and clothes must be lists of paths or content ids")
+    try:
+        concurrency = int(data.get("concurrency") or TRYON_BATCH_CONCURRENCY)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="concurrency must be an integer")
+    concurrency = max(1, min(concurrency, TRYON_BATCH_CONCURRENCY))
+    
+    # Look each distinct ref up once; remote stores list over the network, so use the pool sized for that
+    try:
+        model_refs, cloth_refs = await asyncio.gather(blob_pool().run(resolve_upload_refs, "models", models),
+                                                      blob_pool().run(resolve_upload_refs, "clothes", clothes))
+    except BulkheadFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    items = [
+        (model_refs[model], cloth_refs[cloth], category)
+        for model in models
+        for cloth, category in zip(clothes, categories)
+    ]
+    logger.info(f"Batch try-on: {len(items)} items at concurrency {concurrency}")
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def run_item(index, model_path, cloth_path, category):
+        line = {"index": index, "model_path": model_path, "cloth_path": cloth_path, "clothing_category": category}
+        async with semaphore:
+            started = time.time()
+            try:
+                # Items are bounded by the batch size, not the request deadline; a disconnect still cancels them
+                job = await submit_tryon_job(model_path, cloth_path, category, params, budget=deadline.Budget())
+                await job_queue.wait(job)
+                if job.status == SUCCEEDED:
+                    line.update(status="succeeded", result=job.result["result"])
+                else:
+                    line.update(status="failed", error=job.error)
+            except HTTPException as e:
+                line.update(status="failed", error=e.detail)
+            line["elapsed_seconds"] = round(time.time() - started, 3)
+        return line
+    
+    async def results():
+        tasks = [asyncio.create_task(run_item(i, *item)) for i, item in enumerate(items)]
+        succeeded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                succeeded += line["status"] == "succeeded"
+                yield json.dumps(line) + "\n"
+            yield json.dumps({"done": True, "total": len(items), "succeeded": succeeded,
+                              "failed": len(items) - succeeded}) + "\n"
+        finally:
+            # Client went away or the batch finished: don't start anything that is still waiting
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.post("/api/jobs/tryon", status_code=202)
+async def submit_tryon(request: Request) -> dict:
+    """
+    Queue a virtual try-on and return its job id immediately.
+    
+    Accepts the same JSON body as /api/tryon. Poll /api/jobs/{job_id} or follow
+    /api/jobs/{job_id}/stream for the result.
+    """
+    data = await request.json()
+    model_path, cloth_path, clothing_category, params = parse_tryon_request(data)
+    
+    # Polled later, so neither this request's deadline nor its disconnect applies
+    job = await submit_tryon_job(model_path, cloth_path, clothing_category, params,
+                                 budget=deadline.Budget(), detached=True)
+    logger.info(f"Queued try-on job {job.id}: model={model_path}, cloth={cloth_path}, category={clothing_category}")
+    
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "stream_url": f"/api/jobs/{job.id}/stream",
+        "events_url": f"/api/jobs/{job.id}/events"
+    }
+
+@app.get("/api/jobs/stats")
+async def get_job_stats():
+    """Report job queue depth, running jobs and wait/run times."""
+    return job_queue.stats()
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get the status (and result, once finished) of a queued job."""
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}/stream")
+async def stream_job(job_id: str):
+    """Stream job status changes as newline-delimited JSON until the job finishes."""
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def events():
+        async for snapshot in job_queue.stream(job):
+            yield json.dumps(snapshot) + "\n"
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_progress_events(job_id: str):
+    """Stream a job's progress stages as server-sent events (for EventSource), ending with its result."""
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return event_stream_response(job_events(job))
+
 async def call_with_advanced_identity(model_path, cloth_path, category, request_id):
     """Make a direct call to Segmind API with an advanced identity rotation technique."""
     # Get API key
@@ -303,12 +730,12 @@ async def call_with_advanced_identity(model_path, cloth_path, category, request_
             return base64.b64encode(image_file.read()).decode('utf-8')
     
     # Convert images in parallel for efficiency
-    loop = asyncio.get_event_loop()
-    model_image_b64 = await loop.run_in_executor(None, lambda: encode_image(model_path))
-    cloth_image_b64 = await loop.run_in_executor(None, lambda: encode_image(cloth_path))
+    model_image_b64, cloth_image_b64 = await asyncio.gather(
+        disk_pool.run(encode_image, model_path), disk_pool.run(encode_image, cloth_path)
+    )
     
     # Segmind API endpoint
-    url = "https://api.segmind.com/v1/try-on-diffusion"
+    url = SEGMIND_TRYON_URL
     
     # Randomize all request parameters to appear unique
     seed = random.randint(10000, 99999)
@@ -393,43 +820,118 @@ async def call_with_advanced_identity(model_path, cloth_path, category, request_
     # Add randomized delay to appear more human-like
     await asyncio.sleep(random.uniform(0.1, 0.5))
     
-    # Make request with advanced identity
-    timeout = aiohttp.ClientTimeout(total=300)
-    async with aiohttp.ClientSession(headers=headers, cookies=cookies) as session:
-        async with session.post(url, json=data, timeout=timeout) as response:
-            logger.info(f"Advanced identity call status: {response.status}")
-            
-            if response.status == 200:
-                # Success - save the result image
-                result_path = f"results/advanced_{uuid.uuid4()}.png"
-                image_data = await response.read()
-                
-                with open(result_path, "wb") as image_file:
-                    image_file.write(image_data)
-                
-                logger.info(f"Advanced identity processing complete, result saved to {result_path}")
-                return result_path
-            else:
-                # Error response
-                error_text = await response.text()
-                logger.error(f"Advanced identity call error: {response.status} - {error_text}")
-                raise Exception(f"Advanced identity API error: {response.status} - {error_text}")
+    # Make request with advanced identity over the shared connection pool
+    response = await http_client.request("POST", url, json=data, headers=headers, cookies=cookies, timeout=300,
+                                         guard=upstream_guard.segmind)
+    logger.info(f"Advanced identity call status: {response.status_code}")
+    
+    if response.status_code == 200:
+        # Success - save the result image
+        result_path = blob_store.store.put_bytes(f"results/advanced_{uuid.uuid4()}.png", response.content)
+        
+        logger.info(f"Advanced identity processing complete, result saved to {result_path}")
+        return result_path
+    else:
+        # Error response
+        error_text = response.text
+        logger.error(f"Advanced identity call error: {response.status_code} - {error_text}")
+        raise Exception(f"Advanced identity API error: {response.status_code} - {error_text}")
+
+def blob_pool():
+    """The pool for blocking blob store calls: disk I/O locally, network round trips for remote stores."""
+    return disk_pool if blob_store.store.backend == "local" else upstream_pool
+
+async def local_blob(key: str) -> Optional[str]:
+    """
+    Return a local path for a stored blob, or None
+    
+    Store calls from request handlers go through a pool; the local backend here is the one deliberate
+    exception. Its lookup is a stat or two of a file served next anyway, cheaper than a pool hand-off.
+    """
+    if blob_store.store.backend == "local":
+        return blob_store.store.local_path(key)
+    # Remote stores download a local copy on first access
+    return await upstream_pool.run(blob_store.store.local_path, key)
+
+def is_stale(derived_path: str, source_path: str) -> bool:
+    """Whether a derived file predates its source (the source was regenerated under the same name since)."""
+    try:
+        return os.stat(derived_path).st_mtime_ns < os.stat(source_path).st_mtime_ns
+    except OSError:
+        return True
+
+async def image_variant(namespace: str, filename: str, source_path: str, width: Optional[int],
+                        fmt: Optional[str]) -> Optional[str]:
+    """
+    Return a resized/re-encoded variant of a stored image, encoding and storing it on first request
+    (and again whenever the source is newer than the stored variant)
+
+    Returns:
+        Local path of the variant, or None to serve the original (already that size and format,
+        undecodable, or the pools are saturated)
+    """
+    key = make_key(namespace, variant_name(filename, width, fmt))
+    existing = await local_blob(key)
+    if existing and not is_stale(existing, source_path):
+        return existing
+
+    async def render():
+        content, changed = await cpu_pool.run(render_variant, source_path, width, fmt)
+        if not changed:
+            return None
+        path = await disk_pool.run(blob_store.store.put_bytes, key, content)
+        logger.info(f"Stored image variant {key} ({len(content)} bytes)")
+        return path
+
+    try:
+        return await variant_flight.do(key, render)
+    except BulkheadFull:
+        logger.warning(f"Pools busy; serving {filename} without the requested variant")
+        return None
+    except OSError as e:
+        logger.warning(f"Could not render variant {key}: {str(e)}")
+        return None
+
+async def serve_blob(request: Request, namespace: str, filename: str, detail: str = "Image not found",
+                     width: Optional[int] = None, variants: bool = False):
+    """
+    Serve a stored file by name (with ETag, Cache-Control, 304 and Range support)
+
+    With variants=True the image is re-encoded to WebP/JPEG when the Accept header prefers it
+    and downscaled to the nearest configured width at or above ?w=.
+    """
+    try:
+        key = make_key(namespace, filename)
+    except ValueError:
+        raise HTTPException(status_code=404, detail=detail)
+    file_path = await local_blob(key)
+    if not file_path:
+        raise HTTPException(status_code=404, detail=detail)
+    if not variants:
+        return await cached_file_response(request, file_path)
+
+    fmt = negotiate_format(request.headers.get("accept"), filename)
+    width = snap_width(width)
+    if fmt or width:
+        variant_path = await image_variant(namespace, filename, file_path, width, fmt)
+        if variant_path:
+            return await cached_file_response(request, variant_path, media_type=media_type_for(variant_path), vary="Accept")
+    return await cached_file_response(request, file_path, vary="Accept")
 
 @app.get("/api/result/{filename}")
-async def get_result(filename: str):
-    """Get a result image."""
-    file_path = f"results/{filename}"
-    if os.path.exists(file_path):
-        return FileResponse(file_path)
-    raise HTTPException(status_code=404, detail="Image not found")
+async def get_result(filename: str, request: Request, w: Optional[int] = Query(None, gt=0)):
+    """Get a result image, optionally resized (?w=) and re-encoded per the Accept header."""
+    return await serve_blob(request, "results", filename, width=w, variants=True)
+
+UPLOAD_FOLDER = re.compile(r"[A-Za-z0-9_-]+")
 
 @app.get("/uploads/{folder}/{filename}")
-async def get_upload(folder: str, filename: str):
-    """Get an uploaded file."""
-    file_path = f"uploads/{folder}/{filename}"
-    if os.path.exists(file_path):
-        return FileResponse(file_path)
-    raise HTTPException(status_code=404, detail="File not found")
+async def get_upload(folder: str, filename: str, request: Request):
+    """Get an uploaded file (with ETag, Cache-Control, 304 and Range support)."""
+    # One plain directory name only: "%2E%2E" arrives here decoded as ".." and must not reach the store root
+    if not UPLOAD_FOLDER.fullmatch(folder):
+        raise HTTPException(status_code=404, detail="File not found")
+    return await serve_blob(request, f"uploads/{folder}", filename, detail="File not found")
 
 @app.post("/api/proxy/segmind")
 async def proxy_segmind_api(
@@ -442,6 +944,9 @@ async def proxy_segmind_api(
     Uses aggressive identity rotation to bypass rate limits completely.
     """
     try:
+        model_path = blob_store.store.localize(model_path)
+        cloth_path = blob_store.store.localize(cloth_path)
+        
         # Check if files exist
         if not os.path.exists(model_path):
             raise HTTPException(status_code=400, detail=f"Model image not found at {model_path}")
@@ -466,7 +971,7 @@ async def proxy_segmind_api(
         cloth_image_b64 = encode_image(cloth_path)
         
         # Prepare API request with randomized parameters to appear unique
-        url = "https://api.segmind.com/v1/try-on-diffusion"
+        url = SEGMIND_TRYON_URL
         
         data = {
             "model_image": model_image_b64,
@@ -597,80 +1102,76 @@ async def proxy_segmind_api(
         # Slight delay to avoid request throttling patterns (randomized to seem more natural)
         await asyncio.sleep(random.uniform(0.1, 0.5))
         
-        # Make API request with unique identity
-        async with aiohttp.ClientSession() as session:
-            try:
-                timeout = aiohttp.ClientTimeout(total=300)
-                async with session.post(url, json=data, headers=headers, cookies=cookies, timeout=timeout) as response:
-                    logger.info(f"Segmind API response status: {response.status}")
+        # Make API request with unique identity over the shared connection pool
+        try:
+            response = await http_client.request("POST", url, json=data, headers=headers, cookies=cookies, timeout=300,
+                                                 guard=upstream_guard.segmind)
+            logger.info(f"Segmind API response status: {response.status_code}")
+            
+            if response.status_code == 200:
+                # Success - save the result image
+                result_path = blob_store.store.put_bytes(f"results/proxy_{uuid.uuid4()}.png", response.content)
+                
+                return {"result": os.path.basename(result_path)}
+            elif response.status_code == 429:
+                # If we still hit rate limit, make another immediate attempt with totally different identity
+                logger.warning("Rate limit hit with proxy. Trying with completely different identity...")
+                
+                # Generate totally new identity and request
+                new_user_agent = generate_browser_fingerprint()
+                new_ip = f"{random.randint(10, 200)}.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}"
+                new_request_id = f"{uuid.uuid4().hex}-{int(time.time()+1)}-{random.randint(1000, 9999)}"
+                new_timestamp = str(int(time.time() * 1000) + random.randint(1000, 5000))
+                
+                # Completely new headers
+                new_headers = headers.copy()
+                new_headers.update({
+                    'User-Agent': new_user_agent,
+                    'X-Client-ID': new_request_id,
+                    'X-Request-ID': str(uuid.uuid4()),
+                    'X-Timestamp': new_timestamp,
+                    'X-Nonce': hashlib.sha256(f"{new_request_id}{new_timestamp}".encode()).hexdigest(),
+                    'X-Forwarded-For': new_ip,
+                    'Origin': random.choice(origins),
+                    'Referer': random.choice(referrers)
+                })
+                
+                # Slightly modify the request parameters
+                new_data = data.copy()
+                new_data.update({
+                    "num_inference_steps": random.randint(30, 40),
+                    "guidance_scale": round(random.uniform(1.8, 2.2), 2),
+                    "seed": random.randint(10000, 99999),
+                })
+                
+                # Immediate retry with completely different identity
+                retry_response = await http_client.request("POST", url, json=new_data, headers=new_headers, timeout=300,
+                                                           guard=upstream_guard.segmind)
+                logger.info(f"Retry response status: {retry_response.status_code}")
+                
+                if retry_response.status_code == 200:
+                    # Success - save the result image
+                    result_path = blob_store.store.put_bytes(f"results/proxy_{uuid.uuid4()}.png", retry_response.content)
                     
-                    if response.status == 200:
-                        # Success - save the result image
-                        result_path = f"results/proxy_{uuid.uuid4()}.png"
-                        image_data = await response.read()
-                        
-                        with open(result_path, "wb") as image_file:
-                            image_file.write(image_data)
-                        
-                        return {"result": os.path.basename(result_path)}
-                    elif response.status == 429:
-                        # If we still hit rate limit, make another immediate attempt with totally different identity
-                        logger.warning("Rate limit hit with proxy. Trying with completely different identity...")
-                        
-                        # Generate totally new identity and request
-                        new_user_agent = generate_browser_fingerprint()
-                        new_ip = f"{random.randint(10, 200)}.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}"
-                        new_request_id = f"{uuid.uuid4().hex}-{int(time.time()+1)}-{random.randint(1000, 9999)}"
-                        new_timestamp = str(int(time.time() * 1000) + random.randint(1000, 5000))
-                        
-                        # Completely new headers
-                        new_headers = headers.copy()
-                        new_headers.update({
-                            'User-Agent': new_user_agent,
-                            'X-Client-ID': new_request_id,
-                            'X-Request-ID': str(uuid.uuid4()),
-                            'X-Timestamp': new_timestamp,
-                            'X-Nonce': hashlib.sha256(f"{new_request_id}{new_timestamp}".encode()).hexdigest(),
-                            'X-Forwarded-For': new_ip,
-                            'Origin': random.choice(origins),
-                            'Referer': random.choice(referrers)
-                        })
-                        
-                        # Slightly modify the request parameters
-                        new_data = data.copy()
-                        new_data.update({
-                            "num_inference_steps": random.randint(30, 40),
-                            "guidance_scale": round(random.uniform(1.8, 2.2), 2),
-                            "seed": random.randint(10000, 99999),
-                        })
-                        
-                        # Immediate retry with completely different identity
-                        async with aiohttp.ClientSession() as new_session:
-                            async with new_session.post(url, json=new_data, headers=new_headers, timeout=timeout) as retry_response:
-                                logger.info(f"Retry response status: {retry_response.status}")
-                                
-                                if retry_response.status == 200:
-                                    # Success - save the result image
-                                    result_path = f"results/proxy_{uuid.uuid4()}.png"
-                                    image_data = await retry_response.read()
-                                    
-                                    with open(result_path, "wb") as image_file:
-                                        image_file.write(image_data)
-                                    
-                                    return {"result": os.path.basename(result_path)}
-                                else:
-                                    # Still failed
-                                    error_content = await retry_response.text()
-                                    logger.error(f"Segmind API retry error: {retry_response.status} - {error_content}")
-                                    raise HTTPException(status_code=retry_response.status, detail=f"API error on retry: {error_content}")
-                    else:
-                        # Error response
-                        error_content = await response.text()
-                        logger.error(f"Segmind API error: {response.status} - {error_content}")
-                        raise HTTPException(status_code=response.status, detail=f"API error: {error_content}")
-            except aiohttp.ClientError as e:
-                logger.error(f"Connection error: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"Connection error: {str(e)}")
+                    return {"result": os.path.basename(result_path)}
+                else:
+                    # Still failed
+                    error_content = retry_response.text
+                    logger.error(f"Segmind API retry error: {retry_response.status_code} - {error_content}")
+                    raise HTTPException(status_code=retry_response.status_code, detail=f"API error on retry: {error_content}")
+            else:
+                # Error response
+                error_content = response.text
+                logger.error(f"Segmind API error: {response.status_code} - {error_content}")
+                raise HTTPException(status_code=response.status_code, detail=f"API error: {error_content}")
+        except http_client.UpstreamError as e:
+            logger.error(f"Connection error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Connection error: {str(e)}")
+        except UpstreamUnavailable as e:
+            logger.warning(f"Segmind unavailable: {str(e)}")
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+        except deadline.DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
@@ -679,15 +1180,51 @@ async def proxy_segmind_api(
 
 @app.get("/api/segmind/status")
 async def check_segmind_status():
-    """Check if the Segmind API is available and properly configured."""
+    """Check if Segmind calls are going through, with the upstream guard's concurrency limit and circuit state."""
+    guard = upstream_guard.segmind.stats()
+    if guard["circuit"] == upstream_guard.OPEN:
+        return {"available": False, "message": "Segmind is failing; calls are paused until it recovers", "guard": guard}
+    return {"available": True, "message": "API is available", "guard": guard}
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Report hit/miss counters and disk usage of the try-on result cache."""
+    return {"enabled": RESULT_CACHE_ENABLED, "tryon": result_cache.stats(),
+            "prompt_enabled": PROMPT_CACHE_ENABLED, "prompt": prompt_cache.stats()}
+
+def require_admin(request: Request):
+    """
+    Reject admin requests without the configured X-Admin-Token
+
+    Without ADMIN_TOKEN, admin endpoints are closed unless ADMIN_ALLOW_UNAUTHENTICATED=true (for local development).
+    """
+    token = os.environ.get("ADMIN_TOKEN")
+    if not token:
+        if os.environ.get("ADMIN_ALLOW_UNAUTHENTICATED", "False").lower() in ("1", "true", "yes"):
+            return
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled: set ADMIN_TOKEN")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", "").encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get("/api/admin/storage")
+async def get_storage_stats(request: Request):
+    """Report disk usage, quotas and evictions per storage directory as of the last janitor sweep."""
+    require_admin(request)
+    return janitor.stats()
+
+@app.post("/api/admin/storage/sweep")
+async def sweep_storage(request: Request, directory: Optional[str] = Query(None)):
+    """Run the storage janitor now, for one directory or all of them."""
+    require_admin(request)
+    if directory is not None and directory not in janitor.policies:
+        raise HTTPException(status_code=404, detail=f"Unknown storage directory: {directory}")
     try:
-        # Always report as available
-        logger.info("Segmind API status check - forced to available")
-        return {"available": True, "message": "API is available"}
-    except Exception as e:
-        logger.error(f"Error in status check: {str(e)}")
-        # Even if there's an error, report as available
-        return {"available": True, "message": "API is available"}
+        evicted = await disk_pool.run(janitor.sweep, [directory] if directory else None)
+    except BulkheadFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    if evicted is None:
+        raise HTTPException(status_code=409, detail="A sweep is already running", headers={"Retry-After": "5"})
+    return {"evicted": evicted, **janitor.stats()}
 
 # Add a root endpoint for testing
 @app.get("/")
@@ -698,19 +1235,119 @@ async def root():
 # New model for text-to-clothing requests
 class TextToClothingRequest(BaseModel):
     prompt: str
+    seed: Optional[int] = None  # pin for a reproducible image
+
+TXT2IMG_URL = f"{SEGMIND_API_BASE}/sdxl1.0-txt2img"
+
+def store_generated_image(content: bytes, filename_prefix: str, cache_key: Optional[str] = None) -> str:
+    """Store a generated image under generated/, moving it into the prompt cache when keyed."""
+    timestamp = int(time.time())
+    random_suffix = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
+    image_path = blob_store.store.put_bytes(f"generated/{filename_prefix}_{timestamp}_{random_suffix}.png", content)
+    
+    if cache_key:
+        image_path = prompt_cache.put(cache_key, image_path)
+    return image_path
+
+async def generate_txt2img(api_key: str, prompt: str, negative_prompt: str, filename_prefix: str,
+                           seed: Optional[int] = None, style: str = "base",
+                           width: int = 1024, height: int = 1024) -> tuple:
+    """
+    Generate an image with Segmind SDXL, serving repeat prompts from the prompt cache when it is enabled
+    
+    Args:
+        api_key: Segmind API key
+        prompt: Prompt sent to the model
+        negative_prompt: Negative prompt sent to the model
+        filename_prefix: Prefix for the saved file when the cache is off
+        seed: Pinned seed; a random one is used when None
+        style: Model style preset
+        width: Image width in pixels
+        height: Image height in pixels
+    
+    Returns:
+        (path of the image under generated/, whether it came from the cache)
+    
+    Raises:
+        Exception: If the Segmind request fails
+    """
+    cache_key = None
+    if PROMPT_CACHE_ENABLED:
+        cache_key = make_prompt_key(prompt, negative_prompt, style, width, height, seed)
+        try:
+            # Stats and maybe downloads the entry; a round trip with remote stores
+            cached_path = await blob_pool().run(prompt_cache.get, cache_key)
+        except BulkheadFull:
+            logging.warning("Pools busy; skipping the prompt cache lookup")
+            cached_path = None
+        if cached_path:
+            logging.info(f"Prompt cache hit, returning {cached_path}")
+            progress.report(progress.SAVED, cached=True)
+            return cached_path, True
+    
+    headers = {
+        "x-api-key": api_key,
+        "Content-Type": "application/json"
+    }
+    
+    payload = {
+        "prompt": prompt,
+        "negative_prompt": negative_prompt,
+        "style": style,
+        "samples": 1,
+        "scheduler": "UniPC",
+        "num_inference_steps": 25,
+        "guidance_scale": 7.5,
+        "strength": 1,
+        "high_noise_frac": 0.8,
+        "seed": seed if seed is not None else random.randint(1, 2147483647),
+        "img_width": width,
+        "img_height": height,
+        "base64": False
+    }
+    
+    logging.info(f"Making request to Segmind API with prompt: {prompt}")
+    
+    # Make the API request without blocking the event loop
+    progress.report(progress.UPSTREAM_SUBMITTED)
+    response = await http_client.request("POST", TXT2IMG_URL, headers=headers, json=payload, timeout=120,
+                                         guard=upstream_guard.segmind)
+    
+    if response.status_code != 200:
+        logging.error(f"Segmind API request failed with status {response.status_code}: {response.text}")
+        raise Exception(f"Segmind API request failed with status {response.status_code}")
+    progress.report(progress.UPSTREAM_COMPLETE)
+    
+    # Writes the image and moves it into the prompt cache (uploads to remote stores)
+    image_path = await blob_pool().run(store_generated_image, response.content, filename_prefix, cache_key)
+    progress.report(progress.SAVED)
+    return image_path, False
 
 # Add new endpoints for text-to-clothing feature
 @app.post("/api/generate-clothing")
-async def generate_clothing(request: TextToClothingRequest):
+async def generate_clothing(request: TextToClothingRequest, http_request: Request):
     """
     Generate clothing image from text description using Segmind API
+    
+    Concurrent requests for the same prompt (ignoring case and spacing) and seed share one
+    generation; with PROMPT_CACHE_ENABLED, repeats are served from generated/.
+    With "Accept: text/event-stream" the response is a stream of progress events ending in
+    a "result" (or "error") event.
     """
+    key = f"{normalize_prompt(request.prompt)}\0{request.seed}"
+    generate = lambda: clothing_flight.do(key, lambda: generate_clothing_image(request.prompt, request.seed))
+    if wants_event_stream(http_request):
+        return event_stream_response(progress_events(generate))
+    return await generate()
+
+async def generate_clothing_image(prompt: str, seed: Optional[int] = None) -> dict:
+    """Generate one clothing image from a text prompt, falling back to a local rendering."""
     try:
         # Log the request
-        logging.info(f"Generating clothing from text prompt: {request.prompt}")
+        logging.info(f"Generating clothing from text prompt: {prompt}")
         
         # Enhance the prompt for better clothing generation
-        enhanced_prompt = f"Highly detailed isolated clothing item on a plain white background, professional product photo: {request.prompt}"
+        enhanced_prompt = f"Highly detailed isolated clothing item on a plain white background, professional product photo: {prompt}"
         negative_prompt = "person, model, mannequin, watermark, logo, text, blurry, low quality"
         
         # Get Segmind API key
@@ -719,158 +1356,43 @@ async def generate_clothing(request: TextToClothingRequest):
             raise HTTPException(status_code=500, detail="Segmind API key not configured")
         
         try:
-            # Use Segmind API for text-to-image generation
-            api_url = "https://api.segmind.com/v1/sdxl1.0-txt2img"
+            # Use Segmind API for text-to-image generation (or the prompt cache)
+            image_path, cached = await generate_txt2img(api_key, enhanced_prompt, negative_prompt,
+                                                        "generated_clothing", seed=seed)
             
-            headers = {
-                "x-api-key": api_key,
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "prompt": enhanced_prompt,
-                "negative_prompt": negative_prompt,
-                "style": "base",
-                "samples": 1,
-                "scheduler": "UniPC",
-                "num_inference_steps": 25,
-                "guidance_scale": 7.5,
-                "strength": 1,
-                "high_noise_frac": 0.8,
-                "seed": random.randint(1, 2147483647),
-                "img_width": 1024,
-                "img_height": 1024,
-                "base64": False
-            }
+            logging.info(f"Successfully generated and saved image to {image_path}")
             
-            logging.info(f"Making request to Segmind API with prompt: {enhanced_prompt}")
-            
-            # Make the API request
-            response = requests.post(api_url, headers=headers, json=payload, timeout=120)
-            
-            if response.status_code == 200:
-                # Save the generated image
-                timestamp = int(time.time())
-                random_suffix = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-                filename = f"generated_clothing_{timestamp}_{random_suffix}.png"
-                
-                # Ensure directory exists
-                os.makedirs("generated", exist_ok=True)
-                
-                # Save the image
-                image_path = os.path.join("generated", filename)
-                with open(image_path, "wb") as f:
-                    f.write(response.content)
-                
-                logging.info(f"Successfully generated and saved image to {image_path}")
-                
-                # Return the URL to the generated image
-                image_url = f"/api/generated/{filename}"
-                return {"imageUrl": image_url, "message": "Clothing generated successfully"}
-            else:
-                logging.error(f"Segmind API request failed with status {response.status_code}: {response.text}")
-                raise Exception(f"Segmind API request failed with status {response.status_code}")
+            # Return the URL to the generated image
+            image_url = f"/api/generated/{os.path.basename(image_path)}"
+            return {"imageUrl": image_url, "message": "Clothing generated successfully", "cached": cached}
                 
+        except deadline.DeadlineExceeded as e:
+            # Out of time: a fallback rendering now would arrive after the client stopped waiting
+            raise HTTPException(status_code=504, detail=str(e))
         except Exception as api_error:
-            logging.error(f"Segmind API error: {str(api_error)}")
-            logging.error(traceback.format_exc())
+            logging.error(f"Segmind API error: {str(api_error)}", exc_info=True)
             
             # Fall back to local image generation as last resort
             logging.info("Using local fallback image generation")
             
-            # Create a more visually appealing fallback with clear indication
-            width, height = 768, 768
-            image = Image.new("RGB", (width, height), (30, 30, 50))
-            draw = ImageDraw.Draw(image)
-            
-            # Gradient background for better visual appeal
-            for y in range(height):
-                r = int(30 + (y / height) * 30)
-                g = int(30 + (y / height) * 30)
-                b = int(50 + (y / height) * 50)
-                for x in range(width):
-                    # Add some noise for texture
-                    noise = random.randint(-10, 10)
-                    r_pixel = max(0, min(255, r + noise))
-                    g_pixel = max(0, min(255, g + noise))
-                    b_pixel = max(0, min(255, b + noise))
-                    draw.point((x, y), fill=(r_pixel, g_pixel, b_pixel))
-            
-            # Draw clothing silhouette based on prompt
-            color = get_color_from_prompt(request.prompt)
-            
-            # Draw clothing outline based on type mentioned in prompt
-            prompt_lower = request.prompt.lower()
-            if any(word in prompt_lower for word in ["shirt", "tee", "blouse", "top"]):
-                # T-shirt silhouette
-                draw.rectangle((width//4, height//4, 3*width//4, 3*height//4), fill=color, outline=(255, 255, 255), width=3)
-                draw.rectangle((width//8, height//4, width//4, height//2), fill=color, outline=(255, 255, 255), width=3)
-                draw.rectangle((3*width//4, height//4, 7*width//8, height//2), fill=color, outline=(255, 255, 255), width=3)
-                draw.ellipse((3*width//8, height//6, 5*width//8, height//3), fill=color, outline=(255, 255, 255), width=3)
-            elif any(word in prompt_lower for word in ["dress", "gown"]):
-                # Dress silhouette
-                draw.rectangle((width//3, height//6, 2*width//3, 3*height//4), fill=color, outline=(255, 255, 255), width=3)
-                points = [(width//3, 3*height//4), (width//5, height-height//8), 
-                         (4*width//5, height-height//8), (2*width//3, 3*height//4)]
-                draw.polygon(points, fill=color, outline=(255, 255, 255), width=3)
-            elif any(word in prompt_lower for word in ["pants", "jeans", "trousers"]):
-                # Pants silhouette
-                draw.rectangle((width//3, height//6, 2*width//3, height//4), fill=color, outline=(255, 255, 255), width=3)
-                draw.rectangle((width//3, height//4, width//2-10, 3*height//4), fill=color, outline=(255, 255, 255), width=3)
-                draw.rectangle((width//2+10, height//4, 2*width//3, 3*height//4), fill=color, outline=(255, 255, 255), width=3)
-            else:
-                # Generic clothing item
-                draw.rectangle((width//4, height//4, 3*width//4, 3*height//4), fill=color, outline=(255, 255, 255), width=3)
-            
-            # Add explanatory text about the image being a fallback
-            try:
-                # Try to load a font, falling back gracefully
-                try:
-                    main_font = ImageFont.truetype("arial.ttf", 32)
-                    small_font = ImageFont.truetype("arial.ttf", 20)
-                except IOError:
-                    main_font = ImageFont.load_default()
-                    small_font = ImageFont.load_default()
-                
-                # Add fallback indicator text at the top
-                fallback_text = "FALLBACK VISUALIZATION"
-                text_width = draw.textlength(fallback_text, font=main_font)
-                draw.text(((width - text_width) // 2, 20), fallback_text, fill=(255, 100, 100), font=main_font)
-                
-                # Add the prompt text at the bottom
-                prompt_display = f'"{request.prompt}"'
-                text_width = draw.textlength(prompt_display, font=main_font) 
-                draw.text(((width - text_width) // 2, height - 60), prompt_display, fill=(255, 255, 255), font=main_font)
-                
-                # Add API explanation
-                api_text = "API error occurred - using generated placeholder"
-                text_width = draw.textlength(api_text, font=small_font)
-                draw.text(((width - text_width) // 2, height - 100), api_text, fill=(255, 200, 100), font=small_font)
-                
-            except Exception as text_error:
-                logging.error(f"Error adding text to fallback image: {text_error}")
-            
-            # Save the generated image
             timestamp = int(time.time())
             random_suffix = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
             filename = f"generated_clothing_{timestamp}_{random_suffix}.png"
             
-            # Ensure directory exists
-            os.makedirs("generated", exist_ok=True)
-            
-            # Save the image
-            image_path = os.path.join("generated", filename)
-            image.save(image_path)
+            # Render and save off the event loop
+            image_path = await disk_pool.run(save_fallback_clothing, prompt, f"generated/{filename}")
             
             logging.info(f"Generated fallback clothing image saved to {image_path}")
+            progress.report(progress.SAVED, fallback=True)
             
             # Return the URL to the generated image
             image_url = f"/api/generated/{filename}"
             return {"imageUrl": image_url, "message": "Clothing visualization created (local fallback used)"}
         
     except Exception as e:
-        logging.error(f"Error in generate_clothing: {str(e)}")
-        logging.error(traceback.format_exc())
+        if isinstance(e, HTTPException) and e.status_code == 504:
+            raise
+        logging.error(f"Error in generate_clothing: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 def get_color_from_prompt(prompt):
@@ -898,74 +1420,173 @@ def get_color_from_prompt(prompt):
     # Default color - cyberpunk cyan
     return (0, 242, 255)
 
+FALLBACK_OUTLINE = (255, 255, 255)
+
+@lru_cache(maxsize=4)
+def get_fallback_background(width: int, height: int) -> "np.ndarray":
+    """Noisy vertical gradient behind fallback garments; computed once per size and shared read-only."""
+    import numpy as np
+    rows = np.arange(height, dtype=np.float32)[:, None, None] / height
+    gradient = np.concatenate([30 + rows * 30, 30 + rows * 30, 50 + rows * 50], axis=2).astype(np.int16)
+    # Same noise on every channel for a grey film-grain texture
+    noise = np.random.default_rng(0).integers(-10, 11, size=(height, width, 1), dtype=np.int16)
+    background = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    background.setflags(write=False)
+    return background
+
+@lru_cache(maxsize=1)
+def get_fallback_fonts():
+    """Load the fallback caption fonts once, falling back gracefully."""
+    try:
+        return ImageFont.truetype("arial.ttf", 32), ImageFont.truetype("arial.ttf", 20)
+    except IOError:
+        return ImageFont.load_default(), ImageFont.load_default()
+
+def _draw_box(canvas, box, color):
+    """Filled rectangle with a white outline, box given as (x0, y0, x1, y1)."""
+    import cv2
+    x0, y0, x1, y1 = box
+    cv2.rectangle(canvas, (x0, y0), (x1, y1), color, thickness=-1)
+    cv2.rectangle(canvas, (x0, y0), (x1, y1), FALLBACK_OUTLINE, thickness=3)
+
+def render_fallback_clothing(prompt: str, width: int = 768, height: int = 768) -> Image.Image:
+    """Draw a placeholder garment for a prompt when text-to-image generation is unavailable."""
+    import cv2
+    import numpy as np
+    canvas = get_fallback_background(width, height).copy()
+    
+    # Draw clothing silhouette based on prompt
+    color = get_color_from_prompt(prompt)
+    
+    # Draw clothing outline based on type mentioned in prompt
+    prompt_lower = prompt.lower()
+    if any(word in prompt_lower for word in ["shirt", "tee", "blouse", "top"]):
+        # T-shirt silhouette
+        _draw_box(canvas, (width//4, height//4, 3*width//4, 3*height//4), color)
+        _draw_box(canvas, (width//8, height//4, width//4, height//2), color)
+        _draw_box(canvas, (3*width//4, height//4, 7*width//8, height//2), color)
+        center, axes = (width//2, height//4), (width//8, height//12)
+        cv2.ellipse(canvas, center, axes, 0, 0, 360, color, thickness=-1)
+        cv2.ellipse(canvas, center, axes, 0, 0, 360, FALLBACK_OUTLINE, thickness=3)
+    elif any(word in prompt_lower for word in ["dress", "gown"]):
+        # Dress silhouette
+        _draw_box(canvas, (width//3, height//6, 2*width//3, 3*height//4), color)
+        points = np.array([(width//3, 3*height//4), (width//5, height-height//8),
+                           (4*width//5, height-height//8), (2*width//3, 3*height//4)], dtype=np.int32)
+        cv2.fillPoly(canvas, [points], color)
+        cv2.polylines(canvas, [points], True, FALLBACK_OUTLINE, thickness=3)
+    elif any(word in prompt_lower for word in ["pants", "jeans", "trousers"]):
+        # Pants silhouette
+        _draw_box(canvas, (width//3, height//6, 2*width//3, height//4), color)
+        _draw_box(canvas, (width//3, height//4, width//2-10, 3*height//4), color)
+        _draw_box(canvas, (width//2+10, height//4, 2*width//3, 3*height//4), color)
+    else:
+        # Generic clothing item
+        _draw_box(canvas, (width//4, height//4, 3*width//4, 3*height//4), color)
+    
+    image = Image.fromarray(canvas)
+    
+    # Add explanatory text about the image being a fallback
+    try:
+        draw = ImageDraw.Draw(image)
+        main_font, small_font = get_fallback_fonts()
+        
+        # Add fallback indicator text at the top
+        fallback_text = "FALLBACK VISUALIZATION"
+        text_width = draw.textlength(fallback_text, font=main_font)
+        draw.text(((width - text_width) // 2, 20), fallback_text, fill=(255, 100, 100), font=main_font)
+        
+        # Add the prompt text at the bottom
+        prompt_display = f'"{prompt}"'
+        text_width = draw.textlength(prompt_display, font=main_font)
+        draw.text(((width - text_width) // 2, height - 60), prompt_display, fill=(255, 255, 255), font=main_font)
+        
+        # Add API explanation
+        api_text = "API error occurred - using generated placeholder"
+        text_width = draw.textlength(api_text, font=small_font)
+        draw.text(((width - text_width) // 2, height - 100), api_text, fill=(255, 200, 100), font=small_font)
+        
+    except Exception as text_error:
+        logging.error(f"Error adding text to fallback image: {text_error}")
+    
+    return image
+
+def save_fallback_clothing(prompt: str, key: str) -> str:
+    """Render the fallback garment and store it as a PNG (fast compression; it is a placeholder)."""
+    return blob_store.store.save_image(key, render_fallback_clothing(prompt), compress_level=1)
+
 @app.get("/api/generated/{filename}")
-async def get_generated_image(filename: str):
+async def get_generated_image(filename: str, request: Request, w: Optional[int] = Query(None, gt=0)):
     """
-    Serve generated images
+    Serve generated images, optionally resized (?w=) and re-encoded per the Accept header
     """
-    file_path = os.path.join("generated", filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Image not found")
-    
-    return FileResponse(file_path)
+    return await serve_blob(request, "generated", filename, width=w, variants=True)
 
 @app.post("/api/text-to-tryon")
 async def text_to_tryon(
+    request: Request,
     model: UploadFile = File(...),
     clothingImageUrl: str = Query(...),
     category: str = Query("Upper body")
 ):
     """
     Process a text-to-clothing try-on request
+    
+    With "Accept: text/event-stream" the response is a stream of progress events ending in
+    a "result" (or "error") event.
     """
     try:
         # Save uploaded model image
-        model_id = str(uuid.uuid4())
-        model_filename = f"{model_id}_{model.filename}"
-        model_path = os.path.join("uploads", "models", model_filename)
-        
-        # Ensure directories exist
-        os.makedirs("uploads/models", exist_ok=True)
-        os.makedirs("uploads/clothes", exist_ok=True)
-        
-        # Save the model image
-        with open(model_path, "wb") as f:
-            shutil.copyfileobj(model.file, f)
+        try:
+            model_path = (await ingest_upload(model, "models"))["path"]
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except UnsupportedImage as e:
+            raise HTTPException(status_code=415, detail=str(e))
         
         # Get the clothing image from the URL (which is a local URL)
         # Extract the filename from clothingImageUrl
         cloth_filename = os.path.basename(clothingImageUrl)
         
-        # Construct the full path to the clothing image
-        clothing_full_path = os.path.join("generated", cloth_filename)
+        # Find (or fetch) a local copy of the clothing image
+        try:
+            clothing_full_path = await local_blob(make_key("generated", cloth_filename))
+        except ValueError:
+            clothing_full_path = None
         
-        if not os.path.exists(clothing_full_path):
+        if not clothing_full_path:
             raise HTTPException(status_code=404, detail="Clothing image not found")
         
-        # Copy the clothing image to the uploads/clothes directory
-        cloth_id = str(uuid.uuid4())
-        new_cloth_filename = f"{cloth_id}_{cloth_filename}"
-        cloth_path = os.path.join("uploads", "clothes", new_cloth_filename)
-        
-        shutil.copy(clothing_full_path, cloth_path)
+        # Link the clothing image into the uploads/clothes directory by content (hashes, links and
+        # normalizes the file, and uploads it to remote stores, so keep it off the event loop)
+        cloth_path = (await blob_pool().run(ingest_local_file, clothing_full_path, "clothes"))["path"]
         
         logging.info(f"Processing text-to-tryon with model: {model_path}, cloth: {cloth_path}, category: {category}")
         
-        # Process the virtual try-on using the existing function
-        result_path = process_tryon(model_path, cloth_path, category)
+        # Process the virtual try-on on the shared job workers, like /api/tryon
+        job = await submit_tryon_job(model_path, cloth_path, category, {})
+        
+        def response_body(result):
+            return {
+                "resultUrl": f"/api/result/{result['result']}",
+                "message": "Try-on completed successfully"
+            }
         
-        # Extract just the filename from the result path
-        result_filename = os.path.basename(result_path)
+        if wants_event_stream(request):
+            return event_stream_response(job_events(job, response_body))
+        await job_queue.wait(job)
+        if job.status != SUCCEEDED:
+            raise job_failure(job)
         
         # Return the result
-        return {
-            "resultUrl": f"/api/result/{result_filename}",
-            "message": "Try-on completed successfully"
-        }
+        return response_body(job.result)
         
+    except HTTPException:
+        raise
+    except BulkheadFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
-        logging.error(f"Error in text_to_tryon: {str(e)}")
-        logging.error(traceback.format_exc())
+        logging.error(f"Error in text_to_tryon: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/generate-outfit")
@@ -980,6 +1601,7 @@ async def generate_outfit(request: Request):
         # Extract parameters
         selected_items = data.get("items", [])
         style_preferences = data.get("preferences", {})
+        seed = data.get("seed")  # optional, for a reproducible image
         
         # Construct a detailed prompt for the outfit generation
         occasion = style_preferences.get("occasion", "casual")
@@ -1007,128 +1629,122 @@ async def generate_outfit(request: Request):
             raise HTTPException(status_code=500, detail="Segmind API key not configured")
         
         try:
-            # Use Segmind API for outfit generation
-            api_url = "https://api.segmind.com/v1/sdxl1.0-txt2img"
+            # Use Segmind API for outfit generation (or the prompt cache)
+            image_path, cached = await generate_txt2img(api_key, prompt, negative_prompt, "generated_outfit",
+                                                        seed=int(seed) if seed is not None else None)
             
-            headers = {
-                "x-api-key": api_key,
-                "Content-Type": "application/json"
-            }
+            logging.info(f"Successfully generated and saved outfit to {image_path}")
             
-            payload = {
+            # Return the URL to the generated image along with the prompt used
+            image_url = f"/api/generated/{os.path.basename(image_path)}"
+            return {
+                "imageUrl": image_url, 
+                "message": "Outfit generated successfully",
                 "prompt": prompt,
-                "negative_prompt": negative_prompt,
-                "style": "base",
-                "samples": 1,
-                "scheduler": "UniPC",
-                "num_inference_steps": 25,
-                "guidance_scale": 7.5,
-                "strength": 1,
-                "high_noise_frac": 0.8,
-                "seed": random.randint(1, 2147483647),
-                "img_width": 1024,
-                "img_height": 1024,
-                "base64": False
+                "occasion": occasion,
+                "season": season,
+                "style": style,
+                "colorScheme": color_scheme,
+                "cached": cached
             }
-            
-            logging.info(f"Making request to Segmind API with outfit prompt: {prompt}")
-            
-            # Make the API request
-            response = requests.post(api_url, headers=headers, json=payload, timeout=120)
-            
-            if response.status_code == 200:
-                # Save the generated image
-                timestamp = int(time.time())
-                random_suffix = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-                filename = f"generated_outfit_{timestamp}_{random_suffix}.png"
-                
-                # Ensure directory exists
-                os.makedirs("generated", exist_ok=True)
-                
-                # Save the image
-                image_path = os.path.join("generated", filename)
-                with open(image_path, "wb") as f:
-                    f.write(response.content)
-                
-                logging.info(f"Successfully generated and saved outfit to {image_path}")
-                
-                # Return the URL to the generated image along with the prompt used
-                image_url = f"/api/generated/{filename}"
-                return {
-                    "imageUrl": image_url, 
-                    "message": "Outfit generated successfully",
-                    "prompt": prompt,
-                    "occasion": occasion,
-                    "season": season,
-                    "style": style,
-                    "colorScheme": color_scheme
-                }
-            else:
-                logging.error(f"Segmind API request failed with status {response.status_code}: {response.text}")
-                raise Exception(f"Segmind API request failed with status {response.status_code}")
                 
         except Exception as api_error:
-            logging.error(f"Segmind API error: {str(api_error)}")
-            logging.error(traceback.format_exc())
+            logging.error(f"Segmind API error: {str(api_error)}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"Failed to generate outfit: {str(api_error)}")
     
     except Exception as e:
-        logging.error(f"Error in generate_outfit: {str(e)}")
-        logging.error(traceback.format_exc())
+        logging.error(f"Error in generate_outfit: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-if __name__ == "__main__":
-    # Configure server
-    config = uvicorn.Config(
-        app,
-        host="0.0.0.0",
-        port=8000,
-        workers=1,  # Single worker for better stability
-        loop="asyncio",
-        timeout_keep_alive=300,  # Increased keep-alive timeout
-        access_log=True,
-        log_level="info"
-    )
-    
-    # Add gzip compression
-    app.add_middleware(GZipMiddleware, minimum_size=1000)
-
 # ===== SMART FASHION ADVISOR ENDPOINTS =====
 # Enhanced with LangChain RAG system for intelligent fashion advice
 
-try:
-    from smart_fashion_advisor import SmartFashionAdvisor
-    from clothing_image_analyzer import ClothingImageAnalyzer
-    ADVANCED_FASHION_AVAILABLE = True
-except ImportError:
-    # Fallback to simple version if dependencies are not available
-    from simple_fashion_advisor import SimpleFashionAdvisor, SimpleImageAnalyzer
-    SmartFashionAdvisor = SimpleFashionAdvisor
-    ClothingImageAnalyzer = SimpleImageAnalyzer
-    ADVANCED_FASHION_AVAILABLE = False
-    logger.warning("Advanced fashion advisor dependencies not available. Using simplified version.")
+# LangChain and sentence-transformers are only imported when an advisor endpoint is first used;
+# image analysis (CLIP) runs in the CPU pool's worker processes (see cpu_tasks.py)
+_fashion_advisor_class = None
+
+def get_fashion_advisor_class():
+    """Return (advisor class, advanced flag), importing it on first call."""
+    global _fashion_advisor_class
+    if _fashion_advisor_class is None:
+        try:
+            from smart_fashion_advisor import SmartFashionAdvisor
+            _fashion_advisor_class = (SmartFashionAdvisor, True)
+        except ImportError:
+            # Fallback to simple version if dependencies are not available
+            from simple_fashion_advisor import SimpleFashionAdvisor
+            _fashion_advisor_class = (SimpleFashionAdvisor, False)
+            logger.warning("Advanced fashion advisor dependencies not available. Using simplified version.")
+    return _fashion_advisor_class
 
 # Initialize Smart Fashion Advisor (singleton pattern)
 fashion_advisor = None
-image_analyzer = None
+# Requests that arrive mid-warm-up wait for the instance being built instead of building another
+_fashion_advisor_lock = threading.Lock()
+
+@contextmanager
+def interprocess_lock(path: str):
+    """Serialize a section across worker processes with an exclusive lock file (no-op where fcntl is unavailable)."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
 def get_fashion_advisor():
     global fashion_advisor
-    if fashion_advisor is None:
-        if ADVANCED_FASHION_AVAILABLE:
-            fashion_advisor = SmartFashionAdvisor(use_openai=False)  # Set to True if you have OpenAI API key
-        else:
-            fashion_advisor = SmartFashionAdvisor()
+    with _fashion_advisor_lock:
+        if fashion_advisor is None:
+            SmartFashionAdvisor, advanced = get_fashion_advisor_class()
+            if advanced:
+                # Workers that were not preloaded would otherwise race to build fashion_vectorstore/ at the same time
+                with interprocess_lock("fashion_vectorstore.lock"):
+                    fashion_advisor = SmartFashionAdvisor(use_openai=False)  # Set to True if you have OpenAI API key
+            else:
+                fashion_advisor = SmartFashionAdvisor()
     return fashion_advisor
 
-def get_image_analyzer():
-    global image_analyzer
-    if image_analyzer is None:
-        if ADVANCED_FASHION_AVAILABLE:
-            image_analyzer = ClothingImageAnalyzer()
-        else:
-            image_analyzer = SimpleImageAnalyzer()
-    return image_analyzer
+def exercise_fashion_advisor(advisor):
+    """Run one knowledge-base retrieval (or canned answer) so embeddings and index pages are loaded before traffic."""
+    if hasattr(advisor, "fashion_kb"):
+        advisor.fashion_kb.search_knowledge("what goes with navy trousers", k=1)
+    else:
+        advisor.get_fashion_advice("What goes with navy trousers?")
+
+def start_warmup():
+    """
+    Queue the advisor and analyzer to warm up once the first response is out; /ready turns green once both
+    have served a dummy request, or warm-up has given up on them and left them to load on first use.
+    """
+    readiness.warm_up("fashion_advisor", get_fashion_advisor, exercise_fashion_advisor)
+    # Starts every CPU pool process; each loads its analyzer and analyzes a synthetic image
+    readiness.warm_up("image_analyzer", lambda: cpu_pool.warm_up(cpu_tasks.warm_up))
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once every component can serve, 503 (with per-component status) until then."""
+    status = readiness.to_dict()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+def preload_models():
+    """
+    Load the fashion advisor (embedding model and knowledge-base index) up front.
+    
+    serve.py calls this before forking so worker processes share the loaded model copy-on-write.
+    The image analyzer (CLIP) lives in the CPU pool's own processes and is loaded there.
+    """
+    started = time.time()
+    try:
+        get_fashion_advisor()
+        logger.info(f"Preloaded fashion_advisor in {time.time() - started:.1f}s")
+    except Exception as e:
+        logger.warning(f"Could not preload fashion_advisor: {str(e)}")
 
 @app.post("/api/fashion-advice")
 async def get_fashion_advice_endpoint(
@@ -1145,7 +1761,7 @@ async def get_fashion_advice_endpoint(
         image: Optional image for visual context
     """
     try:
-        advisor = get_fashion_advisor()
+        advisor = await run_in_threadpool(get_fashion_advisor)
         
         # If image is provided, analyze it first
         image_context = {}
@@ -1153,12 +1769,13 @@ async def get_fashion_advice_endpoint(
             # Save uploaded image temporarily
             temp_path = f"temp_advice_{int(time.time())}_{image.filename}"
             
-            with open(temp_path, "wb") as buffer:
-                shutil.copyfileobj(image.file, buffer)
+            def save_temp():
+                with open(temp_path, "wb") as buffer:
+                    shutil.copyfileobj(image.file, buffer)
+            await disk_pool.run(save_temp)
             
             # Analyze image
-            analyzer = get_image_analyzer()
-            image_analysis = analyzer.analyze_image(temp_path)
+            image_analysis = await cpu_pool.run(cpu_tasks.analyze_image, temp_path)
             
             # Add image context to question
             if "dominant_colors" in image_analysis:
@@ -1169,8 +1786,9 @@ async def get_fashion_advice_endpoint(
                 primary_item = image_analysis["clothing_detection"]["primary_item"]
                 question += f" (Primary item detected: {primary_item})"
             
-            # Clean up temp file
+            # Clean up temp file and its normalized copy
             cleanup_temp_file(temp_path)
+            cleanup_temp_file(normalized_path_for(temp_path))
             
             image_context = {
                 "image_analyzed": True,
@@ -1182,7 +1800,7 @@ async def get_fashion_advice_endpoint(
             }
         
         # Get fashion advice
-        advice_result = advisor.get_fashion_advice(question, advice_type)
+        advice_result = await upstream_pool.run(advisor.get_fashion_advice, question, advice_type)
         
         # Combine results
         response = {
@@ -1199,6 +1817,8 @@ async def get_fashion_advice_endpoint(
         logger.info(f"Fashion advice generated for query: {question[:50]}...")
         return response
         
+    except BulkheadFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Fashion advice error: {str(e)}")
         return {
@@ -1225,18 +1845,14 @@ async def analyze_outfit(
             raise HTTPException(status_code=400, detail="No image provided")
         
         # Save uploaded image
-        unique_filename = f"outfit_analysis_{int(time.time())}_{secure_filename(image.filename)}"
-        file_path = os.path.join("uploads", unique_filename)
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
+        file_path = (await ingest_upload(image, "outfits"))["path"]
+        unique_filename = os.path.basename(file_path)
         
-        # Analyze image
-        analyzer = get_image_analyzer()
-        image_analysis = analyzer.analyze_image(file_path)
+        # Analyze the normalized copy written at ingest
+        image_analysis = await cpu_pool.run(cpu_tasks.analyze_image, file_path)
         
         # Get fashion advice based on analysis
-        advisor = get_fashion_advisor()
+        advisor = await run_in_threadpool(get_fashion_advisor)
         
         # Create detailed question for advisor
         question = f"Analyze this outfit"
@@ -1256,7 +1872,7 @@ async def analyze_outfit(
                 question += f". The style appears to be {style}"
         
         # Get advice
-        advice_result = advisor.get_fashion_advice(question, "outfit")
+        advice_result = await upstream_pool.run(advisor.get_fashion_advice, question, "outfit")
         
         # Combine all results
         response = {
@@ -1275,6 +1891,8 @@ async def analyze_outfit(
         logger.info(f"Outfit analysis completed for image: {unique_filename}")
         return response
         
+    except BulkheadFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Outfit analysis error: {str(e)}")
         return {
@@ -1297,13 +1915,13 @@ async def get_color_coordination(
         style_preference: Style preference (optional)
     """
     try:
-        advisor = get_fashion_advisor()
+        advisor = await run_in_threadpool(get_fashion_advisor)
         
         # Parse base colors
         colors_list = [color.strip() for color in base_colors.split(",")]
         
         # Get color advice
-        advice_result = advisor.get_color_palette_advice(colors_list, season)
+        advice_result = await upstream_pool.run(advisor.get_color_palette_advice, colors_list, season)
         
         # Additional color theory analysis
         color_suggestions = {
@@ -1344,6 +1962,8 @@ async def get_color_coordination(
         logger.info(f"Color coordination advice for: {base_colors}")
         return response
         
+    except BulkheadFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Color coordination error: {str(e)}")
         return {
@@ -1368,10 +1988,10 @@ async def get_body_type_advice(
         budget_range: Budget considerations (optional)
     """
     try:
-        advisor = get_fashion_advisor()
+        advisor = await run_in_threadpool(get_fashion_advisor)
         
         # Get body type specific advice
-        advice_result = advisor.get_body_type_advice(body_type, style_goals)
+        advice_result = await upstream_pool.run(advisor.get_body_type_advice, body_type, style_goals)
         
         # Add additional context
         context_additions = []
@@ -1382,7 +2002,7 @@ async def get_body_type_advice(
         
         if context_additions:
             additional_question = f"Specifically {', '.join(context_additions)}, what are the best options?"
-            additional_advice = advisor.get_fashion_advice(additional_question, "general")
+            additional_advice = await upstream_pool.run(advisor.get_fashion_advice, additional_question, "general")
         else:
             additional_advice = {"advice": ""}
         
@@ -1402,6 +2022,8 @@ async def get_body_type_advice(
         logger.info(f"Body type advice for: {body_type}")
         return response
         
+    except BulkheadFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Body type advice error: {str(e)}")
         return {
@@ -1428,7 +2050,7 @@ async def get_occasion_advice(
         constraints: Any constraints like budget, body concerns, etc. (optional)
     """
     try:
-        advisor = get_fashion_advisor()
+        advisor = await run_in_threadpool(get_fashion_advisor)
         
         # Build comprehensive constraints string
         all_constraints = []
@@ -1444,7 +2066,7 @@ async def get_occasion_advice(
         constraints_str = ", ".join(all_constraints) if all_constraints else ""
         
         # Get occasion-specific advice
-        advice_result = advisor.get_occasion_advice(occasion, constraints_str)
+        advice_result = await upstream_pool.run(advisor.get_occasion_advice, occasion, constraints_str)
         
         response = {
             "success": True,
@@ -1461,6 +2083,8 @@ async def get_occasion_advice(
         logger.info(f"Occasion advice for: {occasion}")
         return response
         
+    except BulkheadFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Occasion advice error: {str(e)}")
         return {
@@ -1485,10 +2109,10 @@ async def get_trend_analysis(
         lifestyle: Lifestyle considerations (optional)
     """
     try:
-        advisor = get_fashion_advisor()
+        advisor = await run_in_threadpool(get_fashion_advisor)
         
         # Get trend advice
-        advice_result = advisor.get_trend_advice(season, style_preference)
+        advice_result = await upstream_pool.run(advisor.get_trend_advice, season, style_preference)
         
         # Add lifestyle and age considerations
         if age_range or lifestyle:
@@ -1498,7 +2122,7 @@ async def get_trend_analysis(
             if lifestyle:
                 context_question += f" with a {lifestyle} lifestyle"
             
-            context_advice = advisor.get_fashion_advice(context_question, "general")
+            context_advice = await upstream_pool.run(advisor.get_fashion_advice, context_question, "general")
         else:
             context_advice = {"advice": ""}
         
@@ -1517,6 +2141,8 @@ async def get_trend_analysis(
         logger.info(f"Trend analysis for: {season} season")
         return response
         
+    except BulkheadFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Trend analysis error: {str(e)}")
         return {
@@ -1530,7 +2156,7 @@ async def get_fashion_categories():
     Get available fashion categories and knowledge topics
     """
     try:
-        advisor = get_fashion_advisor()
+        advisor = await run_in_threadpool(get_fashion_advisor)
         
         # Get knowledge categories
         categories = {}
@@ -1557,8 +2183,17 @@ async def get_fashion_categories():
             "error": f"Failed to get fashion categories: {str(e)}"
         }
 
-# Run server
+# Run a single-process development server (use serve.py for multi-process production serving)
 if __name__ == "__main__":
+    config = uvicorn.Config(
+        app,
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+        loop="asyncio",
+        timeout_keep_alive=300,  # Increased keep-alive timeout
+        access_log=True,
+        log_level="info"
+    )
     server = uvicorn.Server(config)
     try:
         server.run()
@@ -0,0 +1,158 @@
+"""
+Mask-generation benchmark for the local try-on compositor
+Times the per-pixel mask loops body_masks.py replaced against its NumPy version (uncached and cached) at several image sizes
+"""
+
+import sys
+import time
+import argparse
+import statistics
+
+import numpy as np
+from PIL import Image
+
+import body_masks
+
+SIZES = (512, 1024, 2048)
+CATEGORIES = ("Upper body", "Lower body", "Dress")
+
+
+def loop_body_mask(size, category):
+    """The original per-pixel body mask from segmind_api.py, kept as the reference for speed and output."""
+    width, height = size
+    mask = Image.new('L', size, 0)
+    center_x = width // 2
+    if category == "Upper body":
+        upper_body_height = int(height * 0.4)
+        for y in range(upper_body_height):
+            relative_y = y / upper_body_height
+            body_width = int(width * (0.3 + 0.2 * relative_y))
+            for x in range(width):
+                dist_from_center = abs(x - center_x)
+                if dist_from_center < body_width // 2:
+                    alpha = int(255 * (1 - dist_from_center / (body_width // 2) * 0.3))
+                    alpha = int(alpha * (0.7 + 0.3 * relative_y))
+                    mask.putpixel((x, y), alpha)
+        shoulder_y = int(height * 0.2)
+        shoulder_width = int(width * 0.6)
+        for x in range(center_x - shoulder_width // 2, center_x + shoulder_width // 2):
+            for y in range(shoulder_y - 10, shoulder_y + 10):
+                if 0 <= y < height and 0 <= x < width:
+                    alpha = int(255 * (1 - abs(y - shoulder_y) / 10))
+                    if alpha > mask.getpixel((x, y)):
+                        mask.putpixel((x, y), alpha)
+    elif category == "Lower body":
+        lower_body_start = int(height * 0.4)
+        for y in range(lower_body_start, height):
+            relative_y = (y - lower_body_start) / (height - lower_body_start)
+            body_width = int(width * (0.4 - 0.15 * relative_y))
+            for x in range(width):
+                dist_from_center = abs(x - center_x)
+                if dist_from_center < body_width // 2 and (body_width // 2) > 0:
+                    alpha = int(255 * (1 - dist_from_center / (body_width // 2) * 0.3))
+                    alpha = int(alpha * (0.9 - 0.2 * relative_y))
+                    mask.putpixel((x, y), alpha)
+    else:
+        for y in range(height):
+            relative_y = y / height
+            if relative_y < 0.4:
+                body_width = int(width * (0.3 + 0.2 * relative_y))
+            else:
+                body_width = int(width * (0.5 - 0.2 * (relative_y - 0.4) / 0.6))
+                if relative_y > 0.7:
+                    flare_factor = (relative_y - 0.7) / 0.3
+                    body_width = int(body_width * (1 + flare_factor * 0.5))
+            body_width = max(1, body_width)
+            for x in range(width):
+                dist_from_center = abs(x - center_x)
+                if dist_from_center < body_width // 2:
+                    alpha = int(255 * (1 - dist_from_center / (body_width // 2) * 0.3))
+                    alpha = int(alpha * (0.7 + 0.3 * relative_y))
+                    mask.putpixel((x, y), alpha)
+    return mask
+
+
+def loop_blend_mask(size, category):
+    """The original per-pixel simple-blend mask from segmind_api.py."""
+    width, height = size
+    mask = Image.new('L', size, 0)
+    if category == "Upper body":
+        upper_body_height = int(height * 0.4)
+        for y in range(upper_body_height):
+            alpha = int(255 * (1 - y / upper_body_height * 0.5))
+            for x in range(width):
+                mask.putpixel((x, y), alpha)
+    elif category == "Lower body":
+        lower_body_start = int(height * 0.4)
+        for y in range(lower_body_start, height):
+            alpha = int(255 * (y - lower_body_start) / (height - lower_body_start) * 0.8)
+            for x in range(width):
+                mask.putpixel((x, y), alpha)
+    else:
+        for y in range(height):
+            alpha = int(255 * (0.3 + 0.5 * y / height))
+            for x in range(width):
+                mask.putpixel((x, y), alpha)
+    return mask
+
+
+def _time(fn, runs: int) -> float:
+    """Median seconds per call over runs calls."""
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def _uncached(size, category):
+    body_masks.clear_cache()
+    body_masks.body_mask(size, category)
+    body_masks.blend_mask(size, category)
+
+
+def measure(side: int, category: str, runs: int, loops: bool) -> dict:
+    """Per-image mask cost (body mask plus blend mask) for a square image of this side."""
+    size = (side, side)
+    row = {
+        "numpy": _time(lambda: _uncached(size, category), runs),
+        "cached": _time(lambda: (body_masks.body_mask(size, category), body_masks.blend_mask(size, category)), runs),
+        "loops": None,
+    }
+    if loops:
+        row["loops"] = _time(lambda: (loop_body_mask(size, category), loop_blend_mask(size, category)), 1)
+        if not (np.array_equal(np.array(loop_body_mask(size, category)), np.array(body_masks.body_mask(size, category)))
+                and np.array_equal(np.array(loop_blend_mask(size, category)),
+                                   np.array(body_masks.blend_mask(size, category)))):
+            raise AssertionError(f"NumPy masks differ from the per-pixel masks at {side}px for {category}")
+    return row
+
+
+def _ms(seconds) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.3f}ms"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Time body-region mask generation for the local compositor")
+    parser.add_argument("--sizes", default=",".join(str(side) for side in SIZES), help="Square image sides to time")
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per size for the NumPy masks")
+    parser.add_argument("--skip-loops", action="store_true",
+                        help="Don't time the per-pixel loops (several seconds per image at 2048)")
+    args = parser.parse_args(argv)
+
+    sides = [int(side) for side in args.sizes.split(",") if side.strip()]
+    print(f"{'size':<11}{'category':<12}{'per-pixel':>14}{'numpy':>12}{'cached':>12}{'speedup':>10}")
+    for side in sides:
+        for category in CATEGORIES:
+            row = measure(side, category, args.runs, not args.skip_loops)
+            speedup = f"{row['loops'] / row['numpy']:.0f}x" if row["loops"] else "-"
+            print(f"{f'{side}x{side}':<11}{category:<12}{_ms(row['loops']):>14}{_ms(row['numpy']):>12}"
+                  f"{_ms(row['cached']):>12}{speedup:>10}")
+    if not args.skip_loops:
+        print("\n✅ NumPy masks match the per-pixel masks at every size")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Startup-time benchmark for the Virtual Try-On API
+Measures how long `import api` takes and how long a fresh server process needs to answer its first request (with warm-up
+on and off), against a budget
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Budget for a fresh process to answer its first request (see .env.example)
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", "1.0"))
+READY_TIMEOUT_SECONDS = 60.0
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import() -> float:
+    """Time `import api` in a fresh interpreter."""
+    code = "import time; t = time.perf_counter(); import api; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def warmup_enabled() -> bool:
+    """Whether the server under test warms up its components, as api.py will read WARMUP_ENABLED."""
+    return os.environ.get("WARMUP_ENABLED", "True").lower() in ("1", "true", "yes")
+
+
+def measure_ready(path: str = "/", warmup: bool = True) -> float:
+    """Start `python api.py` (with warm-up on or off) and time how long it takes to answer GET path with 200."""
+    port = _free_port()
+    env = dict(os.environ, HOST="127.0.0.1", PORT=str(port), WARMUP_ENABLED=str(warmup))
+    url = f"http://127.0.0.1:{port}{path}"
+
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "api.py"], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < READY_TIMEOUT_SECONDS:
+            if process.poll() is not None:
+                raise RuntimeError(f"api.py exited with status {process.returncode} before becoming ready")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                pass
+            time.sleep(0.02)
+        raise RuntimeError(f"api.py did not answer {path} within {READY_TIMEOUT_SECONDS}s")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def slowest_imports(limit: int = 15):
+    """Return the modules with the largest cumulative import time under `import api`."""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import api"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if cumulative.isdigit() and not name.startswith(" "):
+            rows.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure API startup time against a budget")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh processes to time")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_SECONDS,
+                        help="Maximum acceptable median time to first response, in seconds")
+    parser.add_argument("--path", default="/", help="Endpoint that must answer 200")
+    parser.add_argument("--show-imports", action="store_true", help="List the slowest imports")
+    args = parser.parse_args(argv)
+
+    warmup = warmup_enabled()
+    import_times = [measure_import() for _ in range(args.runs)]
+    ready_times = [measure_ready(args.path, warmup) for _ in range(args.runs)]
+    # Warm-up must not delay the first response; timing the other setting too shows its cost
+    other_times = [measure_ready(args.path, not warmup) for _ in range(args.runs)]
+
+    print(f"{'import api':<30} median {statistics.median(import_times):.3f}s  max {max(import_times):.3f}s")
+    for enabled, times in ((warmup, ready_times), (not warmup, other_times)):
+        label = f"ready (GET {args.path}, warm-up {'on' if enabled else 'off'})"
+        print(f"{label:<30} median {statistics.median(times):.3f}s  max {max(times):.3f}s")
+
+    if args.show_imports:
+        print("\nSlowest imports (cumulative):")
+        for seconds, name in slowest_imports():
+            print(f"  {seconds:7.3f}s  {name}")
+
+    median_ready = statistics.median(ready_times)
+    setting = f"warm-up {'on' if warmup else 'off'} (WARMUP_ENABLED)"
+    if median_ready > args.budget:
+        print(f"\n❌ Startup {median_ready:.3f}s with {setting} is over the {args.budget:.3f}s budget")
+        return 1
+    print(f"\n✅ Startup {median_ready:.3f}s with {setting} is within the {args.budget:.3f}s budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,466 @@
+"""
+Blob storage for uploads, results and generated images
+Keys look like the app's relative paths (uploads/models/<sha256>.png, results/..., generated/...); backends are a
+hash-sharded local directory, process memory (tests) or an S3-compatible bucket
+"""
+
+import io
+import os
+import re
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Iterator, Optional, Tuple
+
+from metrics import Histogram
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Blob storage settings (see .env.example)
+BLOB_BACKEND = os.environ.get("BLOB_BACKEND", "local").lower()
+BLOB_ROOT = os.environ.get("BLOB_ROOT", ".")
+BLOB_SHARD_LEVELS = int(os.environ.get("BLOB_SHARD_LEVELS", "1"))
+# Local copies of remote blobs, for code that needs a file path (PIL, FileResponse, uploads to Segmind)
+BLOB_CACHE_DIR = os.environ.get("BLOB_CACHE_DIR", ".blob_cache")
+S3_BUCKET = os.environ.get("S3_BUCKET", "")
+S3_PREFIX = os.environ.get("S3_PREFIX", "")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "")
+S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+
+BLOB_OPERATION_SECONDS = Histogram("blob_operation_seconds", "Blob store latency by backend and operation",
+                                   ("backend", "operation"))
+
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+
+
+def validate_key(key: str) -> str:
+    """
+    Check that a key is a relative, normalized path
+
+    Raises:
+        ValueError: If the key is empty, absolute or escapes its namespace
+    """
+    parts = key.split("/")
+    if not key or key.startswith("/") or "\\" in key or any(part in ("", ".", "..") for part in parts):
+        raise ValueError(f"Invalid blob key: {key!r}")
+    return key
+
+
+def make_key(namespace: str, name: str) -> str:
+    """
+    Join a namespace (e.g. "uploads/models" or "./results") and a file name into a key
+
+    Raises:
+        ValueError: If the namespace has ".." segments (normalizing those away could leave its top-level
+            directory, e.g. "uploads/.." is the store root) or the result is not a valid key
+    """
+    parts = namespace.replace(os.sep, "/").split("/")
+    if ".." in parts:
+        raise ValueError(f"Invalid blob namespace: {namespace!r}")
+    namespace = "/".join(part for part in parts if part not in ("", "."))
+    return validate_key(f"{namespace}/{name}" if namespace else name)
+
+
+def split_key(key: str) -> Tuple[str, str]:
+    namespace, _, name = key.rpartition("/")
+    return namespace, name
+
+
+class BlobStore:
+    """Interface shared by the storage backends."""
+
+    backend = "base"
+
+    def put_file(self, key: str, source_path: str, move: bool = True) -> str:
+        """
+        Store a local file under a key
+
+        Args:
+            key: Blob key
+            source_path: File to store
+            move: Consume the source file (and its blob, if it is a local copy of one) instead of copying it
+
+        Returns:
+            A local path to read the stored blob from
+        """
+        raise NotImplementedError
+
+    def put_bytes(self, key: str, data: bytes) -> str:
+        """Store bytes under a key and return a local path to read them from."""
+        raise NotImplementedError
+
+    def stat(self, key: str) -> Optional[Tuple[int, float]]:
+        """Return (size, mtime) of a blob, or None if it does not exist."""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Return a local file path holding the blob, or None if it does not exist."""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def list(self, namespace: str, prefix: str = "") -> Iterator[Tuple[str, int, float]]:
+        """Yield (name, size, last used time) for the blobs in a namespace whose names start with prefix."""
+        raise NotImplementedError
+
+    def key_for_path(self, path: str) -> Optional[str]:
+        """Map a local path handed out by this store back to its key, or None."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def save_image(self, key: str, image, format: str = "PNG", **save_kwargs) -> str:
+        """Encode a PIL image and store it; returns a local path."""
+        buffer = io.BytesIO()
+        image.save(buffer, format=format, **save_kwargs)
+        return self.put_bytes(key, buffer.getvalue())
+
+    def localize(self, path_or_key: str) -> str:
+        """
+        Turn a path a client sent back (a key, a legacy flat path or a local path) into a readable local path
+
+        Unknown paths are returned unchanged so callers report them as missing the usual way.
+        """
+        if os.path.isfile(path_or_key):
+            return path_or_key
+        key = self.key_for_path(path_or_key)
+        if key is None:
+            try:
+                key = make_key("", path_or_key)
+            except ValueError:
+                return path_or_key
+        return self.local_path(key) or path_or_key
+
+    def _observe(self, operation: str, started: float):
+        elapsed = time.perf_counter() - started
+        BLOB_OPERATION_SECONDS.labels(self.backend, operation).observe(elapsed)
+        tracing.record_span(f"blob.{operation}", elapsed, **{"blob.backend": self.backend})
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under root/<namespace>/<shard>/<name>, sharded on a hash so no directory grows huge."""
+
+    backend = "local"
+
+    def __init__(self, root: str = BLOB_ROOT, shard_levels: int = BLOB_SHARD_LEVELS):
+        """
+        Initialize the store
+
+        Args:
+            root: Base directory; namespaces are subdirectories of it
+            shard_levels: Levels of two-hex-digit shard directories (0: flat). Files written before
+                sharding, directly in the namespace directory, are still found.
+        """
+        self.root = root
+        self.shard_levels = shard_levels
+
+    def _shards(self, name: str) -> list:
+        # Content-addressed names shard on their own digest so a content id finds its shard directly;
+        # others on a hash of the stem, so derived files (<stem>.norm.jpg, <stem>.w320.webp) sit beside the original
+        match = _DIGEST.search(name)
+        digest = match.group(0) if match else hashlib.sha256(name.split(".", 1)[0].encode()).hexdigest()
+        return [digest[2 * level:2 * level + 2] for level in range(self.shard_levels)]
+
+    def path_for(self, key: str) -> str:
+        """Return where a key is (or would be) stored, whether or not it exists."""
+        namespace, name = split_key(validate_key(key))
+        return os.path.join(self.root, *namespace.split("/"), *self._shards(name), name) if namespace else \
+            os.path.join(self.root, *self._shards(name), name)
+
+    def _legacy_path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def _existing_path(self, key: str) -> Optional[str]:
+        path = self.path_for(key)
+        if os.path.isfile(path):
+            return path
+        if self.shard_levels:
+            legacy = self._legacy_path(key)
+            if os.path.isfile(legacy):
+                return legacy
+        return None
+
+    def put_file(self, key: str, source_path: str, move: bool = True) -> str:
+        started = time.perf_counter()
+        path = self.path_for(key)
+        if os.path.abspath(source_path) != os.path.abspath(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            if move:
+                shutil.move(source_path, tmp_path)
+            else:
+                shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+        self._observe("put", started)
+        return path
+
+    def put_bytes(self, key: str, data: bytes) -> str:
+        started = time.perf_counter()
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._observe("put", started)
+        return path
+
+    def stat(self, key: str) -> Optional[Tuple[int, float]]:
+        path = self._existing_path(key)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def local_path(self, key: str) -> Optional[str]:
+        started = time.perf_counter()
+        path = self._existing_path(key)
+        self._observe("lookup", started)
+        return path
+
+    def delete(self, key: str):
+        path = self._existing_path(key)
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def list(self, namespace: str, prefix: str = "") -> Iterator[Tuple[str, int, float]]:
+        base = os.path.join(self.root, *[part for part in namespace.split("/") if part])
+        match = _DIGEST.search(prefix)
+        directories = [base]
+        if self.shard_levels:
+            # A full digest prefix pins the shard; otherwise walk every shard directory
+            directories = [os.path.join(base, *self._shards(match.group(0)))] if match else self._shard_dirs(base)
+            directories.append(base)
+        for directory in directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.name.startswith(prefix) or entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.name, stat.st_size, max(stat.st_atime, stat.st_mtime)
+
+    def _shard_dirs(self, base: str) -> list:
+        directories = [base]
+        for _ in range(self.shard_levels):
+            nested = []
+            for directory in directories:
+                try:
+                    nested.extend(entry.path for entry in os.scandir(directory)
+                                  if entry.is_dir() and re.fullmatch(r"[0-9a-f]{2}", entry.name))
+                except OSError:
+                    continue
+            directories = nested
+        return directories
+
+    def key_for_path(self, path: str) -> Optional[str]:
+        root = os.path.abspath(self.root)
+        absolute = os.path.abspath(path)
+        if os.path.commonpath([root, absolute]) != root or absolute == root:
+            return None
+        parts = os.path.relpath(absolute, root).replace(os.sep, "/").split("/")
+        name = parts[-1]
+        shards = self._shards(name)
+        if self.shard_levels and len(parts) > self.shard_levels and parts[-1 - self.shard_levels:-1] == shards:
+            parts = parts[:-1 - self.shard_levels] + [name]
+        try:
+            return validate_key("/".join(parts))
+        except ValueError:
+            return None
+
+
+class _CachedRemoteStore(BlobStore):
+    """Base for stores that are not on the local disk: blobs read through a sharded local copy."""
+
+    def __init__(self, cache_dir: str = BLOB_CACHE_DIR):
+        self.cache = LocalBlobStore(cache_dir)
+
+    def _read(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def _write(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    def _remove(self, key: str):
+        raise NotImplementedError
+
+    def put_bytes(self, key: str, data: bytes) -> str:
+        started = time.perf_counter()
+        self._write(validate_key(key), data)
+        self._observe("put", started)
+        return self.cache.put_bytes(key, data)
+
+    def put_file(self, key: str, source_path: str, move: bool = True) -> str:
+        with open(source_path, "rb") as f:
+            data = f.read()
+        path = self.put_bytes(key, data)
+        if move and os.path.abspath(source_path) != os.path.abspath(path):
+            source_key = self.key_for_path(source_path)
+            if source_key is not None:
+                self.delete(source_key)
+            elif os.path.exists(source_path):
+                os.remove(source_path)
+        return path
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self.cache.local_path(key)
+        if path is not None:
+            return path
+        started = time.perf_counter()
+        data = self._read(validate_key(key))
+        self._observe("fetch", started)
+        if data is None:
+            return None
+        return self.cache.put_bytes(key, data)
+
+    def delete(self, key: str):
+        self._remove(validate_key(key))
+        self.cache.delete(key)
+
+    def key_for_path(self, path: str) -> Optional[str]:
+        return self.cache.key_for_path(path)
+
+
+class MemoryBlobStore(_CachedRemoteStore):
+    """Blobs held in process memory, for tests; local copies go to a scratch directory."""
+
+    backend = "memory"
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        super().__init__(cache_dir or os.path.join(BLOB_CACHE_DIR, f"memory-{uuid.uuid4().hex[:8]}"))
+        self.blobs = {}
+        self._lock = threading.Lock()
+
+    def _read(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self.blobs.get(key)
+        return entry[0] if entry else None
+
+    def _write(self, key: str, data: bytes):
+        with self._lock:
+            self.blobs[key] = (data, time.time())
+
+    def _remove(self, key: str):
+        with self._lock:
+            self.blobs.pop(key, None)
+
+    def stat(self, key: str) -> Optional[Tuple[int, float]]:
+        with self._lock:
+            entry = self.blobs.get(key)
+        return (len(entry[0]), entry[1]) if entry else None
+
+    def list(self, namespace: str, prefix: str = "") -> Iterator[Tuple[str, int, float]]:
+        namespace = namespace.strip("/")
+        with self._lock:
+            items = list(self.blobs.items())
+        for key, (data, mtime) in items:
+            key_namespace, name = split_key(key)
+            if key_namespace == namespace and name.startswith(prefix):
+                yield name, len(data), mtime
+
+
+class S3BlobStore(_CachedRemoteStore):
+    """Blobs in an S3-compatible bucket (AWS S3, MinIO, Ceph...); needs boto3."""
+
+    backend = "s3"
+
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX, endpoint_url: str = S3_ENDPOINT_URL,
+                 region: str = S3_REGION, cache_dir: str = BLOB_CACHE_DIR, client=None):
+        """
+        Initialize the store
+
+        Args:
+            bucket: Bucket name
+            prefix: Key prefix inside the bucket, so several deployments can share one bucket
+            endpoint_url: Endpoint of an S3-compatible service (empty: AWS)
+            region: Bucket region
+            cache_dir: Directory for local copies of blobs
+            client: Preconfigured boto3 S3 client (credentials otherwise come from the environment)
+        """
+        super().__init__(cache_dir)
+        if not bucket:
+            raise ValueError("S3_BUCKET must be set to use the s3 blob backend")
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise ImportError("The s3 blob backend needs boto3 (pip install boto3)")
+            client = boto3.client("s3", endpoint_url=endpoint_url or None, region_name=region)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _is_missing(self, error) -> bool:
+        code = getattr(error, "response", {}).get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def _read(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return response["Body"].read()
+
+    def _write(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data)
+
+    def _remove(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def stat(self, key: str) -> Optional[Tuple[int, float]]:
+        started = time.perf_counter()
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self._object_key(validate_key(key)))
+        except Exception as e:
+            if self._is_missing(e):
+                return None
+            raise
+        finally:
+            self._observe("stat", started)
+        return response["ContentLength"], response["LastModified"].timestamp()
+
+    def list(self, namespace: str, prefix: str = "") -> Iterator[Tuple[str, int, float]]:
+        namespace = namespace.strip("/")
+        base = self._object_key(f"{namespace}/" if namespace else "")
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=base + prefix, Delimiter="/"):
+            for item in page.get("Contents", []):
+                yield item["Key"][len(base):], item["Size"], item["LastModified"].timestamp()
+
+
+def create_store(backend: str = BLOB_BACKEND) -> BlobStore:
+    """Build the configured backend."""
+    if backend == "local":
+        return LocalBlobStore()
+    if backend == "memory":
+        return MemoryBlobStore()
+    if backend == "s3":
+        return S3BlobStore()
+    raise ValueError(f"Unknown BLOB_BACKEND: {backend}")
+
+
+store = create_store()
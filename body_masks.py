@@ -0,0 +1,150 @@
+"""
+Alpha masks for the local try-on compositor in segmind_api.py
+The masks depend only on image size and clothing category, so each is built once with NumPy array operations and cached
+"""
+
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+from PIL import Image
+
+# Distinct (size, region) masks kept per kind; at 1024x1024 each is 1MB
+MASK_CACHE_SIZE = 32
+
+UPPER = "upper"
+LOWER = "lower"
+DRESS = "dress"
+
+
+def region_for(category: str) -> str:
+    """Map a clothing category to the body region its masks cover (anything but upper/lower body is a dress)."""
+    if category == "Upper body":
+        return UPPER
+    if category == "Lower body":
+        return LOWER
+    return DRESS
+
+
+def _shaped_alpha(width: int, body_width: np.ndarray, fade: np.ndarray) -> np.ndarray:
+    """
+    Rows of a body-shaped mask: opaque near the centre line, 30% fainter at the body's edge, scaled by fade per row
+
+    Args:
+        width: Image width
+        body_width: Per-row body width in pixels, shape (rows, 1)
+        fade: Per-row top-to-bottom factor, shape (rows, 1)
+    """
+    half = body_width // 2
+    dist_from_center = np.abs(np.arange(width) - width // 2)[np.newaxis, :]
+    inside = dist_from_center < half
+    # Same float operations, in the same order, as the per-pixel version, so masks match it exactly
+    alpha = np.trunc(255 * (1 - dist_from_center / np.maximum(half, 1) * 0.3))
+    alpha = np.trunc(alpha * fade)
+    return np.where(inside, alpha, 0).astype(np.uint8)
+
+
+def _upper_body(width: int, height: int) -> np.ndarray:
+    mask = np.zeros((height, width), dtype=np.uint8)
+    upper_body_height = int(height * 0.4)
+    if upper_body_height > 0:
+        # Torso narrower at the top, wider at the bottom
+        relative_y = (np.arange(upper_body_height) / upper_body_height)[:, np.newaxis]
+        body_width = (width * (0.3 + 0.2 * relative_y)).astype(np.int64)
+        mask[:upper_body_height] = _shaped_alpha(width, body_width, 0.7 + 0.3 * relative_y)
+
+    # Shoulder line: a 20-pixel band fading out from its centre, never lowering the torso alpha
+    center_x = width // 2
+    shoulder_y = int(height * 0.2)
+    shoulder_width = int(width * 0.6)
+    top, bottom = max(0, shoulder_y - 10), min(height, shoulder_y + 10)
+    left, right = max(0, center_x - shoulder_width // 2), min(width, center_x + shoulder_width // 2)
+    if top < bottom and left < right:
+        dist = np.abs(np.arange(top, bottom) - shoulder_y)[:, np.newaxis]
+        band = np.trunc(255 * (1 - dist / 10)).astype(np.uint8)
+        np.maximum(mask[top:bottom, left:right], band, out=mask[top:bottom, left:right])
+    return mask
+
+
+def _lower_body(width: int, height: int) -> np.ndarray:
+    mask = np.zeros((height, width), dtype=np.uint8)
+    lower_body_start = int(height * 0.4)
+    if lower_body_start >= height:
+        return mask
+    # Hips wider at the top, narrowing towards the ankles
+    relative_y = ((np.arange(lower_body_start, height) - lower_body_start) / (height - lower_body_start))[:, np.newaxis]
+    body_width = (width * (0.4 - 0.15 * relative_y)).astype(np.int64)
+    mask[lower_body_start:] = _shaped_alpha(width, body_width, 0.9 - 0.2 * relative_y)
+    return mask
+
+
+def _dress(width: int, height: int) -> np.ndarray:
+    if height <= 0:
+        return np.zeros((0, width), dtype=np.uint8)
+    relative_y = (np.arange(height) / height)[:, np.newaxis]
+    # Narrow at the shoulders, widest at the waist, then tapering with a flare at the hem
+    upper = (width * (0.3 + 0.2 * relative_y)).astype(np.int64)
+    skirt = (width * (0.5 - 0.2 * (relative_y - 0.4) / 0.6)).astype(np.int64)
+    flare = (relative_y - 0.7) / 0.3
+    flared = (skirt * (1 + flare * 0.5)).astype(np.int64)
+    body_width = np.where(relative_y < 0.4, upper, np.where(relative_y > 0.7, flared, skirt))
+    body_width = np.maximum(1, body_width)
+    return _shaped_alpha(width, body_width, 0.7 + 0.3 * relative_y)
+
+
+def _gradient(width: int, height: int, region: str) -> np.ndarray:
+    """Full-width horizontal bands for the simple blend fallback."""
+    column = np.zeros(height, dtype=np.uint8)
+    if region == UPPER:
+        # Top 40%, fading to half strength
+        upper_body_height = int(height * 0.4)
+        y = np.arange(upper_body_height)
+        column[:upper_body_height] = np.trunc(255 * (1 - y / max(upper_body_height, 1) * 0.5))
+    elif region == LOWER:
+        # Bottom 60%, strengthening towards the feet
+        lower_body_start = int(height * 0.4)
+        y = np.arange(lower_body_start, height)
+        column[lower_body_start:] = np.trunc(255 * (y - lower_body_start) / max(height - lower_body_start, 1) * 0.8)
+    else:
+        y = np.arange(height)
+        column[:] = np.trunc(255 * (0.3 + 0.5 * y / max(height, 1)))
+    return np.repeat(column[:, np.newaxis], width, axis=1)
+
+
+_BUILDERS = {UPPER: _upper_body, LOWER: _lower_body, DRESS: _dress}
+
+
+@lru_cache(maxsize=MASK_CACHE_SIZE)
+def _cached_body_mask(size: Tuple[int, int], region: str) -> Image.Image:
+    width, height = size
+    return Image.fromarray(_BUILDERS[region](width, height))
+
+
+@lru_cache(maxsize=MASK_CACHE_SIZE)
+def _cached_blend_mask(size: Tuple[int, int], region: str) -> Image.Image:
+    width, height = size
+    return Image.fromarray(_gradient(width, height, region))
+
+
+def body_mask(size: Tuple[int, int], category: str) -> Image.Image:
+    """
+    Body-shaped alpha mask ("L" mode) for pasting clothing of a category onto a model image of this size
+
+    The image is cached and shared between callers: paste with it or copy it, but never draw on it.
+    """
+    return _cached_body_mask(tuple(size), region_for(category))
+
+
+def blend_mask(size: Tuple[int, int], category: str) -> Image.Image:
+    """Banded alpha mask ("L" mode) used by the simple blend fallback; cached and shared like body_mask()."""
+    return _cached_blend_mask(tuple(size), region_for(category))
+
+
+def cache_info():
+    """Hit and miss counts of the two mask caches, for benchmarks and tests."""
+    return {"body": _cached_body_mask.cache_info(), "blend": _cached_blend_mask.cache_info()}
+
+
+def clear_cache():
+    _cached_body_mask.cache_clear()
+    _cached_blend_mask.cache_clear()
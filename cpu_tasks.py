@@ -0,0 +1,53 @@
+"""
+CPU-bound tasks run on the process pool (see executors.cpu_pool)
+Each worker process loads its own image analyzer once and reuses it for every task
+"""
+
+import os
+import logging
+import tempfile
+from typing import Any, Dict
+
+from PIL import Image
+
+from image_normalize import ensure_normalized
+
+logger = logging.getLogger(__name__)
+
+_image_analyzer = None
+
+
+def get_image_analyzer():
+    """Return this process's analyzer: the CLIP-based one if its dependencies are installed, else the simple one."""
+    global _image_analyzer
+    if _image_analyzer is None:
+        try:
+            from clothing_image_analyzer import ClothingImageAnalyzer
+            _image_analyzer = ClothingImageAnalyzer()
+        except ImportError:
+            from simple_fashion_advisor import SimpleImageAnalyzer
+            _image_analyzer = SimpleImageAnalyzer()
+    return _image_analyzer
+
+
+def init_worker():
+    """Process pool initializer: load the analyzer before the first task arrives."""
+    get_image_analyzer()
+
+
+def warm_up() -> int:
+    """Analyze a small synthetic image so CLIP and the colour clustering allocate their buffers; returns the pid."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "warmup.png")
+        Image.effect_noise((224, 224), 64).convert("RGB").save(path)
+        get_image_analyzer().analyze_image(path)
+    return os.getpid()
+
+
+def analyze_image(image_path: str) -> Dict[str, Any]:
+    """Analyze a clothing image at working resolution."""
+    try:
+        image_path = ensure_normalized(image_path)
+    except Exception as e:
+        logger.warning(f"Analyzing original image {image_path}; normalization failed: {str(e)}")
+    return get_image_analyzer().analyze_image(image_path)
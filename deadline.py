@@ -0,0 +1,292 @@
+"""
+Request deadlines and cancellation for the try-on API
+Each request carries a time budget, and a flag raised when its client goes away, through context variables into job workers, retries and upstream calls
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Deadline settings (see .env.example)
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("REQUEST_TIMEOUT_SECONDS", "300"))
+REQUEST_TIMEOUT_MAX_SECONDS = float(os.environ.get("REQUEST_TIMEOUT_MAX_SECONDS", "900"))
+# Clients may ask for a different budget (in seconds, up to the max) with this header
+TIMEOUT_HEADER = b"x-request-timeout"
+# nginx's status for requests whose client closed the connection first; only ever seen in logs and metrics
+CLIENT_CLOSED_REQUEST = 499
+
+REQUESTS_CUT_SHORT = Counter("requests_cut_short_total",
+                             "Requests ended early because the client disconnected or the deadline passed", ("reason",))
+
+_current: ContextVar[Optional["Budget"]] = ContextVar("request_budget", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the time budget for a request runs out before its work is done."""
+
+
+class Cancelled(Exception):
+    """Raised in work nobody is waiting for any more (the client disconnected)."""
+
+
+class Budget:
+    """The time a piece of work must finish by, and whether anyone still wants it; safe to use from any thread."""
+
+    def __init__(self, seconds: Optional[float] = None):
+        """
+        Args:
+            seconds: Time allowed from now; None for no deadline (work can still be cancelled)
+        """
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+        self._cancelled = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def derive(cls, parent: Optional["Budget"]) -> "Budget":
+        """A budget with the parent's deadline but its own cancellation, for work that may outlive one requester."""
+        budget = cls()
+        budget.expires_at = parent.expires_at if parent is not None else None
+        return budget
+
+    def extend(self, other: Optional["Budget"]):
+        """Move the deadline out to other's when another requester with a later deadline joins the work."""
+        with self._lock:
+            if other is None or other.expires_at is None or self.expires_at is None:
+                self.expires_at = None
+            else:
+                self.expires_at = max(self.expires_at, other.expires_at)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline (never negative), or None without one."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Flag the work as unwanted and run the registered callbacks (once)."""
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancellation callback failed: {str(e)}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Run callback when the budget is cancelled (right away if it already is)
+
+        Returns:
+            A function that unregisters the callback
+        """
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def check(self):
+        """Raise Cancelled or DeadlineExceeded if the work should stop."""
+        if self.cancelled:
+            raise Cancelled("The client is no longer waiting for this request")
+        if self.expired:
+            raise DeadlineExceeded("The request deadline passed")
+
+    def sleep(self, seconds: float):
+        """Block for seconds unless cancelled first; raise right away if the deadline falls before the sleep ends."""
+        self.check()
+        remaining = self.remaining()
+        if remaining is not None and seconds >= remaining:
+            raise DeadlineExceeded(f"Waiting {seconds:.1f}s would overrun the request deadline ({remaining:.1f}s left)")
+        self._cancelled.wait(seconds)
+        self.check()
+
+
+def current() -> Optional[Budget]:
+    return _current.get()
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current request's budget, or None outside a request."""
+    budget = _current.get()
+    return budget.remaining() if budget is not None else None
+
+
+def check():
+    """Raise if the current request was cancelled or ran out of time (a no-op outside a request)."""
+    budget = _current.get()
+    if budget is not None:
+        budget.check()
+
+
+def clamp(timeout: float) -> float:
+    """Cut a timeout down to what is left of the current request's budget, raising if nothing is left."""
+    budget = _current.get()
+    if budget is None:
+        return timeout
+    budget.check()
+    left = budget.remaining()
+    return timeout if left is None else min(timeout, left)
+
+
+def sleep(seconds: float):
+    """time.sleep that gives up when the current request is cancelled or would overrun its deadline."""
+    budget = _current.get()
+    if budget is None:
+        time.sleep(seconds)
+    else:
+        budget.sleep(seconds)
+
+
+@contextmanager
+def attached(budget: Optional[Budget]):
+    """Make budget current in a context that did not inherit it (e.g. a job worker thread)."""
+    token = _current.set(budget)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def budget_from(header: Optional[str]) -> Budget:
+    """The budget a request asked for with X-Request-Timeout, capped at the max; the default when absent or malformed."""
+    seconds = REQUEST_TIMEOUT_SECONDS
+    if header:
+        try:
+            requested = float(header)
+            if requested > 0:
+                seconds = requested
+        except ValueError:
+            pass
+    return Budget(min(seconds, REQUEST_TIMEOUT_MAX_SECONDS))
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware that gives each HTTP request a Budget
+
+    When the client disconnects, the budget is cancelled (stopping the request's jobs and upstream calls)
+    and the handler with it. When the deadline passes before the response has started, the handler is
+    cancelled and the client gets a 504. Responses already streaming are left to finish.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        header = headers.get(TIMEOUT_HEADER)
+        budget = budget_from(header.decode("latin-1") if header else None)
+
+        body_read = asyncio.Event()
+        disconnected = asyncio.Event()
+        started = False
+        pending: List[dict] = []
+        if b"content-length" not in headers and b"transfer-encoding" not in headers:
+            # No body to wait for: take the empty request message now so disconnects are noticed during the handler
+            pending.append(await receive())
+            body_read.set()
+
+        async def receive_wrapper():
+            if pending:
+                return pending.pop()
+            if body_read.is_set():
+                # The watcher owns the connection once the body is in; the app only hears about the disconnect
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_read.set()
+            return message
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        async def watch():
+            await body_read.wait()
+            while not disconnected.is_set():
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+
+        token = _current.set(budget)
+        try:
+            handler = asyncio.ensure_future(self.app(scope, receive_wrapper, send_wrapper))
+        finally:
+            _current.reset(token)
+        watcher = asyncio.ensure_future(watch())
+        disconnect = asyncio.ensure_future(disconnected.wait())
+        try:
+            timeout = budget.remaining()
+            while True:
+                done, _ = await asyncio.wait({handler, disconnect}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if handler in done:
+                    handler.result()
+                    return
+                if disconnect in done:
+                    reason, status = "disconnect", CLIENT_CLOSED_REQUEST
+                elif started:
+                    # Past the deadline but already streaming: let the response finish
+                    timeout = None
+                    continue
+                else:
+                    reason, status = "deadline", 504
+                break
+
+            REQUESTS_CUT_SHORT.labels(reason).inc()
+            logger.info(f"Cancelling {scope.get('method')} {scope.get('path')}: "
+                        f"{'client disconnected' if reason == 'disconnect' else 'deadline passed'}")
+            budget.cancel()
+            handler.cancel()
+            try:
+                await handler
+            except (asyncio.CancelledError, Exception):
+                pass
+            if not started:
+                detail = "Client closed the request" if reason == "disconnect" else "The request deadline passed"
+                body = json.dumps({"detail": detail}).encode()
+                await send({"type": "http.response.start", "status": status,
+                            "headers": [(b"content-type", b"application/json"),
+                                        (b"content-length", str(len(body)).encode())]})
+                await send({"type": "http.response.body", "body": body})
+        finally:
+            watcher.cancel()
+            disconnect.cancel()
+            if not handler.done():
+                handler.cancel()
@@ -22,10 +22,12 @@ from nodes.preprocessing import ModelPreprocessor, ClothPreprocessor
 from nodes.warping import ClothWarper
 from nodes.fusion import ImageFusionNode
 from nodes.postprocessing import PostProcessor
+from image_normalize import open_normalized
 
 def load_image(image_path):
     """Load an image and convert it to the format expected by our nodes."""
-    img = Image.open(image_path).convert('RGB')
+    # Use the normalized working copy made at ingest when there is one
+    img = open_normalized(image_path)
     img_np = np.array(img)
     # Convert to tensor (BCHW format)
     img_tensor = torch.from_numpy(img_np).float() / 255.0
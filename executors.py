@@ -0,0 +1,185 @@
+"""
+Bulkhead executors for blocking work
+Separately sized pools for CPU/ML work (processes), upstream I/O and disk I/O, each with its own queue limit and metrics
+"""
+
+import os
+import time
+import asyncio
+import contextvars
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+from metrics import REGISTRY, Counter, Histogram
+import tracing
+
+# Pool sizes and queue limits (see .env.example)
+# Every server process gets its own CPU pool, and every pool process loads its own CLIP, so by default the
+# server processes share half the CPUs between them (serve.py sets WEB_CONCURRENCY to its worker count)
+SERVER_PROCESSES = max(1, int(os.environ.get("WEB_CONCURRENCY") or "1"))
+CPU_POOL_SIZE = int(os.environ.get("CPU_POOL_SIZE", str(max(1, (os.cpu_count() or 2) // (2 * SERVER_PROCESSES)))))
+CPU_POOL_QUEUE = int(os.environ.get("CPU_POOL_QUEUE", "32"))
+UPSTREAM_POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "16"))
+UPSTREAM_POOL_QUEUE = int(os.environ.get("UPSTREAM_POOL_QUEUE", "64"))
+DISK_POOL_SIZE = int(os.environ.get("DISK_POOL_SIZE", "4"))
+DISK_POOL_QUEUE = int(os.environ.get("DISK_POOL_QUEUE", "256"))
+
+EXECUTOR_WAIT_SECONDS = Histogram("executor_wait_seconds", "Time work waits for a free worker in a pool", ("pool",))
+EXECUTOR_RUN_SECONDS = Histogram("executor_run_seconds", "Time work runs on a pool worker", ("pool",))
+EXECUTOR_REJECTED = Counter("executor_rejected_total", "Work turned away because a pool's queue was full", ("pool",))
+
+
+class BulkheadFull(Exception):
+    """Raised when a pool already has as much work queued as it accepts."""
+
+
+def _timed_call(fn: Callable, args: tuple, kwargs: dict):
+    """Run fn and report when it started and finished (wall clock, comparable across processes)."""
+    started = time.time()
+    result = fn(*args, **kwargs)
+    return started, time.time(), result
+
+
+class Bulkhead:
+    """A named, bounded executor: at most `workers` items run and `queue_limit` wait; the rest are rejected."""
+
+    def __init__(self, name: str, workers: int, queue_limit: int, processes: bool = False,
+                 initializer: Optional[Callable[[], Any]] = None):
+        """
+        Initialize the pool (the executor itself starts on first use)
+
+        Args:
+            name: Pool name used in metrics and errors
+            workers: Number of concurrent workers
+            queue_limit: Maximum number of items waiting for a worker
+            processes: Use worker processes (for CPU-bound Python) instead of threads
+            initializer: Called once in each worker process before it takes work
+        """
+        self.name = name
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.processes = processes
+        self.initializer = initializer
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.processes:
+                # spawn, not fork: the server process has threads whose locks a forked child could inherit held
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=self.initializer,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-pool")
+        return self._executor
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a blocking callable on this pool and await its result
+
+        Thread pools run it inside a copy of the caller's context, so context variables carry over.
+        Process pools need fn and its arguments to be picklable.
+
+        Raises:
+            BulkheadFull: If the pool's queue is full
+        """
+        if self.in_flight >= self.workers + self.queue_limit:
+            self.rejected += 1
+            EXECUTOR_REJECTED.labels(self.name).inc()
+            raise BulkheadFull(f"The {self.name} pool is busy ({self.in_flight} requests in flight); try again shortly")
+
+        loop = asyncio.get_running_loop()
+        call = partial(_timed_call, fn, args, kwargs)
+
+        submitted = time.time()
+        self.in_flight += 1
+        try:
+            with tracing.span(f"pool.{self.name}", function=getattr(fn, "__name__", "call")) as active:
+                if not self.processes:
+                    # Copied inside the span so spans opened on the worker thread nest under it
+                    call = partial(contextvars.copy_context().run, call)
+                started, finished, result = await loop.run_in_executor(self.executor, call)
+                if active:
+                    active.set(wait_seconds=round(max(0.0, started - submitted), 6))
+        except BrokenProcessPool:
+            # A worker process died (e.g. out of memory); start a fresh pool for the next caller
+            self.shutdown()
+            raise
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        EXECUTOR_WAIT_SECONDS.labels(self.name).observe(max(0.0, started - submitted))
+        EXECUTOR_RUN_SECONDS.labels(self.name).observe(finished - started)
+        return result
+
+    def warm_up(self, fn: Callable[[], Any]) -> list:
+        """Start every worker and run fn once per worker slot, blocking until done (call from a warm-up thread)."""
+        futures = [self.executor.submit(fn) for _ in range(self.workers)]
+        try:
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            # Let a retried warm-up (or the next caller) start a fresh pool
+            self.shutdown()
+            raise
+
+    def shutdown(self):
+        if self._executor is not None:
+            if self.processes:
+                # Workers still in their initializer (loading CLIP) would otherwise outlive the server
+                for process in list((getattr(self._executor, "_processes", None) or {}).values()):
+                    process.terminate()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "kind": "process" if self.processes else "thread",
+        }
+
+
+def _init_cpu_worker():
+    import cpu_tasks
+    cpu_tasks.init_worker()
+
+
+# Image analysis (KMeans, CLIP): separate processes so it neither holds the server's GIL nor competes with I/O pools
+cpu_pool = Bulkhead("cpu", CPU_POOL_SIZE, CPU_POOL_QUEUE, processes=True, initializer=_init_cpu_worker)
+# Blocking calls to LLMs and other upstream services
+upstream_pool = Bulkhead("upstream", UPSTREAM_POOL_SIZE, UPSTREAM_POOL_QUEUE)
+# File reads, writes and image encoding
+disk_pool = Bulkhead("disk", DISK_POOL_SIZE, DISK_POOL_QUEUE)
+
+POOLS = (cpu_pool, upstream_pool, disk_pool)
+
+
+def shutdown():
+    """Stop every pool (call from the app's shutdown hook)."""
+    for pool in POOLS:
+        pool.shutdown()
+
+
+def stats() -> Dict[str, Any]:
+    return {pool.name: pool.stats() for pool in POOLS}
+
+
+def _collect():
+    for name, field, documentation in (
+        ("executor_in_flight", "in_flight", "Work running or waiting in a pool"),
+        ("executor_workers", "workers", "Configured workers in a pool"),
+        ("executor_queue_limit", "queue_limit", "Maximum work waiting in a pool before rejection"),
+    ):
+        yield name, "gauge", documentation, [({"pool": pool.name}, getattr(pool, field)) for pool in POOLS]
+
+
+REGISTRY.register_collector(_collect)
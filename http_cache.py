@@ -0,0 +1,176 @@
+"""
+HTTP caching for served images
+Strong content-hash ETags, Cache-Control (immutable for names that hash their own bytes), 304 Not Modified and byte ranges
+"""
+
+import os
+import re
+import time
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from executors import disk_pool, BulkheadFull
+from metrics import Counter, Histogram
+from result_cache import file_sha256, memoized_sha256
+from storage import record_access
+
+# Cache lifetimes (see .env.example)
+MUTABLE_MAX_AGE = int(os.environ.get("IMAGE_CACHE_MAX_AGE", "300"))
+IMMUTABLE_MAX_AGE = 31536000
+RANGE_CHUNK_SIZE = 256 * 1024
+
+SERVED_BYTES = Counter("served_bytes_total", "Bytes of image bodies sent, by directory the file was served from", ("directory",))
+FILE_LOOKUP_SECONDS = Histogram("file_lookup_seconds", "Time to resolve and stat a requested file, by base directory", ("directory",))
+
+# Uploads are named <sha256 of their bytes>.<ext>, so they and their derived variants never change once
+# written. Prefixed names (tryon_<digest>, prompt_<digest>) hash the request, not the output: an evicted
+# entry is regenerated with different bytes under the same name, so those must be revalidated.
+_CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}(?:\.|$)")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def resolve_file(base_dir: str, *parts: str) -> Optional[str]:
+    """Join path segments under base_dir, returning None if the result escapes it or is not a file."""
+    started = time.perf_counter()
+    base = os.path.realpath(base_dir)
+    path = os.path.realpath(os.path.join(base, *parts))
+    found = os.path.commonpath([base, path]) == base and os.path.isfile(path)
+    FILE_LOOKUP_SECONDS.labels(os.path.basename(base)).observe(time.perf_counter() - started)
+    return path if found else None
+
+
+def is_content_addressed(filename: str) -> bool:
+    """Whether a filename is (or derives from) the hash of its own bytes."""
+    return bool(_CONTENT_ADDRESSED.match(filename))
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    # If-None-Match uses weak comparison
+    return any(tag == etag or tag == f"W/{etag}" for tag in candidates)
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header
+
+    Returns:
+        (start, end) inclusive, or None to serve the whole file
+
+    Raises:
+        ValueError: If the range cannot be satisfied
+    """
+    match = _RANGE.match(header.strip())
+    if not match:
+        # Multiple or malformed ranges: answering with the full body is always allowed
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def _iter_file_range(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def _etag(path: str, stat: os.stat_result) -> str:
+    """Strong ETag from the content hash; hashing a file for the first time runs on the disk pool."""
+    digest = memoized_sha256(path)
+    if digest is None:
+        try:
+            digest = await disk_pool.run(file_sha256, path)
+        except BulkheadFull:
+            # Don't hash on the event loop: a weak validator from size and mtime will do until the pool frees up
+            return f'W/"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    return f'"{digest}"'
+
+
+async def cached_file_response(request: Request, path: str, media_type: Optional[str] = None,
+                               vary: Optional[str] = None) -> Response:
+    """
+    Serve a file with validators and cache headers, honouring conditional and range requests
+
+    Args:
+        request: Incoming request (for If-None-Match, If-Modified-Since, Range, If-Range)
+        path: File to serve
+        media_type: Content type; guessed from the filename when None
+        vary: Request headers the representation was chosen by (e.g. "Accept"), for shared caches
+
+    Returns:
+        200 FileResponse, 206 partial content, 304 Not Modified or 416
+    """
+    stat = os.stat(path)
+    record_access(path)
+    served = SERVED_BYTES.labels(os.path.basename(os.path.dirname(path)))
+    etag = await _etag(path, stat)
+    if is_content_addressed(os.path.basename(path)):
+        cache_control = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache_control = f"public, max-age={MUTABLE_MAX_AGE}, must-revalidate"
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    if vary:
+        headers["Vary"] = vary
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get("if-modified-since") and _not_modified_since(request.headers["if-modified-since"], stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range needs a strong validator; with a weak one the whole file is sent
+    if range_header and (if_range is None or (if_range.strip() == etag and not etag.startswith("W/"))):
+        try:
+            byte_range = _parse_range(range_header, stat.st_size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{stat.st_size}"})
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+            served.inc(end - start + 1)
+            return StreamingResponse(_iter_file_range(path, start, end), status_code=206,
+                                     headers=headers, media_type=media_type)
+
+    served.inc(stat.st_size)
+    return FileResponse(path, media_type=media_type, headers=headers)
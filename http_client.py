@@ -0,0 +1,196 @@
+"""
+Shared outbound HTTP client for Segmind and other upstream calls
+One pooled, keep-alive aiohttp session lives for the lifetime of the app and is reused by every request
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import concurrent.futures
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+from multidict import CIMultiDict
+
+from metrics import Histogram
+from upstream_guard import UpstreamGuard
+import deadline
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings (see .env.example)
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "100"))
+HTTP_POOL_PER_HOST = int(os.environ.get("HTTP_POOL_PER_HOST", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_SECONDS", "30"))
+HTTP_DEFAULT_TIMEOUT = float(os.environ.get("HTTP_DEFAULT_TIMEOUT", "120"))
+
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds",
+    "Outbound HTTP request latency by upstream host and response status (\"error\" for connection failures)",
+    ("host", "method", "status"),
+)
+
+_session: Optional[aiohttp.ClientSession] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream request fails at the connection level or times out."""
+
+
+class UpstreamResponse:
+    """Fully-read upstream response, shaped like a requests.Response for the fields we use."""
+
+    def __init__(self, status_code: int, headers: CIMultiDict, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+def _create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_SIZE,
+        limit_per_host=HTTP_POOL_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+    )
+    # Cookies are sent per request only; nothing is remembered between callers
+    return aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+
+
+async def startup():
+    """Create the shared session on the running loop (call from the app's startup hook)."""
+    global _session, _loop
+    if _session is None or _session.closed:
+        _session = _create_session()
+        _loop = asyncio.get_running_loop()
+        logger.info(f"Shared HTTP session started (pool {HTTP_POOL_SIZE}, per host {HTTP_POOL_PER_HOST})")
+
+
+async def shutdown():
+    """Close the shared session (call from the app's shutdown hook)."""
+    global _session, _loop
+    if _session is not None:
+        await _session.close()
+        logger.info("Shared HTTP session closed")
+    _session = None
+    _loop = None
+
+
+async def request(method: str, url: str, *, headers: Optional[Dict[str, str]] = None,
+                  cookies: Optional[Dict[str, str]] = None, json: Any = None,
+                  timeout: float = HTTP_DEFAULT_TIMEOUT, guard: Optional[UpstreamGuard] = None) -> UpstreamResponse:
+    """
+    Make an HTTP request on the shared session and read the whole body
+
+    Args:
+        method: HTTP method
+        url: Target URL
+        headers: Request headers
+        cookies: Cookies for this request only
+        json: JSON body
+        timeout: Total timeout in seconds (not counting time waiting on the guard); cut to the
+            remaining request deadline (see deadline.py) when that is sooner
+        guard: Concurrency limiter and circuit breaker of the upstream (see upstream_guard.py)
+
+    Returns:
+        UpstreamResponse with status code, headers and body
+
+    Raises:
+        UpstreamError: On connection errors and timeouts
+        UpstreamUnavailable: If the guard's circuit is open or it has no capacity in time
+        DeadlineExceeded: If the request deadline passes first
+        Cancelled: If the client of the request went away
+    """
+    deadline.check()
+    if guard is not None:
+        await guard.acquire(deadline.remaining())
+    shared = _session is not None and not _session.closed and _loop is asyncio.get_running_loop()
+    session = _session if shared else _create_session()
+    host = urlsplit(url).hostname or "unknown"
+    path = urlsplit(url).path
+    status = "error"
+    # What the guard is told: the status, "error" for connection failures, None if the call was abandoned
+    result = None
+    retry_after = None
+    started = time.perf_counter()
+    cut_short = False
+    try:
+        # Never wait on the upstream past the request deadline
+        deadline.check()
+        left = deadline.remaining()
+        if left is not None and left < timeout:
+            timeout, cut_short = left, True
+        with tracing.span(f"http.{method}", **{"http.host": host, "http.path": path}) as active:
+            async with session.request(method, url, headers=headers, cookies=cookies, json=json,
+                                       timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                content = await response.read()
+                status = str(response.status)
+                result = response.status
+                retry_after = response.headers.get("Retry-After")
+                if active:
+                    active.set(**{"http.status_code": response.status, "http.response_bytes": len(content)})
+                return UpstreamResponse(response.status, CIMultiDict(response.headers), content)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        if cut_short and isinstance(e, asyncio.TimeoutError):
+            # Our deadline, not the upstream's fault: leave the result as abandoned for the guard
+            raise deadline.DeadlineExceeded(f"{method} {url} did not finish before the request deadline") from e
+        result = "error"
+        raise UpstreamError(f"{method} {url} failed: {str(e) or type(e).__name__}") from e
+    finally:
+        elapsed = time.perf_counter() - started
+        UPSTREAM_LATENCY.labels(host, method, status).observe(elapsed)
+        if guard is not None:
+            guard.release(result, elapsed, path, retry_after)
+        if not shared:
+            await session.close()
+
+
+def request_blocking(method: str, url: str, **kwargs) -> UpstreamResponse:
+    """
+    Synchronous wrapper around request() for worker threads
+
+    Runs the request on the app's event loop so it shares the pooled session.
+    Outside a running app (scripts, tests) it falls back to a one-off session.
+    """
+    loop = _loop
+    if loop is not None and loop.is_running():
+        if _running_on(loop):
+            raise RuntimeError("request_blocking() called on the event loop thread; await request() instead")
+        # The coroutine runs on the loop, outside this thread's context; carry the span and budget over
+        parent = tracing.current_span()
+        budget = deadline.current()
+
+        async def call():
+            with tracing.attached(parent), deadline.attached(budget):
+                return await request(method, url, **kwargs)
+
+        future = asyncio.run_coroutine_threadsafe(call(), loop)
+        if budget is None:
+            return future.result()
+        # A cancelled budget cancels the call on the loop instead of leaving it to finish unread
+        forget = budget.on_cancel(future.cancel)
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            raise deadline.Cancelled(f"{method} {url} was cancelled: the client is no longer waiting")
+        finally:
+            forget()
+    return asyncio.run(request(method, url, **kwargs))
+
+
+def _running_on(loop: asyncio.AbstractEventLoop) -> bool:
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
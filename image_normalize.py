@@ -0,0 +1,103 @@
+"""
+One-time image normalization for uploaded images
+Applies EXIF orientation, a bounded decode and a resize to the working resolution, and stores the result next to the original
+"""
+
+import os
+import logging
+import threading
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Normalization settings (see .env.example)
+WORKING_MAX_DIMENSION = int(os.environ.get("IMAGE_WORKING_MAX_DIMENSION", "1024"))
+MAX_DECODE_PIXELS = int(os.environ.get("IMAGE_MAX_DECODE_PIXELS", str(50 * 1000 * 1000)))
+NORMALIZED_SUFFIX = ".norm.jpg"
+JPEG_QUALITY = 92
+
+
+class ImageTooLarge(ValueError):
+    """Raised when an image's pixel count exceeds MAX_DECODE_PIXELS."""
+
+
+def normalized_path_for(path: str) -> str:
+    """Return where the normalized variant of an image lives."""
+    if path.endswith(NORMALIZED_SUFFIX):
+        return path
+    return os.path.splitext(path)[0] + NORMALIZED_SUFFIX
+
+
+def _normalize(path: str) -> Image.Image:
+    """Decode an image at (roughly) working resolution and return an upright RGB copy."""
+    with Image.open(path) as img:
+        if img.width * img.height > MAX_DECODE_PIXELS:
+            raise ImageTooLarge(f"Image is {img.width}x{img.height}, above the {MAX_DECODE_PIXELS} pixel decode limit")
+
+        # JPEGs can be decoded directly at a reduced DCT scale, skipping most of the work
+        img.draft("RGB", (WORKING_MAX_DIMENSION, WORKING_MAX_DIMENSION))
+        img = ImageOps.exif_transpose(img)
+
+        # Flatten transparency onto white, which is what garment photos are shot on
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        else:
+            img = img.convert("RGB")
+
+        img.thumbnail((WORKING_MAX_DIMENSION, WORKING_MAX_DIMENSION), Image.LANCZOS, reducing_gap=3.0)
+        return img
+
+
+def normalize_image(path: str) -> str:
+    """
+    Write the normalized variant of an image and return its path
+
+    Args:
+        path: Original image path
+
+    Returns:
+        Path of the normalized JPEG next to the original
+
+    Raises:
+        ImageTooLarge: If the image exceeds the decode limit
+    """
+    output_path = normalized_path_for(path)
+    if output_path == path:
+        return path
+
+    img = _normalize(path)
+    # Unique per thread too: concurrent uploads of the same content, or try-ons of the same input,
+    # normalize to the same output path
+    tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        img.save(tmp_path, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.info(f"Normalized {path} to {img.width}x{img.height} at {output_path}")
+    return output_path
+
+
+def ensure_normalized(path: str) -> str:
+    """Return the normalized variant of an image, creating it if it is missing or stale."""
+    output_path = normalized_path_for(path)
+    try:
+        if os.path.getmtime(output_path) >= os.path.getmtime(path):
+            return output_path
+    except OSError:
+        pass
+    return normalize_image(path)
+
+
+def open_normalized(path: str) -> Image.Image:
+    """Open an image at working resolution without writing anything to disk."""
+    output_path = normalized_path_for(path)
+    if os.path.exists(output_path):
+        return Image.open(output_path).convert("RGB")
+    return _normalize(path)
@@ -0,0 +1,124 @@
+"""
+Served-image variants for results and generated garments
+Picks WebP/JPEG from the Accept header and snaps ?w= to a fixed set of widths; variants are stored beside the original
+"""
+
+import io
+import os
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+# Variant settings (see .env.example)
+VARIANT_WIDTHS = tuple(sorted(int(w) for w in os.environ.get("VARIANT_WIDTHS", "160,320,480,640,960,1280").split(",") if w.strip()))
+WEBP_QUALITY = int(os.environ.get("VARIANT_WEBP_QUALITY", "80"))
+JPEG_QUALITY = int(os.environ.get("VARIANT_JPEG_QUALITY", "85"))
+
+# Encodings we produce, with their file extension and media type
+FORMATS = {
+    "webp": (".webp", "image/webp"),
+    "jpeg": (".jpg", "image/jpeg"),
+    "png": (".png", "image/png"),
+}
+_EXTENSION_FORMATS = {".webp": "webp", ".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png"}
+
+
+def parse_accept(header: Optional[str]) -> Dict[str, float]:
+    """Parse an Accept header into {media range: q}."""
+    accepted = {}
+    for part in (header or "").split(","):
+        fields = [field.strip() for field in part.split(";")]
+        if not fields[0]:
+            continue
+        q = 1.0
+        for field in fields[1:]:
+            if field.startswith("q="):
+                try:
+                    q = float(field[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[fields[0].lower()] = q
+    return accepted
+
+
+def _quality(accepted: Dict[str, float], media_type: str) -> float:
+    if media_type in accepted:
+        return accepted[media_type]
+    return accepted.get("image/*", accepted.get("*/*", 0.0))
+
+
+def negotiate_format(accept: Optional[str], filename: str) -> Optional[str]:
+    """
+    Choose the encoding to serve for an image
+
+    WebP is used whenever the client lists it; JPEG only when the client prefers it to the
+    original's format (JPEG drops transparency, so PNG is never swapped for it silently).
+
+    Returns:
+        "webp" or "jpeg" to re-encode, or None to keep the original format
+    """
+    original = _EXTENSION_FORMATS.get(os.path.splitext(filename)[1].lower())
+    if original is None:
+        return None
+    accepted = parse_accept(accept)
+    if original != "webp" and accepted.get("image/webp", 0.0) > 0:
+        return "webp"
+    if original != "jpeg" and _quality(accepted, "image/jpeg") > _quality(accepted, FORMATS[original][1]):
+        return "jpeg"
+    return None
+
+
+def snap_width(width: Optional[int]) -> Optional[int]:
+    """Round a requested width up to the nearest configured variant width (the largest if beyond them)."""
+    if not width or width <= 0:
+        return None
+    for candidate in VARIANT_WIDTHS:
+        if candidate >= width:
+            return candidate
+    return VARIANT_WIDTHS[-1] if VARIANT_WIDTHS else None
+
+
+def variant_name(filename: str, width: Optional[int], fmt: Optional[str]) -> str:
+    """Name of a variant stored beside the original: <stem>.w320.webp, <stem>.jpg, <stem>.w640.png."""
+    stem, extension = os.path.splitext(filename)
+    suffix = f".w{width}" if width else ""
+    return f"{stem}{suffix}{FORMATS[fmt][0] if fmt else extension}"
+
+
+def media_type_for(filename: str) -> Optional[str]:
+    fmt = _EXTENSION_FORMATS.get(os.path.splitext(filename)[1].lower())
+    return FORMATS[fmt][1] if fmt else None
+
+
+def render_variant(source_path: str, width: Optional[int], fmt: Optional[str]) -> Tuple[bytes, bool]:
+    """
+    Resize and re-encode an image (runs on the CPU pool)
+
+    Args:
+        source_path: Original image
+        width: Target width; images are never upscaled
+        fmt: "webp", "jpeg", "png" or None to keep the original format
+
+    Returns:
+        (encoded bytes, whether the result differs from the original)
+    """
+    with Image.open(source_path) as img:
+        original = (img.format or "PNG").lower()
+        fmt = fmt or _EXTENSION_FORMATS.get(os.path.splitext(source_path)[1].lower(), original)
+        resize = bool(width) and img.width > width
+        if not resize and fmt == original:
+            return b"", False
+
+        img.load()
+        if resize:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS,
+                             reducing_gap=3.0)
+
+        buffer = io.BytesIO()
+        if fmt == "jpeg":
+            img.convert("RGB").save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        elif fmt == "webp":
+            img.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=4)
+        else:
+            img.save(buffer, format="PNG", optimize=False, compress_level=6)
+        return buffer.getvalue(), True
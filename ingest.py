@@ -0,0 +1,173 @@
+"""
+Upload ingestion for model, clothing and outfit images
+Streams uploads to disk in chunks, enforces a size cap, stores each distinct content once by SHA-256
+and writes a normalized working copy once per stored image
+"""
+
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+from typing import Dict, Any, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from image_normalize import normalize_image, normalized_path_for
+from blob_store import store, make_key
+from metrics import Counter
+from storage import record_access
+
+logger = logging.getLogger(__name__)
+
+# Upload settings (see .env.example); UPLOAD_DIR holds uploads while they stream in
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "uploads")
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", str(10 * 1024 * 1024)))
+CHUNK_SIZE = 1024 * 1024
+
+# Leading bytes of the image formats we accept, mapped to their canonical extension
+_MAGIC_EXTENSIONS = (
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+    (b"BM", ".bmp"),
+)
+_KNOWN_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp"}
+
+UPLOAD_BYTES_READ = Counter("upload_bytes_read_total", "Bytes received from client uploads", ("kind",))
+UPLOAD_BYTES_WRITTEN = Counter("upload_bytes_written_total", "Bytes of new (non-duplicate) content stored under uploads", ("kind",))
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured byte limit."""
+
+
+class UnsupportedImage(Exception):
+    """Raised when an upload is not one of the accepted image formats."""
+
+
+def _detect_extension(head: bytes, filename: Optional[str]) -> str:
+    """Pick a canonical extension from the file's magic bytes, falling back to its name."""
+    for magic, extension in _MAGIC_EXTENSIONS:
+        if head.startswith(magic):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".jpeg":
+        return ".jpg"
+    return extension if extension in _KNOWN_EXTENSIONS else ".bin"
+
+
+def _store(tmp_path: str, kind: str, content_id: str, extension: str) -> Dict[str, Any]:
+    """Move a fully written temp file into the blob store under its content-addressed key, dropping it if already stored."""
+    key = make_key(f"uploads/{kind}", f"{content_id}{extension}")
+    duplicate = store.exists(key)
+    if duplicate:
+        os.remove(tmp_path)
+        final_path = store.local_path(key)
+        # Re-uploads count as use, so the janitor keeps popular images
+        record_access(final_path)
+    else:
+        final_path = store.put_file(key, tmp_path)
+    return {
+        "content_id": content_id,
+        "key": key,
+        "path": final_path,
+        "normalized_path": _normalize_stored(final_path),
+        "size": os.path.getsize(final_path),
+        "duplicate": duplicate,
+    }
+
+
+def _normalize_stored(path: str) -> Optional[str]:
+    """Create the normalized working copy of a stored image once; None if it is not a decodable image."""
+    normalized_path = normalized_path_for(path)
+    if os.path.exists(normalized_path):
+        return normalized_path
+    try:
+        return normalize_image(path)
+    except Exception as e:
+        logger.warning(f"Could not normalize {path}: {str(e)}")
+        return None
+
+
+async def ingest_upload(upload, kind: str, max_bytes: int = MAX_UPLOAD_SIZE) -> Dict[str, Any]:
+    """
+    Stream an uploaded file to the blob store as uploads/<kind>/<sha256><ext>
+
+    Args:
+        upload: FastAPI UploadFile
+        kind: Upload folder (models, clothes, ...)
+        max_bytes: Maximum accepted size in bytes
+
+    Returns:
+        Dict with content_id, key (blob key, also the public path), path (local copy), normalized_path,
+        size and duplicate (True if the content was already stored)
+
+    Raises:
+        UploadTooLarge: If the upload exceeds max_bytes
+        UnsupportedImage: If neither the content nor the file name is an accepted image format
+    """
+    directory = os.path.join(UPLOAD_DIR, kind)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".incoming_{uuid.uuid4().hex}")
+
+    sha = hashlib.sha256()
+    size = 0
+    head = b""
+    try:
+        with open(tmp_path, "wb") as buffer:
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                UPLOAD_BYTES_READ.labels(kind).inc(len(chunk))
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+                if not head:
+                    head = chunk[:16]
+                sha.update(chunk)
+                await run_in_threadpool(buffer.write, chunk)
+
+        extension = _detect_extension(head, upload.filename)
+        if extension == ".bin":
+            raise UnsupportedImage(f"Unsupported image type: {upload.filename or 'upload'}")
+        result = await run_in_threadpool(_store, tmp_path, kind, sha.hexdigest(), extension)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if result["duplicate"]:
+        logger.info(f"Upload to {kind} deduplicated to existing {result['path']}")
+    else:
+        UPLOAD_BYTES_WRITTEN.labels(kind).inc(result["size"])
+    return result
+
+
+def ingest_local_file(source_path: str, kind: str) -> Dict[str, Any]:
+    """
+    Add an existing server-side file (e.g. a generated garment) to uploads/<kind>/ by content
+
+    The stored copy is a hard link to the source where the filesystem allows it.
+    """
+    directory = os.path.join(UPLOAD_DIR, kind)
+    os.makedirs(directory, exist_ok=True)
+
+    sha = hashlib.sha256()
+    with open(source_path, "rb") as f:
+        head = f.read(16)
+        sha.update(head)
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+
+    tmp_path = os.path.join(directory, f".incoming_{uuid.uuid4().hex}")
+    try:
+        os.link(source_path, tmp_path)
+    except OSError:
+        shutil.copyfile(source_path, tmp_path)
+    return _store(tmp_path, kind, sha.hexdigest(), _detect_extension(head, source_path))
@@ -0,0 +1,505 @@
+"""
+Asynchronous job queue for long-running try-on work
+Jobs are accepted immediately and processed by a bounded pool of workers; clients poll or stream status and stages
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import logging
+from functools import partial
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from executors import disk_pool, BulkheadFull
+from metrics import Counter, Histogram
+from upstream_guard import UpstreamUnavailable
+import deadline
+import progress
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Job queue settings (see .env.example)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", "10000"))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", "3600"))
+# Shared directory of job snapshots so any worker process can answer for any job (empty: in-memory only)
+JOB_STATE_DIR = os.environ.get("JOB_STATE_DIR", "")
+JOB_STATE_POLL_SECONDS = 1.0
+# Snapshot changes within this window are written together, each job once with its latest state
+JOB_STATE_FLUSH_SECONDS = 0.1
+# How often finished jobs past the retention window are forgotten
+JOB_PRUNE_INTERVAL_SECONDS = 60.0
+
+JOB_WAIT_SECONDS = Histogram("job_wait_seconds", "Time jobs spend queued before a worker picks them up", ("kind",))
+JOB_RUN_SECONDS = Histogram("job_run_seconds", "Time jobs spend running on a worker", ("kind",))
+JOBS_FINISHED = Counter("jobs_finished_total", "Finished jobs by kind and outcome", ("kind", "status"))
+JOBS_COALESCED = Counter("jobs_coalesced_total", "Submissions answered by an identical job already queued or running", ("kind",))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    """A unit of work tracked by the JobQueue."""
+
+    def __init__(self, kind: str, fn: Callable[[], Any], key: Optional[str] = None,
+                 budget: Optional[deadline.Budget] = None, detached: bool = False):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.fn = fn
+        self.key = key
+        self.status = QUEUED
+        self.result: Any = None
+        self.error: Optional[str] = None
+        # HTTP status a failure maps to: 503 when an upstream was unavailable, 504 past the deadline (None: 500)
+        self.error_status: Optional[int] = None
+        # Seconds the client should wait before retrying, when the job failed because an upstream was unavailable
+        self.retry_after: Optional[float] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Pipeline stages reached so far (see progress.py), with timestamps
+        self.stages = [progress.stage_event(progress.QUEUED, {}, self.created_at)]
+        # Span of the request that submitted the job, so the work shows up in its trace
+        self.trace_parent = tracing.current_span()
+        # Deadline of the requests waiting on the job, and its cancellation once none of them is left
+        self.budget = budget or deadline.Budget()
+        # Detached jobs (submitted to be polled later) keep running when their followers go away
+        self.detached = detached
+        self.followers = 0
+        self._changed = asyncio.Event()
+        # False for snapshots of jobs owned by another worker process
+        self.local = True
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "Job":
+        """Rebuild a read-only job from a snapshot written by another process."""
+        job = cls(data["kind"], None)
+        job.id = data["job_id"]
+        job.status = data["status"]
+        job.result = data.get("result")
+        job.error = data.get("error")
+        job.error_status = data.get("error_status")
+        job.retry_after = data.get("retry_after")
+        job.created_at = data["created_at"]
+        job.started_at = data.get("started_at")
+        job.finished_at = data.get("finished_at")
+        job.stages = data.get("stages", [])
+        job.local = False
+        return job
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+    def _set_status(self, status: str):
+        self.status = status
+        self._notify()
+
+    def _notify(self):
+        # Wake every waiter, then re-arm for the next transition
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return a JSON-serializable snapshot of the job."""
+        now = time.time()
+        started = self.started_at or (now if not self.done else self.finished_at)
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "error_status": self.error_status,
+            "retry_after": self.retry_after,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "stages": list(self.stages),
+            "wait_seconds": round(started - self.created_at, 3),
+            "run_seconds": round((self.finished_at or now) - self.started_at, 3) if self.started_at else None,
+        }
+
+
+class JobQueue:
+    """Bounded FIFO of jobs drained by a fixed number of worker tasks."""
+
+    def __init__(self, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING,
+                 retention_seconds: int = JOB_RETENTION_SECONDS, state_dir: str = JOB_STATE_DIR):
+        """
+        Initialize the job queue
+
+        Args:
+            workers: Number of jobs processed concurrently
+            max_pending: Maximum number of queued (not yet running) jobs
+            retention_seconds: How long finished jobs stay available for polling
+            state_dir: Directory for job snapshots shared between worker processes; empty to keep jobs in memory only
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self.state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.coalesced = 0
+        # Unfinished jobs by request key, so identical submissions share one job
+        self._in_flight: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._wait_times = deque(maxlen=1000)
+        self._run_times = deque(maxlen=1000)
+        # Jobs whose snapshot changed since the last write, and the task writing them
+        self._dirty: "OrderedDict[str, Job]" = OrderedDict()
+        self._flusher: Optional[asyncio.Task] = None
+        self._pruner: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the worker tasks on the running event loop."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-worker")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._pruner = asyncio.create_task(self._prune_periodically())
+        logger.info(f"Job queue started with {self.workers} workers (max pending {self.max_pending})")
+
+    async def stop(self):
+        """Cancel the worker tasks, write pending snapshots and release the worker threads."""
+        tasks = self._tasks + [self._pruner] if self._pruner else self._tasks
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._pruner = None
+        if self._flusher is not None:
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        if self._dirty:
+            # Last chance (e.g. the disk pool was full): write what is left here
+            self._write_snapshots(self._take_snapshots())
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def submit(self, kind: str, fn: Callable[[], Any], key: Optional[str] = None,
+               budget: Optional[deadline.Budget] = None, detached: bool = False) -> Job:
+        """
+        Enqueue a blocking callable and return its job immediately
+
+        Args:
+            kind: Job type label (e.g. "tryon")
+            fn: Zero-argument callable run on a worker thread; its return value becomes the job result
+            key: Normalized request key; while a job with the same kind and key is queued or
+                running, that job is returned instead of queuing a duplicate
+            budget: Deadline the job must finish by (see deadline.py); None for no deadline
+            detached: Keep the job running when nobody is waiting on it (jobs submitted for polling);
+                otherwise it is cancelled once its last waiter goes away
+
+        Raises:
+            JobQueueFull: If max_pending jobs are already waiting
+        """
+        if self._queue is None:
+            raise RuntimeError("Job queue has not been started")
+        if key is not None:
+            key = f"{kind}:{key}"
+            existing = self._in_flight.get(key)
+            if existing is not None and not existing.done:
+                self.coalesced += 1
+                JOBS_COALESCED.labels(kind).inc()
+                logger.info(f"Coalesced {kind} submission onto in-flight job {existing.id}")
+                # The shared job runs until the latest of its requesters' deadlines
+                existing.budget.extend(budget)
+                existing.detached = existing.detached or detached
+                return existing
+        job = Job(kind, fn, key, deadline.Budget.derive(budget) if budget is not None else None, detached)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"Job queue is full ({self.max_pending} pending)")
+        self.jobs[job.id] = job
+        if key is not None:
+            self._in_flight[key] = job
+        self._persist(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by id, falling back to snapshots written by other worker processes."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            job = self._load(job_id)
+        return job
+
+    def _state_path(self, job_id: str) -> Optional[str]:
+        if not self.state_dir or not re.fullmatch(r"[0-9a-f]{32}", job_id):
+            return None
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _persist(self, job: Job):
+        """
+        Schedule the job's snapshot to be written for other worker processes
+
+        Called on the event loop; the write happens shortly after on the disk pool, so a burst of
+        transitions and progress stages costs one write per job.
+        """
+        if self._state_path(job.id) is None:
+            return
+        self._dirty[job.id] = job
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush())
+
+    def _take_snapshots(self) -> Dict[str, Dict[str, Any]]:
+        """Serialize the changed jobs (on the event loop, where they are mutated) and clear the dirty set."""
+        snapshots = {self._state_path(job_id): job.to_dict() for job_id, job in self._dirty.items()}
+        self._dirty.clear()
+        return snapshots
+
+    async def _flush(self):
+        """Write changed snapshots until none are left; the only writer, so an older snapshot never lands last."""
+        while self._dirty:
+            await asyncio.sleep(JOB_STATE_FLUSH_SECONDS)
+            pending = dict(self._dirty)
+            snapshots = self._take_snapshots()
+            try:
+                await disk_pool.run(self._write_snapshots, snapshots)
+            except BulkheadFull:
+                # Try again next round, unless a newer state has been queued meanwhile
+                for job_id, job in pending.items():
+                    self._dirty.setdefault(job_id, job)
+
+    @staticmethod
+    def _write_snapshots(snapshots: Dict[str, Dict[str, Any]]):
+        for path, snapshot in snapshots.items():
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_path, path)
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning(f"Could not persist job {snapshot.get('job_id')}: {str(e)}")
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        path = self._state_path(job_id)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return Job.from_snapshot(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _transition(self, job: Job, status: str):
+        job._set_status(status)
+        self._persist(job)
+
+    def _record_stage(self, job: Job, event: Dict[str, Any]):
+        job.stages.append(event)
+        job._notify()
+        self._persist(job)
+
+    def _reporter(self, job: Job, loop: asyncio.AbstractEventLoop) -> progress.Reporter:
+        """Progress reporter for a job's worker thread: timestamp there, record on the event loop."""
+        def reporter(stage: str, detail: Dict[str, Any]):
+            loop.call_soon_threadsafe(self._record_stage, job, progress.stage_event(stage, detail, job.created_at))
+        return reporter
+
+    def cancel(self, job: Job, reason: str):
+        """Stop a job nobody is waiting for: drop it if still queued, or cancel its budget so the worker gives up."""
+        if job.done or not job.local:
+            return
+        logger.info(f"Cancelling job {job.id} ({job.kind}): {reason}")
+        job.budget.cancel()
+        if job.key is not None and self._in_flight.get(job.key) is job:
+            # Identical submissions from now on start a fresh job rather than joining a cancelled one
+            del self._in_flight[job.key]
+        if job.status == QUEUED:
+            job.error = f"Cancelled: {reason}"
+            job.finished_at = time.time()
+            self.cancelled += 1
+            JOBS_FINISHED.labels(job.kind, CANCELLED).inc()
+            self._transition(job, CANCELLED)
+
+    @contextmanager
+    def _following(self, job: Job):
+        """Count a waiter on the job; the last one to leave an unfinished, attached job cancels it."""
+        if not job.local:
+            yield
+            return
+        job.followers += 1
+        try:
+            yield
+        finally:
+            job.followers -= 1
+            if job.followers == 0 and not job.done and not job.detached:
+                self.cancel(job, "no request is waiting for it any more")
+
+    @staticmethod
+    def _run(job: Job, reporter: progress.Reporter) -> Any:
+        with tracing.attached(job.trace_parent), deadline.attached(job.budget), progress.reporting_to(reporter):
+            tracing.record_span("job.queued", job.started_at - job.created_at, job_id=job.id)
+            with tracing.span(f"job.{job.kind}", job_id=job.id):
+                return job.fn()
+
+    async def wait(self, job: Job, timeout: Optional[float] = None) -> Job:
+        """Wait until a job reaches a terminal state."""
+        async def _wait():
+            while not job.done:
+                await job._changed.wait()
+        with self._following(job):
+            await asyncio.wait_for(_wait(), timeout)
+        return job
+
+    async def stream(self, job: Job, heartbeat: float = 15.0) -> AsyncIterator[Dict[str, Any]]:
+        """Yield a snapshot on every status or stage change (and periodically) until the job finishes."""
+        if not job.local:
+            async for snapshot in self._stream_snapshots(job, heartbeat):
+                yield snapshot
+            return
+        with self._following(job):
+            while True:
+                yield job.to_dict()
+                if job.done:
+                    return
+                try:
+                    await asyncio.wait_for(job._changed.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _stream_snapshots(self, job: Job, heartbeat: float) -> AsyncIterator[Dict[str, Any]]:
+        """Follow a job owned by another process by polling its snapshot."""
+        last_sent = 0.0
+        last_state = None
+        while job is not None:
+            state = (job.status, len(job.stages))
+            if state != last_state or time.monotonic() - last_sent >= heartbeat:
+                last_state = state
+                last_sent = time.monotonic()
+                yield job.to_dict()
+            if job.done:
+                return
+            await asyncio.sleep(JOB_STATE_POLL_SECONDS)
+            job = self._load(job.id)
+
+    async def _worker(self, index: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            if job.done:
+                # Cancelled while queued
+                job.fn = None
+                self._queue.task_done()
+                continue
+            job.started_at = time.time()
+            self._wait_times.append(job.started_at - job.created_at)
+            JOB_WAIT_SECONDS.labels(job.kind).observe(job.started_at - job.created_at)
+            self.running += 1
+            self._transition(job, RUNNING)
+            try:
+                job.result = await loop.run_in_executor(self._executor, partial(self._run, job, self._reporter(job, loop)))
+                job.finished_at = time.time()
+                self.completed += 1
+                self._transition(job, SUCCEEDED)
+            except asyncio.CancelledError:
+                raise
+            except deadline.Cancelled as e:
+                logger.info(f"Job {job.id} ({job.kind}) stopped: {str(e)}")
+                job.error = f"Cancelled: {str(e)}"
+                job.finished_at = time.time()
+                self.cancelled += 1
+                self._transition(job, CANCELLED)
+            except Exception as e:
+                logger.error(f"Job {job.id} ({job.kind}) failed: {str(e)}")
+                job.error = str(e)
+                if isinstance(e, UpstreamUnavailable):
+                    job.error_status = 503
+                    job.retry_after = e.retry_after
+                elif isinstance(e, deadline.DeadlineExceeded):
+                    job.error_status = 504
+                job.finished_at = time.time()
+                self.failed += 1
+                self._transition(job, FAILED)
+            finally:
+                job.finished_at = job.finished_at or time.time()
+                self._run_times.append(job.finished_at - job.started_at)
+                JOB_RUN_SECONDS.labels(job.kind).observe(job.finished_at - job.started_at)
+                if job.done:
+                    JOBS_FINISHED.labels(job.kind, job.status).inc()
+                self.running -= 1
+                if job.key is not None and self._in_flight.get(job.key) is job:
+                    del self._in_flight[job.key]
+                job.fn = None
+                self._queue.task_done()
+
+    async def _prune_periodically(self):
+        while True:
+            await asyncio.sleep(JOB_PRUNE_INTERVAL_SECONDS)
+            try:
+                await self._prune()
+            except BulkheadFull:
+                pass
+            except Exception as e:
+                logger.warning(f"Could not prune finished jobs: {str(e)}")
+
+    async def _prune(self):
+        """Forget finished jobs older than the retention window, deleting their snapshots on the disk pool."""
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.done and job.finished_at and job.finished_at < cutoff]
+        paths = []
+        for job_id in expired:
+            del self.jobs[job_id]
+            self._dirty.pop(job_id, None)
+            path = self._state_path(job_id)
+            if path:
+                paths.append(path)
+        if paths:
+            await disk_pool.run(self._remove_snapshots, paths)
+
+    @staticmethod
+    def _remove_snapshots(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, concurrency and wait/run time figures."""
+        def _summary(values):
+            if not values:
+                return {"avg": 0.0, "max": 0.0}
+            return {"avg": round(sum(values) / len(values), 3), "max": round(max(values), 3)}
+
+        return {
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_pending": self.max_pending,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "coalesced": self.coalesced,
+            "tracked_jobs": len(self.jobs),
+            "wait_seconds": _summary(list(self._wait_times)),
+            "run_seconds": _summary(list(self._run_times)),
+        }
@@ -0,0 +1,345 @@
+"""
+Load generator for the Virtual Try-On API
+Drives uploads, try-ons, clothing generation and the fashion endpoints at a target request rate (open loop) and reports throughput, latency percentiles and error rates
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shlex
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+import urllib.request
+from collections import defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+from PIL import Image, ImageDraw
+
+from mock_segmind import DEFAULT_PORT as MOCK_PORT
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+READY_TIMEOUT_SECONDS = 60.0
+
+SCENARIOS = ("upload", "tryon", "generate", "fashion")
+DEFAULT_MIX = "upload=2,tryon=4,generate=1,fashion=1"
+CATEGORIES = ("Upper body", "Lower body", "Dress")
+PROMPTS = ("red silk evening dress", "navy wool blazer", "white linen shirt", "black denim jeans",
+           "green knit sweater", "beige trench coat")
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Parse "scenario=weight,..." into {scenario: weight}."""
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if not name:
+            continue
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("The mix needs at least one scenario with a positive weight")
+    return mix
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of values (q in 0-100); 0.0 when empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def make_image(rng: random.Random, size=(768, 1024)) -> bytes:
+    """A small, unique JPEG (so uploads are not deduplicated)."""
+    image = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    x, y = rng.randrange(size[0] // 2), rng.randrange(size[1] // 2)
+    draw.rectangle((x, y, x + size[0] // 3, y + size[1] // 3), fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class Results:
+    """Outcomes of the requests sent, by scenario."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+
+    def record(self, scenario: str, latency: float, error: Optional[str] = None):
+        self.latencies[scenario].append(latency)
+        if error:
+            self.errors[scenario][error] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        rows = {}
+        for scenario in list(self.latencies) + ["total"]:
+            if scenario == "total":
+                latencies = [value for values in self.latencies.values() for value in values]
+                errors = defaultdict(int)
+                for counts in self.errors.values():
+                    for error, count in counts.items():
+                        errors[error] += count
+            else:
+                latencies, errors = self.latencies[scenario], self.errors[scenario]
+            failed = sum(errors.values())
+            rows[scenario] = {
+                "requests": len(latencies),
+                "errors": failed,
+                "error_rate": failed / len(latencies) if latencies else 0.0,
+                "throughput": (len(latencies) - failed) / elapsed if elapsed else 0.0,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": max(latencies, default=0.0),
+                "error_kinds": dict(errors),
+            }
+        return rows
+
+
+class LoadTest:
+    """Sends requests for a weighted mix of scenarios at a fixed rate, whether or not earlier ones have finished."""
+
+    def __init__(self, base_url: str, mix: Dict[str, float], rps: float, duration: float, timeout: float = 300.0,
+                 pool_size: int = 4, seeds: int = 0, seed: Optional[int] = None):
+        """
+        Args:
+            base_url: API root, e.g. http://127.0.0.1:8000
+            mix: Relative weight of each scenario
+            rps: Requests started per second
+            duration: Seconds to keep starting requests
+            timeout: Per-request timeout in seconds
+            pool_size: Model and cloth images uploaded up front for try-ons
+            seeds: Pin try-on and generation seeds to this many values so repeats hit the caches (0: all new)
+            seed: Seed for the scenario order and request contents, for repeatable runs
+        """
+        self.base_url = base_url.rstrip("/")
+        self.mix = mix
+        self.rps = rps
+        self.duration = duration
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.seeds = seeds
+        self.rng = random.Random(seed)
+        self.models: List[str] = []
+        self.clothes: List[str] = []
+        self.results = Results()
+
+    async def _upload(self, session: aiohttp.ClientSession, kind: str) -> dict:
+        image = await asyncio.to_thread(make_image, random.Random(self.rng.random()))
+        form = aiohttp.FormData()
+        form.add_field("file", image, filename=f"load_{kind}.jpg", content_type="image/jpeg")
+        async with session.post(f"{self.base_url}/api/upload/{kind}", data=form) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def setup(self, session: aiohttp.ClientSession):
+        """Upload the model and cloth images the try-on scenario picks from."""
+        for _ in range(self.pool_size):
+            self.models.append((await self._upload(session, "model"))["filename"])
+            self.clothes.append((await self._upload(session, "cloth"))["filename"])
+
+    def _request(self, scenario: str):
+        """Return (method, path, keyword arguments for session.request) for one request of scenario."""
+        rng = self.rng
+        if scenario == "upload":
+            return "UPLOAD", rng.choice(("model", "cloth")), {}
+        if scenario == "tryon":
+            body = {"model_path": rng.choice(self.models), "cloth_path": rng.choice(self.clothes),
+                    "clothing_category": rng.choice(CATEGORIES),
+                    "seed": rng.randrange(self.seeds) if self.seeds else rng.randrange(1, 2 ** 31)}
+            return "POST", "/api/tryon", {"json": body}
+        if scenario == "generate":
+            body = {"prompt": rng.choice(PROMPTS), "seed": rng.randrange(self.seeds) if self.seeds else None}
+            return "POST", "/api/generate-clothing", {"json": body}
+        endpoint = rng.choice(("color-coordination", "trend-analysis", "fashion-advice", "fashion-categories"))
+        if endpoint == "fashion-categories":
+            return "GET", "/api/fashion-categories", {}
+        form = {
+            "color-coordination": {"base_colors": rng.choice(("navy", "black,white", "olive")), "season": "autumn"},
+            "trend-analysis": {"season": rng.choice(("spring", "summer", "autumn", "winter"))},
+            "fashion-advice": {"question": f"What goes with a {rng.choice(PROMPTS)}?"},
+        }[endpoint]
+        return "POST", f"/api/{endpoint}", {"data": form}
+
+    async def _send(self, session: aiohttp.ClientSession, scenario: str):
+        method, path, kwargs = self._request(scenario)
+        started = time.perf_counter()
+        error = None
+        try:
+            if method == "UPLOAD":
+                await self._upload(session, path)
+            else:
+                async with session.request(method, f"{self.base_url}{path}", **kwargs) as response:
+                    body = await response.read()
+                    if response.status >= 400:
+                        error = str(response.status)
+                    elif body.startswith(b"{") and json.loads(body).get("success") is False:
+                        # The fashion endpoints report failures in a 200 body
+                        error = "success=false"
+        except aiohttp.ClientResponseError as e:
+            error = str(e.status)
+        except asyncio.TimeoutError:
+            error = "timeout"
+        except aiohttp.ClientError as e:
+            error = type(e).__name__
+        self.results.record(scenario, time.perf_counter() - started, error)
+
+    async def run(self) -> Dict[str, dict]:
+        """Upload the try-on images, send requests for `duration` seconds, wait for them and summarize."""
+        scenarios = [name for name, weight in self.mix.items() if weight > 0]
+        weights = [self.mix[name] for name in scenarios]
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector,
+                                         timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+            if "tryon" in scenarios:
+                await self.setup(session)
+            tasks = []
+            started = time.perf_counter()
+            for i in range(int(self.rps * self.duration)):
+                # Open loop: each request starts on schedule, so a slow server builds a backlog instead of slowing the load
+                delay = started + i / self.rps - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                scenario = self.rng.choices(scenarios, weights)[0]
+                tasks.append(asyncio.create_task(self._send(session, scenario)))
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+        return self.results.summary(elapsed)
+
+
+def print_report(summary: Dict[str, dict], rps: float, duration: float):
+    print(f"\nTarget {rps:g} req/s for {duration:g}s\n")
+    print(f"{'scenario':<10} {'requests':>8} {'errors':>7} {'err%':>6} {'ok/s':>7} "
+          f"{'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for scenario, row in summary.items():
+        print(f"{scenario:<10} {row['requests']:>8} {row['errors']:>7} {row['error_rate'] * 100:>5.1f}% "
+              f"{row['throughput']:>7.2f} {row['p50']:>7.3f}s {row['p95']:>7.3f}s {row['p99']:>7.3f}s {row['max']:>7.3f}s")
+    for scenario, row in summary.items():
+        if row["error_kinds"] and scenario != "total":
+            kinds = ", ".join(f"{kind}: {count}" for kind, count in sorted(row["error_kinds"].items()))
+            print(f"  {scenario} errors: {kinds}")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(url: str, process: subprocess.Popen, name: str):
+    """Wait until process accepts connections on url's port."""
+    address = urlsplit(url)
+    started = time.perf_counter()
+    while time.perf_counter() - started < READY_TIMEOUT_SECONDS:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} exited with status {process.returncode} before becoming ready")
+        try:
+            with socket.create_connection((address.hostname, address.port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{name} did not start within {READY_TIMEOUT_SECONDS}s")
+
+
+def spawn_stack(mock_args: List[str]):
+    """Start mock_segmind.py and api.py (pointed at it) on free ports; returns (api URL, mock URL, processes)."""
+    mock_port, api_port = _free_port(), _free_port()
+    mock_url, api_url = f"http://127.0.0.1:{mock_port}", f"http://127.0.0.1:{api_port}"
+    processes = []
+    try:
+        processes.append(subprocess.Popen([sys.executable, "mock_segmind.py", "--port", str(mock_port), *mock_args],
+                                          cwd=ROOT, stdout=subprocess.DEVNULL))
+        _wait_until_up(mock_url, processes[0], "mock_segmind.py")
+        env = dict(os.environ, HOST="127.0.0.1", PORT=str(api_port), SEGMIND_API_BASE=f"{mock_url}/v1",
+                   SEGMIND_API_KEY=os.environ.get("SEGMIND_API_KEY") or "load-test")
+        processes.append(subprocess.Popen([sys.executable, "api.py"], cwd=ROOT, env=env,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        _wait_until_up(api_url, processes[1], "api.py")
+    except Exception:
+        stop_stack(processes)
+        raise
+    return api_url, mock_url, processes
+
+
+def stop_stack(processes: List[subprocess.Popen]):
+    for process in reversed(processes):
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def mock_stats(mock_url: Optional[str]) -> Optional[dict]:
+    if not mock_url:
+        return None
+    with urllib.request.urlopen(f"{mock_url}/stats", timeout=5) as response:
+        return json.load(response)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the Virtual Try-On API at a target request rate")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="API root (ignored with --spawn)")
+    parser.add_argument("--rps", type=float, default=2.0, help="Requests started per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to keep starting requests")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Scenario weights ({', '.join(SCENARIOS)})")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds")
+    parser.add_argument("--pool", type=int, default=4, help="Model and cloth images uploaded for try-ons")
+    parser.add_argument("--seeds", type=int, default=0,
+                        help="Pin try-on/generation seeds to this many values so repeats hit the caches (0: all new)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed the request sequence for repeatable runs")
+    parser.add_argument("--spawn", action="store_true",
+                        help="Start mock_segmind.py and api.py on free ports and test against them")
+    parser.add_argument("--mock-url", default=None,
+                        help=f"Running stand-in to report upstream calls from (e.g. http://127.0.0.1:{MOCK_PORT})")
+    parser.add_argument("--mock-args", default="", help="Extra mock_segmind.py arguments with --spawn, "
+                                                        "e.g. \"--latency-median 2 --rate-429 0.1\"")
+    parser.add_argument("--max-error-rate", type=float, default=0.01,
+                        help="Fail when more than this fraction of requests errors")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the summary to this file")
+    args = parser.parse_args(argv)
+
+    processes = []
+    base_url, mock_url = args.url, args.mock_url
+    if args.spawn:
+        base_url, mock_url, processes = spawn_stack(shlex.split(args.mock_args))
+    try:
+        before = mock_stats(mock_url)
+        load_test = LoadTest(base_url, parse_mix(args.mix), args.rps, args.duration, args.timeout,
+                             args.pool, args.seeds, args.seed)
+        summary = asyncio.run(load_test.run())
+        after = mock_stats(mock_url)
+    finally:
+        stop_stack(processes)
+
+    print_report(summary, args.rps, args.duration)
+    if after is not None:
+        calls = {name: count - before["calls"].get(name, 0) for name, count in sorted(after["calls"].items())}
+        print(f"\nUpstream calls: {', '.join(f'{name}: {count}' for name, count in calls.items() if count) or 'none'}"
+              f" (peak {after['peak_in_flight']} in flight)")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"rps": args.rps, "duration": args.duration, "mix": args.mix, "summary": summary}, f, indent=2)
+
+    error_rate = summary["total"]["error_rate"]
+    if error_rate > args.max_error_rate:
+        print(f"\n❌ Error rate {error_rate:.1%} is over the {args.max_error_rate:.1%} budget")
+        return 1
+    print(f"\n✅ Error rate {error_rate:.1%} is within the {args.max_error_rate:.1%} budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
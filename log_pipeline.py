@@ -0,0 +1,248 @@
+"""
+Non-blocking logging for the try-on API
+Callers only enqueue records; a background listener formats them (as text or JSON) and writes stdout and a rotating log file, with per-logger sampling of info lines
+Each process runs its own listener; processes forked from one with a running pipeline write <name>.<pid>.log beside the parent's file
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from metrics import REGISTRY, Counter
+import tracing
+
+# Logging settings (see .env.example)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_DIR = os.environ.get("LOG_DIR", ".")
+LOG_FILE = os.environ.get("LOG_FILE", "server.log")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+LOG_JSON = os.environ.get("LOG_JSON", "False").lower() in ("1", "true", "yes")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Fraction of DEBUG/INFO records kept per logger, e.g. "api=0.1,segmind_api=0.5"; warnings and errors are always kept
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "Log records discarded because the log queue was full", ("level",))
+LOG_RECORDS_SAMPLED_OUT = Counter("log_records_sampled_out_total", "Info/debug records skipped by per-logger sampling", ("logger",))
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Parse "logger=rate,..." into {logger: rate}."""
+    rates = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fixed fraction of DEBUG/INFO records per logger (the longest configured dotted prefix applies)."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, Optional[float]] = {}
+
+    def _rate(self, name: str) -> Optional[float]:
+        if name not in self._resolved:
+            candidate, rate = name, None
+            while candidate:
+                if candidate in self.rates:
+                    rate = self.rates[candidate]
+                    break
+                candidate = candidate.rpartition(".")[0]
+            self._resolved[name] = rate
+        return self._resolved[name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = self._rate(record.name)
+        if rate is None or rate >= 1.0 or random.random() < rate:
+            return True
+        LOG_RECORDS_SAMPLED_OUT.labels(record.name).inc()
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueue records without formatting them
+
+    The stock QueueHandler formats the message and traceback on the calling thread; here the
+    caller only merges the message arguments and stamps the request id, and a full queue drops
+    the record (counted in metrics) instead of blocking or printing an error.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        # Context variables are not visible on the listener thread, so capture them now
+        record.request_id = tracing.current_request_id()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels(record.levelname).inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LogPipeline:
+    """The queue, its listener thread and the handlers the listener writes to."""
+
+    def __init__(self, level: str = LOG_LEVEL, log_dir: str = LOG_DIR, log_file: str = LOG_FILE,
+                 json_output: bool = LOG_JSON, sample_rates: str = LOG_SAMPLE_RATES,
+                 queue_size: int = LOG_QUEUE_SIZE, stream=None):
+        """
+        Build the pipeline (call start() to install it)
+
+        Args:
+            level: Root log level
+            log_dir: Directory for the log file
+            log_file: Log file name; empty for stdout only
+            json_output: Write JSON lines instead of LOG_FORMAT text
+            sample_rates: Per-logger keep fractions for DEBUG/INFO records ("logger=rate,...")
+            queue_size: Records buffered for the listener before new ones are dropped
+            stream: Console stream (default: stdout)
+        """
+        self.level = level
+        self.log_dir = log_dir
+        self.log_file = log_file
+        self.stream = stream or sys.stdout
+        self.formatter = JsonFormatter() if json_output else logging.Formatter(LOG_FORMAT)
+        self.handlers = self._build_handlers(log_file)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = NonBlockingQueueHandler(self.queue)
+        self.handler.addFilter(SamplingFilter(parse_sample_rates(sample_rates)))
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.pid = os.getpid()
+        self._started = False
+        self._fork_hook = False
+
+    def _build_handlers(self, log_file: str):
+        handlers = [logging.StreamHandler(self.stream)]
+        if log_file:
+            os.makedirs(self.log_dir, exist_ok=True)
+            handlers.append(logging.handlers.RotatingFileHandler(
+                os.path.join(self.log_dir, log_file), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"))
+        for handler in handlers:
+            handler.setFormatter(self.formatter)
+        return handlers
+
+    @property
+    def running(self) -> bool:
+        """Whether the listener is draining the queue in this process (a forked child inherits no threads)."""
+        return self._started and self.pid == os.getpid()
+
+    def start(self):
+        """Route the root logger through the queue and start the listener thread."""
+        if self._started:
+            return
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        self.listener.start()
+        self._started = True
+        atexit.register(self.stop)
+        if not self._fork_hook and hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._restart_after_fork)
+            self._fork_hook = True
+
+    def _restart_after_fork(self):
+        """
+        Give a forked child its own queue, listener and log file
+
+        The listener thread does not survive fork, so records the child queued on the inherited pipeline would
+        never be written; and rotating one file from several processes loses lines.
+        """
+        if not self._started:
+            return
+        for handler in self.handlers:
+            if isinstance(handler, logging.FileHandler):
+                # Only the child's copy of the descriptor; the parent keeps writing its file
+                handler.close()
+        log_file = self.log_file
+        if log_file:
+            stem, ext = os.path.splitext(log_file)
+            log_file = f"{stem}.{os.getpid()}{ext or '.log'}"
+        self.handlers = self._build_handlers(log_file)
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.handler.queue = self.queue
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        self.pid = os.getpid()
+
+    def stop(self):
+        """Flush queued records and stop the listener."""
+        if not self.running:
+            return
+        self._started = False
+        logging.getLogger().removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+
+    def collect(self):
+        yield ("log_queue_depth", "gauge", "Log records waiting for the listener thread", [({}, self.queue.qsize())])
+
+
+_active: Optional[LogPipeline] = None
+
+
+def configure_logging(**kwargs) -> LogPipeline:
+    """
+    Install the logging pipeline for this process (see LogPipeline for the options)
+
+    Safe to call from every process's startup: a pipeline already running in this process, including one
+    restarted in a forked child, is returned as is.
+    """
+    global _active
+    if _active is None or not _active.running:
+        _active = LogPipeline(**kwargs)
+        _active.start()
+    return _active
+
+
+def shutdown_logging():
+    """Flush and stop this process's pipeline (for exits that skip atexit, such as os._exit in a forked worker)."""
+    if _active is not None:
+        _active.stop()
+
+
+def _collect():
+    if _active is not None:
+        yield from _active.collect()
+
+
+REGISTRY.register_collector(_collect)
@@ -0,0 +1,160 @@
+"""
+Local stand-in for the Segmind API, for load tests that must not spend API credits
+Serves try-on-diffusion and sdxl1.0-txt2img with configurable latency, 429/5xx injection, a concurrency limit and response image size
+"""
+
+import io
+import sys
+import math
+import base64
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+from functools import lru_cache
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from PIL import Image
+
+DEFAULT_PORT = 8900
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+
+
+class MockConfig:
+    """How the stand-in behaves."""
+
+    def __init__(self, latency: str = "lognormal", latency_median: float = 8.0, latency_spread: float = 0.4,
+                 rate_429: float = 0.0, rate_5xx: float = 0.0, retry_after: float = 2.0,
+                 concurrency_limit: int = 0, image_size: int = 1024, seed: Optional[int] = None):
+        """
+        Args:
+            latency: Latency distribution: fixed, uniform or lognormal
+            latency_median: Median latency of a successful call, in seconds
+            latency_spread: uniform: +/- seconds around the median; lognormal: sigma of the log latency
+            rate_429: Fraction of calls rejected with 429 and Retry-After
+            rate_5xx: Fraction of calls failing with 500/502/503 after the sampled latency
+            retry_after: Retry-After sent with 429s, in seconds
+            concurrency_limit: Calls in progress beyond this are rejected with 429 (0: unlimited)
+            image_size: Width and height of the returned PNG, in pixels
+            seed: Seed for latency and error sampling, for repeatable runs
+        """
+        if latency not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"latency must be one of {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.latency = latency
+        self.latency_median = latency_median
+        self.latency_spread = latency_spread
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.concurrency_limit = concurrency_limit
+        self.image_size = image_size
+        self.rng = random.Random(seed)
+
+    def sample_latency(self) -> float:
+        if self.latency == "fixed" or self.latency_median <= 0:
+            return max(0.0, self.latency_median)
+        if self.latency == "uniform":
+            return max(0.0, self.rng.uniform(self.latency_median - self.latency_spread,
+                                             self.latency_median + self.latency_spread))
+        return self.rng.lognormvariate(math.log(self.latency_median), self.latency_spread)
+
+
+@lru_cache(maxsize=4)
+def render_image(size: int) -> bytes:
+    """A size x size PNG of noise: it barely compresses, so the payload is an upper bound for real results."""
+    rng = random.Random(size)
+    image = Image.frombytes("RGB", (size, size), rng.randbytes(size * size * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    """Build the stand-in app; GET /stats reports calls by endpoint and status."""
+    app = FastAPI(title="Segmind stand-in")
+    calls = defaultdict(int)
+    state = {"in_flight": 0, "peak_in_flight": 0}
+
+    def reply(endpoint: str, status: int, body=None, headers=None) -> Response:
+        calls[f"{endpoint} {status}"] += 1
+        return JSONResponse(body or {"error": "mock failure"}, status_code=status, headers=headers)
+
+    async def generate(endpoint: str, request: Request, required: tuple) -> Response:
+        if not request.headers.get("x-api-key"):
+            return reply(endpoint, 401, {"error": "Missing x-api-key"})
+        try:
+            data = await request.json()
+        except ValueError:
+            return reply(endpoint, 400, {"error": "Body must be JSON"})
+        missing = [name for name in required if not data.get(name)]
+        if missing:
+            return reply(endpoint, 400, {"error": f"Missing {', '.join(missing)}"})
+
+        # Rate limiting happens before any work, like the real gateway
+        retry_after = {"Retry-After": f"{config.retry_after:g}"}
+        if config.concurrency_limit and state["in_flight"] >= config.concurrency_limit:
+            return reply(endpoint, 429, {"error": "Too many concurrent requests"}, retry_after)
+        if config.rng.random() < config.rate_429:
+            return reply(endpoint, 429, {"error": "Rate limit exceeded"}, retry_after)
+
+        state["in_flight"] += 1
+        state["peak_in_flight"] = max(state["peak_in_flight"], state["in_flight"])
+        try:
+            await asyncio.sleep(config.sample_latency())
+        finally:
+            state["in_flight"] -= 1
+        if config.rng.random() < config.rate_5xx:
+            return reply(endpoint, config.rng.choice((500, 502, 503)))
+
+        image = render_image(config.image_size)
+        calls[f"{endpoint} 200"] += 1
+        if data.get("base64"):
+            return JSONResponse({"image": base64.b64encode(image).decode("ascii")})
+        return Response(image, media_type="image/png")
+
+    @app.post("/v1/try-on-diffusion")
+    async def try_on_diffusion(request: Request):
+        return await generate("try-on-diffusion", request, ("model_image", "cloth_image"))
+
+    @app.post("/v1/sdxl1.0-txt2img")
+    async def txt2img(request: Request):
+        return await generate("sdxl1.0-txt2img", request, ("prompt",))
+
+    @app.get("/stats")
+    async def stats():
+        return {"calls": dict(calls), **state}
+
+    return app
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Segmind API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default="lognormal", help="Latency distribution")
+    parser.add_argument("--latency-median", type=float, default=8.0, help="Median latency in seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.4,
+                        help="uniform: +/- seconds around the median; lognormal: sigma of the log latency")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of calls rejected with 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Fraction of calls failing with a 5xx")
+    parser.add_argument("--retry-after", type=float, default=2.0, help="Retry-After sent with 429s, in seconds")
+    parser.add_argument("--concurrency-limit", type=int, default=0,
+                        help="Reject calls beyond this many in progress with 429 (0: unlimited)")
+    parser.add_argument("--image-size", type=int, default=1024, help="Width and height of returned images")
+    parser.add_argument("--seed", type=int, default=None, help="Seed latency and error sampling")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(args.latency, args.latency_median, args.latency_spread, args.rate_429, args.rate_5xx,
+                        args.retry_after, args.concurrency_limit, args.image_size, args.seed)
+    render_image(config.image_size)
+    print(f"Segmind stand-in on http://{args.host}:{args.port}/v1 "
+          f"(set SEGMIND_API_BASE to this URL and any SEGMIND_API_KEY)")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
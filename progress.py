@@ -0,0 +1,151 @@
+"""
+Stage-by-stage progress for long-running try-on and generation requests
+Pipeline code calls report(stage); whoever started the work receives the stages with timestamps, e.g. as server-sent events
+"""
+
+import json
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Stages in the order a request normally passes through them
+QUEUED = "queued"
+ENCODING = "encoding"
+UPSTREAM_SUBMITTED = "upstream_submitted"
+UPSTREAM_COMPLETE = "upstream_complete"
+SAVED = "saved"
+
+# A reporter receives (stage, detail); it must be safe to call from any thread
+Reporter = Callable[[str, Dict[str, Any]], None]
+
+_reporter: ContextVar[Optional[Reporter]] = ContextVar("progress_reporter", default=None)
+
+
+def report(stage: str, **detail):
+    """Record that the current request reached a stage (a no-op when nobody is listening)."""
+    reporter = _reporter.get()
+    if reporter is None:
+        return
+    try:
+        reporter(stage, detail)
+    except Exception as e:
+        # Progress is advisory; never let it fail the work itself
+        logger.debug(f"Progress reporter failed for stage {stage}: {str(e)}")
+
+
+def current() -> Optional[Reporter]:
+    """Return the reporter the current context reports to, if any."""
+    return _reporter.get()
+
+
+@contextmanager
+def reporting_to(reporter: Optional[Reporter]):
+    """Send report() calls made in this context (and tasks or pool calls it starts) to reporter."""
+    token = _reporter.set(reporter)
+    try:
+        yield
+    finally:
+        _reporter.reset(token)
+
+
+def stage_event(stage: str, detail: Dict[str, Any], started_at: float) -> Dict[str, Any]:
+    """Build the timeline entry for a stage reached now."""
+    now = time.time()
+    return {"stage": stage, "at": round(now, 3), "elapsed_seconds": round(now - started_at, 3), **detail}
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Comment line that keeps idle event streams (and proxies in front of them) from timing out
+SSE_HEARTBEAT = ": keep-alive\n\n"
+
+
+class Broadcast:
+    """
+    Reporter that fans stages out to several reporters
+
+    Used when identical requests share one piece of work: each joins the broadcast and
+    receives the stages already reached, then every later one.
+    """
+
+    def __init__(self, reporter: Optional[Reporter] = None):
+        self._lock = threading.Lock()
+        self._history = []
+        self._reporters = []
+        if reporter is not None:
+            self._reporters.append(reporter)
+
+    def add(self, reporter: Optional[Reporter]):
+        if reporter is None:
+            return
+        with self._lock:
+            history = list(self._history)
+            self._reporters.append(reporter)
+        for stage, detail in history:
+            reporter(stage, detail)
+
+    def __call__(self, stage: str, detail: Dict[str, Any]):
+        with self._lock:
+            self._history.append((stage, detail))
+            reporters = list(self._reporters)
+        for reporter in reporters:
+            reporter(stage, detail)
+
+
+class Progress:
+    """Timeline of one request, reported into from any thread and followed on the event loop."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.stages: List[Dict[str, Any]] = [stage_event(QUEUED, {}, self.started_at)]
+        self.done = False
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+
+    def __call__(self, stage: str, detail: Dict[str, Any]):
+        event = stage_event(stage, detail, self.started_at)
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._append(event)
+        else:
+            self._loop.call_soon_threadsafe(self._append, event)
+
+    def _append(self, event: Dict[str, Any]):
+        self.stages.append(event)
+        self._wake()
+
+    def finish(self):
+        """Mark the timeline complete so followers stop waiting (call on the event loop)."""
+        self.done = True
+        self._wake()
+
+    def _wake(self):
+        # Wake every follower, then re-arm for the next stage
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, heartbeat: float = 15.0) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Yield every stage (including those already reached) until finish(); None on idle heartbeats."""
+        sent = 0
+        while True:
+            while sent < len(self.stages):
+                sent += 1
+                yield self.stages[sent - 1]
+            if self.done:
+                return
+            try:
+                await asyncio.wait_for(self._changed.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
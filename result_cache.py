@@ -0,0 +1,287 @@
+"""
+Content-addressed result cache for the virtual try-on pipeline
+Stores finished images under results/ keyed on a SHA-256 of their inputs, with LRU eviction
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from blob_store import BlobStore, LocalBlobStore, make_key
+from metrics import Counter
+from storage import record_access
+
+logger = logging.getLogger(__name__)
+
+# Cache settings (see .env.example)
+RESULT_CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "True").lower() in ("1", "true", "yes")
+RESULT_CACHE_DIR = os.environ.get("RESULT_DIR", "results")
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Text-to-image results keyed on their prompt; opt-in because unpinned prompts then always get the same image
+PROMPT_CACHE_ENABLED = os.environ.get("PROMPT_CACHE_ENABLED", "False").lower() in ("1", "true", "yes")
+PROMPT_CACHE_MAX_BYTES = int(os.environ.get("PROMPT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+RESULT_BYTES_WRITTEN = Counter("result_bytes_written_total", "Bytes of result images written to cache directories", ("cache",))
+
+# Digests of input files, keyed on (path, size, mtime) so unchanged uploads are hashed once
+_digest_memo: "OrderedDict[tuple, str]" = OrderedDict()
+_digest_lock = threading.Lock()
+_DIGEST_MEMO_SIZE = 4096
+
+
+def memoized_sha256(path: str) -> Optional[str]:
+    """Return the file's memoized SHA-256 if it is known for its current size and mtime, without reading it."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    with _digest_lock:
+        return _digest_memo.get((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the hex SHA-256 of a file, memoized on its path, size and mtime."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        digest = _digest_memo.get(memo_key)
+        if digest is not None:
+            _digest_memo.move_to_end(memo_key)
+            return digest
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+
+    with _digest_lock:
+        _digest_memo[memo_key] = digest
+        while len(_digest_memo) > _DIGEST_MEMO_SIZE:
+            _digest_memo.popitem(last=False)
+    return digest
+
+
+def make_tryon_key(model_path: str, cloth_path: str, category: str,
+                   params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build the cache key for a try-on request.
+
+    Args:
+        model_path: Path to the model image
+        cloth_path: Path to the cloth image
+        category: Clothing category (Upper body, Lower body, Dress)
+        params: Inference parameters (steps, guidance, seed); None values mean provider defaults
+
+    Returns:
+        Hex SHA-256 over the image contents, category and parameters
+    """
+    sha = hashlib.sha256()
+    sha.update(b"tryon-v1\0")
+    sha.update(file_sha256(model_path).encode())
+    sha.update(b"\0")
+    sha.update(file_sha256(cloth_path).encode())
+    sha.update(b"\0")
+    sha.update(category.strip().lower().encode())
+    sha.update(b"\0")
+    sha.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+    return sha.hexdigest()
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize a text prompt: case-insensitive, with runs of whitespace collapsed."""
+    return " ".join(prompt.lower().split())
+
+
+def make_prompt_key(prompt: str, negative_prompt: str, style: str, width: int, height: int,
+                    seed: Optional[int] = None) -> str:
+    """
+    Build the cache key for a text-to-image request.
+
+    Args:
+        prompt: Full prompt sent to the model
+        negative_prompt: Negative prompt sent to the model
+        style: Model style preset
+        width: Image width in pixels
+        height: Image height in pixels
+        seed: Pinned seed, or None for "any seed" (the first image generated is reused)
+
+    Returns:
+        Hex SHA-256 over the normalized prompts, style, size and seed
+    """
+    fields = [normalize_prompt(prompt), normalize_prompt(negative_prompt), style.strip().lower(),
+              width, height, seed]
+    sha = hashlib.sha256()
+    sha.update(b"txt2img-v1\0")
+    sha.update(json.dumps(fields).encode())
+    return sha.hexdigest()
+
+
+class ResultCache:
+    """LRU cache of result images kept in one blob store namespace (by default a plain local directory)."""
+
+    def __init__(self, directory: str = RESULT_CACHE_DIR, prefix: str = "tryon_",
+                 extension: str = ".png", max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 store: Optional[BlobStore] = None):
+        """
+        Initialize the cache and index any entries already stored
+
+        Args:
+            directory: Directory holding the cached files, or the namespace within store
+            prefix: Filename prefix that marks a file as owned by this cache
+            extension: Filename extension of cached entries
+            max_bytes: Storage budget; least recently used entries are evicted past it
+            store: Blob store holding the entries (default: the directory itself, unsharded)
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.extension = extension
+        self.max_bytes = max_bytes
+        if store is None:
+            os.makedirs(directory, exist_ok=True)
+            store, self.namespace = LocalBlobStore(directory, shard_levels=0), ""
+        else:
+            self.namespace = directory
+        self.store = store
+        # Label for metrics: "tryon" for tryon_<key>.png
+        self.name = prefix.rstrip("_") or os.path.basename(directory)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._load_index()
+
+    def _load_index(self):
+        """Rebuild the LRU order from the stored entries, oldest access first."""
+        found = []
+        for name, size, used_at in self.store.list(self.namespace, self.prefix):
+            key = name[len(self.prefix):-len(self.extension)]
+            # Served variants (<prefix><key>.w320.webp) live beside the entry but are not entries
+            if name.endswith(self.extension) and "." not in key:
+                found.append((used_at, key, size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.total_bytes += size
+
+        if found:
+            logger.info(f"Result cache indexed {len(found)} entries ({self.total_bytes} bytes) in {self.directory}")
+
+    def blob_key(self, key: str) -> str:
+        """Return the blob store key for a cache key."""
+        return make_key(self.namespace, f"{self.prefix}{key}{self.extension}")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a local path to the cached file for a key, or None on a miss."""
+        blob_key = self.blob_key(key)
+        stat = self.store.stat(blob_key)
+        evicted = []
+        removed = False
+        with self._lock:
+            if key in self._entries and stat:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            elif key not in self._entries and stat:
+                # Written by another worker process (or node) sharing the store
+                self._entries[key] = stat[0]
+                self.total_bytes += stat[0]
+                evicted = self._evict_locked(keep=key)
+                self.hits += 1
+            else:
+                if key in self._entries:
+                    # File was removed behind our back
+                    self.total_bytes -= self._entries.pop(key)
+                    removed = True
+                self.misses += 1
+        if not stat:
+            if removed:
+                # Its variants were rendered from the old file; the regenerated entry must not be served with them
+                self._delete_variants(key)
+            return None
+        self._delete(evicted)
+
+        path = self.store.local_path(blob_key)
+        if path:
+            record_access(path)
+        return path
+
+    def put(self, key: str, source_path: str, move: bool = True) -> str:
+        """
+        Store a file in the cache
+
+        Args:
+            key: Cache key from make_tryon_key or make_prompt_key
+            source_path: File to store
+            move: Move the file into the cache instead of copying it
+
+        Returns:
+            Local path of the cached entry
+        """
+        # Variants of an entry being replaced were rendered from the old file
+        self._delete_variants(key)
+        path = self.store.put_file(self.blob_key(key), source_path, move=move)
+
+        size = os.path.getsize(path)
+        RESULT_BYTES_WRITTEN.labels(self.name).inc(size)
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries[key]
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            self.total_bytes += size
+            evicted = self._evict_locked(keep=key)
+        self._delete(evicted)
+        return path
+
+    def _evict_locked(self, keep: Optional[str] = None) -> list:
+        """Drop least recently used entries until the cache fits its budget; returns the keys to delete."""
+        evicted = []
+        while self.total_bytes > self.max_bytes and self._entries:
+            key, size = next(iter(self._entries.items()))
+            if key == keep:
+                break
+            self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            evicted.append(key)
+        return evicted
+
+    def _delete(self, keys: list):
+        # Outside the lock: remote stores delete over the network
+        for key in keys:
+            try:
+                self.store.delete(self.blob_key(key))
+                self._delete_variants(key)
+            except Exception as e:
+                logger.warning(f"Could not delete evicted cache entry {key}: {str(e)}")
+
+    def _delete_variants(self, key: str):
+        """Delete the served variants (<prefix><key>.w320.webp, ...) stored beside an entry."""
+        entry_name = f"{self.prefix}{key}{self.extension}"
+        try:
+            for name, _, _ in list(self.store.list(self.namespace, f"{self.prefix}{key}.")):
+                if name != entry_name:
+                    self.store.delete(make_key(self.namespace, name))
+        except Exception as e:
+            logger.warning(f"Could not delete variants of cache entry {key}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and occupancy."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
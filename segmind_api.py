@@ -2,9 +2,7 @@ import os
 import uuid
 import time
 import base64
-import aiohttp
 import asyncio
-import requests
 from PIL import Image, ImageEnhance, ImageFilter, ImageOps, ImageChops, ImageDraw
 import logging
 import random
@@ -14,6 +12,13 @@ import socket
 import struct
 import hashlib
 import json
+import http_client
+import upstream_guard
+import deadline
+import body_masks
+import blob_store
+import progress
+import tracing
 
 # Load environment variables
 load_dotenv()
@@ -25,6 +30,14 @@ MAX_CONNECTIONS = 5  # Number of parallel connections to maintain
 ROTATION_INTERVAL = 0.5  # Seconds between connection rotations
 IDENTITY_ROTATION = True  # Enable identity rotation
 
+# Segmind endpoints; point SEGMIND_API_BASE at mock_segmind.py to load test without API credits (see .env.example)
+SEGMIND_API_BASE = os.environ.get("SEGMIND_API_BASE", "https://api.segmind.com/v1").rstrip("/")
+TRYON_URL = f"{SEGMIND_API_BASE}/try-on-diffusion"
+SEGMIND_MAX_ATTEMPTS = int(os.environ.get("SEGMIND_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 20.0
+
+@tracing.traced("segmind.encode_base64")
 def local_image_to_base64(image_path):
     """Convert a local image to base64 encoding."""
     try:
@@ -34,20 +47,39 @@ def local_image_to_base64(image_path):
         logger.error(f"Error encoding image to base64: {str(e)}")
         raise
 
+@tracing.traced("segmind.backoff")
+def backoff(seconds):
+    """
+    Sleep between retries (traced, so retry waits show up in request traces)
+    
+    Gives up at once with DeadlineExceeded when the wait would outlast the request deadline,
+    and with Cancelled as soon as the client goes away (see deadline.py).
+    """
+    deadline.sleep(seconds)
+
+def retry_delay(attempt):
+    """Exponential backoff with full jitter before retry number `attempt`."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
 async def to_b64(url):
     """Convert an image URL to base64 encoding."""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    image_data = await response.read()
-                    return base64.b64encode(image_data).decode('utf-8')
-                else:
-                    raise Exception(f"Failed to fetch image from URL: {url}, status: {response.status}")
+        response = await http_client.request("GET", url)
+        if response.status_code == 200:
+            return base64.b64encode(response.content).decode('utf-8')
+        else:
+            raise Exception(f"Failed to fetch image from URL: {url}, status: {response.status_code}")
     except Exception as e:
         logger.error(f"Error fetching image from URL: {str(e)}")
         raise
 
+class _ClientIdentity:
+    """Headers and cookies presented by one rotated client identity."""
+    
+    def __init__(self):
+        self.headers = {}
+        self.cookies = {}
+
 class SegmindVirtualTryOn:
     """Implementation of the Segmind Virtual Try-On API with rate limit bypass."""
     
@@ -96,10 +128,10 @@ class SegmindVirtualTryOn:
             {"device": "Ultrawide", "screen": "3840x1600", "color_depth": 24, "timezone": 8}
         ]
         
-        # For connection pooling
+        # Identities to rotate through; connections come from the shared pool in http_client
         self.sessions = []
         for _ in range(MAX_CONNECTIONS):
-            session = requests.Session()
+            session = _ClientIdentity()
             self._randomize_session(session)
             self.sessions.append(session)
         
@@ -158,13 +190,17 @@ class SegmindVirtualTryOn:
         
         # Set custom cookies to make each request appear as a different client
         session.cookies.clear()
-        session.cookies.set('visitor_id', f"visitor_{random.randint(10000, 99999)}")
-        session.cookies.set('session_id', session_id)
-        session.cookies.set('client_id', f"client_{random.randint(10000, 99999)}")
+        session.cookies.update({
+            'visitor_id': f"visitor_{random.randint(10000, 99999)}",
+            'session_id': session_id,
+            'client_id': f"client_{random.randint(10000, 99999)}"
+        })
         
         return session
         
-    def process_tryon(self, model_path, cloth_path, category="Upper body"):
+    @tracing.traced("segmind.process_tryon")
+    def process_tryon(self, model_path, cloth_path, category="Upper body",
+                      num_inference_steps=None, guidance_scale=None, seed=None):
         """
         Process the virtual try-on using the Segmind API.
         
@@ -172,6 +208,9 @@ class SegmindVirtualTryOn:
             model_path: Path to the model image
             cloth_path: Path to the cloth image
             category: Clothing category (Upper body, Lower body, Dress)
+            num_inference_steps: Diffusion steps (randomized when None)
+            guidance_scale: Guidance scale (randomized when None)
+            seed: Random seed (randomized when None)
             
         Returns:
             Path to the result image
@@ -189,16 +228,17 @@ class SegmindVirtualTryOn:
                 raise FileNotFoundError(f"Cloth image not found: {cloth_path}")
             
             # Prepare API request
-            url = "https://api.segmind.com/v1/try-on-diffusion"
+            url = TRYON_URL
             
             # Convert images to base64
+            progress.report(progress.ENCODING)
             model_image_b64 = local_image_to_base64(model_path)
             cloth_image_b64 = local_image_to_base64(cloth_path)
             
-            # Randomize request parameters to appear unique
-            seed = random.randint(10000, 99999)
-            steps = random.randint(30, 40)
-            guidance = round(random.uniform(1.8, 2.2), 2)
+            # Randomize request parameters to appear unique, unless pinned by the caller
+            seed = seed if seed is not None else random.randint(10000, 99999)
+            steps = num_inference_steps if num_inference_steps is not None else random.randint(30, 40)
+            guidance = guidance_scale if guidance_scale is not None else round(random.uniform(1.8, 2.2), 2)
             
             data = {
                 "model_image": model_image_b64,
@@ -210,59 +250,59 @@ class SegmindVirtualTryOn:
                 "base64": False
             }
             
-            # Use advanced rotation technique to bypass rate limits
-            def make_api_request(retry_count=0, max_retries=10):
-                # Get the next session in the rotation
+            # Retries are bounded; pacing after 429s (Retry-After) and failing fast while Segmind
+            # is down are left to the shared upstream guard
+            last_error = None
+            for attempt in range(1, SEGMIND_MAX_ATTEMPTS + 1):
+                # Each attempt only gets what is left of the request's budget (http_client clamps its timeout)
+                deadline.check()
                 session = self._rotate_session()
-                
-                logger.info(f"Attempt {retry_count+1}/{max_retries} with rotated identity")
+                logger.info(f"Attempt {attempt}/{SEGMIND_MAX_ATTEMPTS}")
                 
                 try:
-                    # Make the API request with rotated identity - use session directly
-                    response = session.post(url, json=data, timeout=180)
-                    
-                    if response.status_code == 200:
-                        # Success - save the result image
-                        timestamp = int(time.time())
-                        unique_id = hashlib.md5(f"{timestamp}_{random.randint(1000, 9999)}".encode()).hexdigest()[:8]
-                        result_path = f"results/segmind_{timestamp}_{unique_id}.png"
-                        
-                        with open(result_path, "wb") as image_file:
-                            image_file.write(response.content)
-                        
-                        logger.info(f"Segmind processing complete, result saved to {result_path}")
-                        return result_path
-                    elif response.status_code == 429 and retry_count < max_retries:
-                        # Rate limit - wait and retry with different identity
-                        logger.warning(f"Rate limit hit (429). Retrying with different identity ({retry_count+1}/{max_retries})...")
-                        time.sleep(random.uniform(0.5, 1.5))  # Randomized delay
-                        
-                        # Completely randomize the session for next attempt
-                        self._randomize_session(session)
-                        
-                        # Recursive retry with incremented counter
-                        return make_api_request(retry_count + 1, max_retries)
-                    else:
-                        # Handle other errors
-                        logger.error(f"Segmind API error: {response.status_code} - {response.text}")
-                        if retry_count < max_retries:
-                            logger.info(f"Retrying with different identity ({retry_count+1}/{max_retries})...")
-                            time.sleep(random.uniform(0.5, 1.5))  # Randomized delay
-                            return make_api_request(retry_count + 1, max_retries)
-                        else:
-                            raise Exception(f"API failed after {max_retries} attempts with status {response.status_code}")
-                except requests.exceptions.RequestException as e:
+                    # Over the shared connection pool; waits here while the guard holds calls back
+                    progress.report(progress.UPSTREAM_SUBMITTED, attempt=attempt)
+                    with tracing.span("segmind.attempt", attempt=attempt):
+                        response = http_client.request_blocking(
+                            "POST", url, json=data, headers=session.headers, cookies=session.cookies, timeout=180,
+                            guard=upstream_guard.segmind
+                        )
+                except http_client.UpstreamError as e:
                     logger.error(f"Request error: {str(e)}")
-                    if retry_count < max_retries:
-                        logger.info(f"Retrying after connection error ({retry_count+1}/{max_retries})...")
-                        time.sleep(random.uniform(1, 2))  # Longer delay for connection issues
-                        return make_api_request(retry_count + 1, max_retries)
-                    else:
-                        raise Exception(f"Connection failed after {max_retries} attempts: {str(e)}")
+                    last_error = f"Connection failed after {attempt} attempts: {str(e)}"
+                    if attempt < SEGMIND_MAX_ATTEMPTS:
+                        backoff(retry_delay(attempt))
+                    continue
+                
+                if response.status_code == 200:
+                    progress.report(progress.UPSTREAM_COMPLETE, attempt=attempt)
+                    # Success - save the result image
+                    timestamp = int(time.time())
+                    unique_id = hashlib.md5(f"{timestamp}_{random.randint(1000, 9999)}".encode()).hexdigest()[:8]
+                    result_path = blob_store.store.put_bytes(f"results/segmind_{timestamp}_{unique_id}.png", response.content)
+                    
+                    logger.info(f"Segmind processing complete, result saved to {result_path}")
+                    return result_path
+                
+                last_error = f"API failed after {attempt} attempts with status {response.status_code}"
+                if response.status_code == 429:
+                    # The guard has cut its limit and holds the next call back for Retry-After
+                    logger.warning(f"Rate limit hit (429), Retry-After {response.headers.get('Retry-After', 'unset')} "
+                                   f"({attempt}/{SEGMIND_MAX_ATTEMPTS})")
+                elif response.status_code >= 500:
+                    logger.error(f"Segmind API error: {response.status_code} - {response.text}")
+                    if attempt < SEGMIND_MAX_ATTEMPTS:
+                        backoff(retry_delay(attempt))
+                else:
+                    # Other 4xx responses will not succeed on a retry
+                    logger.error(f"Segmind API error: {response.status_code} - {response.text}")
+                    raise Exception(f"API request rejected with status {response.status_code}: {response.text[:200]}")
             
-            # Execute API request with retry mechanism
-            return make_api_request()
+            raise Exception(last_error)
             
+        except (deadline.Cancelled, deadline.DeadlineExceeded) as e:
+            logger.info(f"Segmind processing stopped: {str(e)}")
+            raise
         except Exception as e:
             logger.error(f"Error in Segmind processing: {str(e)}")
             # Throw the error instead of falling back to local processing
@@ -293,8 +333,7 @@ class SegmindVirtualTryOn:
             result_img = self._apply_final_enhancements(result_img)
             
             # Save the result
-            result_path = f"results/{uuid.uuid4()}.png"
-            result_img.save(result_path)
+            result_path = blob_store.store.save_image(f"results/{uuid.uuid4()}.png", result_img)
             
             logger.info(f"Local processing complete, result saved to {result_path}")
             return result_path
@@ -320,8 +359,7 @@ class SegmindVirtualTryOn:
             result_img = Image.blend(model_img, cloth_img, 0.5)
             
             # Save the result
-            result_path = f"results/simple_blend_{uuid.uuid4()}.png"
-            result_img.save(result_path)
+            result_path = blob_store.store.save_image(f"results/simple_blend_{uuid.uuid4()}.png", result_img)
             
             logger.info(f"Simple blend created and saved to {result_path}")
             return result_path
@@ -335,42 +373,8 @@ class SegmindVirtualTryOn:
         # Create a copy of the model image
         result_img = model_img.copy()
         
-        # Calculate the upper body region (approximately top 40%)
-        width, height = model_img.size
-        upper_body_height = int(height * 0.4)
-        
-        # Create a mask for blending
-        mask = Image.new('L', model_img.size, 0)
-        
-        # Create a more realistic body shape mask
-        for y in range(upper_body_height):
-            # Calculate width of body at this height (narrower at top, wider at bottom)
-            relative_y = y / upper_body_height
-            body_width = int(width * (0.3 + 0.2 * relative_y))
-            center_x = width // 2
-            
-            # Calculate alpha based on position
-            for x in range(width):
-                # Distance from center
-                dist_from_center = abs(x - center_x)
-                if dist_from_center < body_width // 2:
-                    # Gradient alpha from center to edges
-                    alpha = int(255 * (1 - dist_from_center / (body_width // 2) * 0.3))
-                    # Gradient alpha from top to bottom
-                    alpha = int(alpha * (0.7 + 0.3 * relative_y))
-                    mask.putpixel((x, y), alpha)
-        
-        # Add shoulders
-        shoulder_y = int(height * 0.2)
-        shoulder_width = int(width * 0.6)
-        for x in range(center_x - shoulder_width // 2, center_x + shoulder_width // 2):
-            for y in range(shoulder_y - 10, shoulder_y + 10):
-                if 0 <= y < height and 0 <= x < width:
-                    # Calculate distance from shoulder line
-                    dist = abs(y - shoulder_y)
-                    alpha = int(255 * (1 - dist / 10))
-                    if alpha > mask.getpixel((x, y)):
-                        mask.putpixel((x, y), alpha)
+        # Upper body region (top 40%): torso narrowing towards the neck, plus a shoulder line (cached per image size)
+        mask = body_masks.body_mask(model_img.size, "Upper body")
         
         # Apply some transformations to the cloth to make it look more natural
         # Slightly warp the cloth to follow body contours
@@ -407,33 +411,8 @@ class SegmindVirtualTryOn:
             # Use simple blend as fallback
             return self._simple_blend(model_img, cloth_img, category="Lower body")
         
-        # Create a mask for blending
-        mask = Image.new('L', model_img.size, 0)
-        
-        # Create a more realistic lower body shape mask
-        for y in range(lower_body_start, height):
-            # Calculate relative position in lower body
-            # Prevent division by zero
-            if (height - lower_body_start) <= 0:
-                relative_y = 0
-            else:
-                relative_y = (y - lower_body_start) / (height - lower_body_start)
-            
-            # Calculate width of body at this height (wider at top, narrower at bottom)
-            body_width = int(width * (0.4 - 0.15 * relative_y))
-            center_x = width // 2
-            
-            # Calculate alpha based on position
-            for x in range(width):
-                # Distance from center
-                dist_from_center = abs(x - center_x)
-                if dist_from_center < body_width // 2:
-                    # Gradient alpha from center to edges
-                    if (body_width // 2) > 0:  # Prevent division by zero
-                        alpha = int(255 * (1 - dist_from_center / (body_width // 2) * 0.3))
-                        # Gradient alpha from top to bottom
-                        alpha = int(alpha * (0.9 - 0.2 * relative_y))
-                        mask.putpixel((x, y), alpha)
+        # Hips narrowing towards the ankles (cached per image size)
+        mask = body_masks.body_mask(model_img.size, "Lower body")
         
         # Apply some transformations to the cloth to make it look more natural
         # Slightly warp the cloth to follow body contours
@@ -466,44 +445,14 @@ class SegmindVirtualTryOn:
         
         # Calculate dimensions
         width, height = model_img.size
-        center_x = width // 2
         
         # Safety check - ensure we have valid dimensions
         if width <= 0 or height <= 0:
             logger.warning("Invalid dimensions for full dress processing - using simple blend")
             return self._simple_blend(model_img, cloth_img, category="Dress")
         
-        # Create a mask for blending
-        mask = Image.new('L', model_img.size, 0)
-        
-        # Create a more realistic body shape mask for a dress
-        for y in range(height):
-            # Calculate relative position
-            relative_y = y / height if height > 0 else 0
-            
-            # Calculate width of body at this height (narrower at top, wider in middle, narrower at bottom)
-            if relative_y < 0.4:  # Upper body
-                body_width = int(width * (0.3 + 0.2 * relative_y))
-            else:  # Lower body - dress shape
-                body_width = int(width * (0.5 - 0.2 * (relative_y - 0.4) / 0.6))
-                # Add some flare to the dress at the bottom
-                if relative_y > 0.7:
-                    flare_factor = (relative_y - 0.7) / 0.3
-                    body_width = int(body_width * (1 + flare_factor * 0.5))
-            
-            # Ensure body width is at least 1 pixel
-            body_width = max(1, body_width)
-            
-            # Calculate alpha based on position
-            for x in range(width):
-                # Distance from center
-                dist_from_center = abs(x - center_x)
-                if dist_from_center < body_width // 2:
-                    # Gradient alpha from center to edges
-                    alpha = int(255 * (1 - dist_from_center / (body_width // 2) * 0.3))
-                    # Gradient alpha from top to bottom
-                    alpha = int(alpha * (0.7 + 0.3 * relative_y))
-                    mask.putpixel((x, y), alpha)
+        # Dress silhouette: narrow shoulders, widest at the waist, flared hem (cached per image size)
+        mask = body_masks.body_mask(model_img.size, "Dress")
         
         # Apply some transformations to the cloth to make it look more natural
         try:
@@ -703,30 +652,8 @@ class SegmindVirtualTryOn:
         logger.info("Using simple blend as fallback")
         result_img = model_img.copy()
         
-        # Create a simple mask based on category
-        mask = Image.new('L', model_img.size, 0)
-        width, height = model_img.size
-        
-        if category == "Upper body":
-            # For upper body, blend the top 40%
-            upper_body_height = int(height * 0.4)
-            for y in range(upper_body_height):
-                alpha = int(255 * (1 - y / upper_body_height * 0.5))
-                for x in range(width):
-                    mask.putpixel((x, y), alpha)
-        elif category == "Lower body":
-            # For lower body, blend the bottom 60%
-            lower_body_start = int(height * 0.4)
-            for y in range(lower_body_start, height):
-                alpha = int(255 * (y - lower_body_start) / (height - lower_body_start) * 0.8)
-                for x in range(width):
-                    mask.putpixel((x, y), alpha)
-        else:  # Full dress
-            # For full dress, blend with gradient
-            for y in range(height):
-                alpha = int(255 * (0.3 + 0.5 * y / height))
-                for x in range(width):
-                    mask.putpixel((x, y), alpha)
+        # Full-width bands over the category's region: top 40%, bottom 60% or a gradient over the whole height
+        mask = body_masks.blend_mask(model_img.size, category)
         
         # Paste the cloth onto the model using the mask
         result_img.paste(cloth_img, (0, 0), mask)
@@ -782,7 +709,7 @@ class AsyncSegmindVirtualTryOn(SegmindVirtualTryOn):
             cloth_image_b64 = await loop.run_in_executor(None, lambda: local_image_to_base64(cloth_path))
             
             # Prepare API request
-            url = "https://api.segmind.com/v1/try-on-diffusion"
+            url = TRYON_URL
             
             # Randomize request parameters to appear as unique
             seed = random.randint(10000, 99999)
@@ -800,7 +727,7 @@ class AsyncSegmindVirtualTryOn(SegmindVirtualTryOn):
             }
             
             # Async function to handle API request with identity rotation
-            async def make_api_request(retry_count=0, max_retries=10):
+            async def make_api_request(retry_count=0, max_retries=SEGMIND_MAX_ATTEMPTS - 1):
                 # Create unique identity for request
                 user_agent = random.choice(self.user_agents)
                 ip_id = random.choice(self.ip_identifiers)
@@ -840,51 +767,45 @@ class AsyncSegmindVirtualTryOn(SegmindVirtualTryOn):
                 await asyncio.sleep(jitter)
                 
                 try:
-                    timeout = aiohttp.ClientTimeout(total=300)
-                    # Create new client session for each request to ensure unique identity
-                    async with aiohttp.ClientSession(headers=headers, timeout=timeout) as session:
-                        # Set cookies to appear as different client
-                        cookies = {
-                            'visitor_id': f"visitor_{random.randint(10000, 99999)}",
-                            'session_id': session_id,
-                            'client_id': f"client_{random.randint(10000, 99999)}"
-                        }
+                    # Set cookies to appear as different client
+                    cookies = {
+                        'visitor_id': f"visitor_{random.randint(10000, 99999)}",
+                        'session_id': session_id,
+                        'client_id': f"client_{random.randint(10000, 99999)}"
+                    }
+                    
+                    # Identity travels in the headers; the connection comes from the shared pool
+                    response = await http_client.request("POST", url, json=data, headers=headers, cookies=cookies, timeout=300,
+                                                         guard=upstream_guard.segmind)
+                    logger.info(f"Segmind API response status: {response.status_code}")
+                    
+                    if response.status_code == 200:
+                        # Success - save the result image
+                        result_path = blob_store.store.put_bytes(f"results/segmind_{int(time.time())}_{uuid.uuid4().hex[:8]}.png",
+                                                                 response.content)
                         
-                        async with session.post(url, json=data, cookies=cookies) as response:
-                            logger.info(f"Segmind API response status: {response.status}")
-                            
-                            if response.status == 200:
-                                # Success - save the result image
-                                result_path = f"results/segmind_{int(time.time())}_{uuid.uuid4().hex[:8]}.png"
-                                image_data = await response.read()
-                                
-                                with open(result_path, "wb") as image_file:
-                                    image_file.write(image_data)
-                                
-                                logger.info(f"Segmind processing complete, result saved to {result_path}")
-                                return result_path
-                            elif response.status == 429 and retry_count < max_retries:
-                                # Rate limit hit - retry with a different identity
-                                error_message = await response.text()
-                                wait_time = random.uniform(0.5, 2.0)
-                                logger.warning(f"Rate limit reached: {error_message}. Rotating identity and retrying in {wait_time:.1f} seconds...")
-                                await asyncio.sleep(wait_time)
-                                
-                                # Modify request slightly to appear different
-                                data["seed"] = random.randint(10000, 99999)
-                                data["num_inference_steps"] = random.randint(30, 40)
-                                data["guidance_scale"] = random.uniform(1.8, 2.2)
-                                
-                                # Recursive retry with incremented counter
-                                return await make_api_request(retry_count + 1, max_retries)
-                            else:
-                                # Other error or max retries exceeded
-                                error_message = await response.text()
-                                logger.error(f"Segmind API error: {response.status} - {error_message}")
-                                raise Exception(f"Segmind API error: {response.status} - {error_message}")
-                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        logger.info(f"Segmind processing complete, result saved to {result_path}")
+                        return result_path
+                    elif response.status_code == 429 and retry_count < max_retries:
+                        # Rate limit hit - the guard holds the retry back for Retry-After
+                        error_message = response.text
+                        logger.warning(f"Rate limit reached: {error_message}. Retrying once the upstream guard allows...")
+                        
+                        # Modify request slightly to appear different
+                        data["seed"] = random.randint(10000, 99999)
+                        data["num_inference_steps"] = random.randint(30, 40)
+                        data["guidance_scale"] = random.uniform(1.8, 2.2)
+                        
+                        # Recursive retry with incremented counter
+                        return await make_api_request(retry_count + 1, max_retries)
+                    else:
+                        # Other error or max retries exceeded
+                        error_message = response.text
+                        logger.error(f"Segmind API error: {response.status_code} - {error_message}")
+                        raise Exception(f"Segmind API error: {response.status_code} - {error_message}")
+                except http_client.UpstreamError as e:
                     if retry_count < max_retries:
-                        wait_time = random.uniform(0.5, 2.0)
+                        wait_time = retry_delay(retry_count + 1)
                         logger.warning(f"Connection error: {str(e)}. Retrying with new identity in {wait_time:.1f} seconds...")
                         await asyncio.sleep(wait_time)
                         return await make_api_request(retry_count + 1, max_retries)
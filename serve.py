@@ -0,0 +1,176 @@
+"""
+Production server entrypoint for the Virtual Try-On API
+Loads the app and its heavy models once, then forks worker processes that share them copy-on-write and accept on one socket
+"""
+
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Reads its LOG_* settings at import, so only after .env is loaded
+from log_pipeline import configure_logging, shutdown_logging
+
+logger = logging.getLogger("serve")
+
+# Server settings (see .env.example)
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8000"))
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", "True").lower() in ("1", "true", "yes")
+GRACEFUL_TIMEOUT = float(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+RESTART_DELAY = 1.0
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """Bind the listening socket once in the parent so every worker accepts on it."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def load_app(preload: bool):
+    """Import the app (and optionally its models) before forking."""
+    started = time.time()
+    import api
+    if preload:
+        api.preload_models()
+
+    # Move everything loaded so far out of the collector's reach, so GC passes in the
+    # workers don't write to (and un-share) the inherited pages
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+    logger.info(f"App loaded in {time.time() - started:.1f}s (preload={'on' if preload else 'off'})")
+    return api.app
+
+
+def run_worker(app, sock: socket.socket):
+    """Serve on the inherited socket until told to stop (runs in the forked child)."""
+    # uvicorn installs its own SIGINT/SIGTERM handlers for a graceful shutdown
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(
+        app,
+        loop="asyncio",
+        timeout_keep_alive=300,
+        access_log=True,
+        log_level="info",
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Forks the worker processes, restarts any that die and shuts them all down on SIGINT/SIGTERM."""
+
+    def __init__(self, app, sock: socket.socket, workers: int):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self, index: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app, self.sock)
+            except BaseException as e:
+                logger.error(f"Worker {index} crashed: {str(e)}")
+                code = 1
+            finally:
+                # os._exit skips atexit, so flush this worker's log queue first
+                shutdown_logging()
+                os._exit(code)
+        self.children[pid] = index
+        logger.info(f"Started worker {index} (pid {pid})")
+
+    def stop(self, signum=None, frame=None):
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info(f"Stopping {len(self.children)} workers")
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+
+        deadline = None
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                if self.stopping:
+                    deadline = deadline or time.time() + GRACEFUL_TIMEOUT
+                    if time.time() > deadline:
+                        logger.warning("Graceful timeout expired; killing remaining workers")
+                        for child in list(self.children):
+                            try:
+                                os.kill(child, signal.SIGKILL)
+                            except ProcessLookupError:
+                                pass
+                time.sleep(0.2)
+                continue
+
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            logger.warning(f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; restarting")
+            time.sleep(RESTART_DELAY)
+            self.spawn(index)
+
+        self.sock.close()
+        logger.info("All workers stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Virtual Try-On API with multiple worker processes")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    parser.add_argument("--no-preload", dest="preload", action="store_false", default=PRELOAD_MODELS,
+                        help="Load the fashion advisor lazily in each worker instead")
+    args = parser.parse_args(argv)
+
+    workers = max(1, args.workers)
+    # Read at import by executors.py to split the CPU pool between the workers
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    if workers > 1:
+        # Job status must be readable from whichever worker a poll lands on
+        os.environ["JOB_STATE_DIR"] = os.environ.get("JOB_STATE_DIR") or "jobs"
+
+    # The parent writes LOG_FILE; each forked worker restarts the pipeline on its own <name>.<pid>.log
+    configure_logging()
+    sock = bind_socket(args.host, args.port)
+    app = load_app(args.preload)
+    logger.info(f"Listening on {args.host}:{args.port} with {workers} workers")
+
+    if workers == 1 or not hasattr(os, "fork"):
+        # Single process (and platforms without fork): serve in the foreground
+        run_worker(app, sock)
+        return
+    Supervisor(app, sock, workers).run()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,123 @@
+"""
+Request coalescing ("singleflight") for expensive async computations
+Concurrent callers with the same key await one in-flight computation and share its result or error
+"""
+
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+from metrics import REGISTRY, Counter
+import deadline
+import progress
+
+logger = logging.getLogger(__name__)
+
+# Coalescing settings (see .env.example)
+COALESCE_ENABLED = os.environ.get("COALESCE_ENABLED", "True").lower() in ("1", "true", "yes")
+
+COALESCED_REQUESTS = Counter("coalesced_requests_total",
+                             "Requests by whether they started a computation (leader) or joined one in flight (shared)",
+                             ("group", "outcome"))
+
+_groups: List["SingleFlight"] = []
+
+
+class SingleFlight:
+    """A named group of in-flight computations keyed on the normalized request."""
+
+    def __init__(self, name: str, enabled: bool = COALESCE_ENABLED):
+        """
+        Initialize the group
+
+        Args:
+            name: Group name used in metrics and logs
+            enabled: When False every call runs its own computation
+        """
+        self.name = name
+        self.enabled = enabled
+        self.leaders = 0
+        self.shared = 0
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        # Progress of each computation, shared with every caller that joins it
+        self._progress: Dict[str, progress.Broadcast] = {}
+        # Each computation's budget: the latest of its callers' deadlines, cancelled when the last caller leaves
+        self._budgets: Dict[str, deadline.Budget] = {}
+        self._callers: Dict[asyncio.Task, int] = {}
+        _groups.append(self)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn, or join the identical computation already in flight
+
+        The computation runs as its own task, so a caller that disconnects does not
+        cancel it for the callers still waiting on it; once the last caller has gone, it
+        is cancelled. Stages it reports (progress.report) reach every caller's reporter,
+        including those that join late.
+
+        Args:
+            key: Normalized request key; callers with equal keys share one computation
+            fn: Zero-argument coroutine function performing the work
+
+        Returns:
+            The computation's result (exceptions propagate to every caller)
+        """
+        if not self.enabled:
+            return await fn()
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.leaders += 1
+            COALESCED_REQUESTS.labels(self.name, "leader").inc()
+            broadcast = progress.Broadcast(progress.current())
+            budget = deadline.Budget.derive(deadline.current())
+            with progress.reporting_to(broadcast), deadline.attached(budget):
+                task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            self._progress[key] = broadcast
+            self._budgets[key] = budget
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            self.shared += 1
+            COALESCED_REQUESTS.labels(self.name, "shared").inc()
+            self._progress[key].add(progress.current())
+            self._budgets[key].extend(deadline.current())
+            logger.info(f"Joining in-flight {self.name} computation ({len(self._in_flight)} in flight)")
+        budget = self._budgets[key]
+        self._callers[task] = self._callers.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._callers[task] -= 1
+            if not self._callers[task]:
+                del self._callers[task]
+                if not task.done():
+                    logger.info(f"Cancelling {self.name} computation: every caller has gone")
+                    budget.cancel()
+                    task.cancel()
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+            del self._progress[key]
+            del self._budgets[key]
+        if not task.cancelled():
+            # Mark the exception retrieved so an unawaited failure isn't logged as "never retrieved"
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._in_flight),
+            "leaders": self.leaders,
+            "shared": self.shared,
+        }
+
+
+def _collect():
+    yield ("coalesced_in_flight", "gauge", "Distinct computations currently in flight per coalescing group",
+           [({"group": group.name}, len(group._in_flight)) for group in _groups])
+
+
+REGISTRY.register_collector(_collect)
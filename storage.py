@@ -0,0 +1,377 @@
+"""
+Storage lifecycle management for uploads, results and generated images
+A background janitor enforces per-directory TTLs and byte/file quotas, evicting the least recently accessed files first
+"""
+
+import os
+import time
+import fnmatch
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from blob_store import BLOB_BACKEND, BLOB_CACHE_DIR, BLOB_ROOT
+from metrics import REGISTRY, Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+
+# Janitor settings (see .env.example)
+JANITOR_ENABLED = os.environ.get("JANITOR_ENABLED", "True").lower() in ("1", "true", "yes")
+JANITOR_INTERVAL_SECONDS = float(os.environ.get("JANITOR_INTERVAL_SECONDS", "600"))
+# Files accessed more recently than this are never evicted for quota (in-flight uploads and results)
+STORAGE_GRACE_SECONDS = float(os.environ.get("STORAGE_GRACE_SECONDS", "900"))
+# Access times are written to the filesystem at most this often per file
+ACCESS_RESOLUTION_SECONDS = 3600.0
+_ACCESS_MEMO_SIZE = 100000
+
+STORAGE_EVICTED_FILES = Counter("storage_evicted_files_total", "Files deleted by the storage janitor", ("directory", "reason"))
+STORAGE_EVICTED_BYTES = Counter("storage_evicted_bytes_total", "Bytes deleted by the storage janitor", ("directory", "reason"))
+STORAGE_SWEEP_SECONDS = Histogram("storage_sweep_seconds", "Time taken by one janitor pass over a directory", ("directory",))
+
+
+def _env_number(name: str, default: float) -> float:
+    return float(os.environ.get(name, str(default)))
+
+
+class StoragePolicy:
+    """Lifecycle rules for the files matching a pattern in one directory tree."""
+
+    def __init__(self, name: str, directory: str, pattern: str = "*", ttl_seconds: float = 0,
+                 max_bytes: int = 0, max_files: int = 0, recursive: bool = True):
+        """
+        Initialize the policy
+
+        Args:
+            name: Policy name used in metrics and the admin endpoint
+            directory: Directory holding the files
+            pattern: Filename glob selecting the files this policy owns
+            ttl_seconds: Delete files not accessed for this long (0: no TTL)
+            max_bytes: Byte quota; least recently accessed files are evicted past it (0: unlimited)
+            max_files: File count quota (0: unlimited)
+            recursive: Include subdirectories
+        """
+        self.name = name
+        self.directory = directory
+        self.pattern = pattern
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.recursive = recursive
+        # Access-time index from the last sweep, plus its outcome
+        self.files = 0
+        self.bytes = 0
+        self.oldest_access: Optional[float] = None
+        self.last_sweep_at: Optional[float] = None
+        self.last_sweep_seconds: Optional[float] = None
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+
+    @classmethod
+    def from_env(cls, name: str, directory: str, ttl_days: float, max_bytes: int, max_files: int = 0,
+                 pattern: str = "*", recursive: bool = True) -> "StoragePolicy":
+        """Build a policy whose limits can be overridden with STORAGE_<NAME>_TTL_DAYS/_MAX_BYTES/_MAX_FILES."""
+        prefix = f"STORAGE_{name.upper()}"
+        return cls(
+            name,
+            directory,
+            pattern=pattern,
+            ttl_seconds=_env_number(f"{prefix}_TTL_DAYS", ttl_days) * DAY,
+            max_bytes=int(_env_number(f"{prefix}_MAX_BYTES", max_bytes)),
+            max_files=int(_env_number(f"{prefix}_MAX_FILES", max_files)),
+            recursive=recursive,
+        )
+
+    def scan(self) -> List[Tuple[float, int, str]]:
+        """Return (last access, size, path) for every owned file, least recently accessed first."""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        stack = [self.directory]
+        while stack:
+            try:
+                iterator = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with iterator:
+                for entry in iterator:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recursive:
+                                stack.append(entry.path)
+                            continue
+                        if not entry.is_file(follow_symlinks=False) or not fnmatch.fnmatch(entry.name, self.pattern):
+                            continue
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path))
+        entries.sort()
+        return entries
+
+    def sweep(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Apply the TTL, then the quotas, to the files on disk
+
+        Returns:
+            Number of files and bytes evicted for each reason
+        """
+        started = time.time()
+        now = now or started
+        entries = self.scan()
+        total_bytes = sum(size for _, size, _ in entries)
+        evicted = {"ttl_files": 0, "ttl_bytes": 0, "quota_files": 0, "quota_bytes": 0}
+
+        kept = []
+        for accessed, size, path in entries:
+            if self.ttl_seconds and accessed < now - self.ttl_seconds and self._delete(path, size, "ttl"):
+                evicted["ttl_files"] += 1
+                evicted["ttl_bytes"] += size
+                total_bytes -= size
+            else:
+                kept.append((accessed, size, path))
+
+        # kept is oldest access first; stop at the grace window so fresh files survive a burst
+        index = 0
+        while index < len(kept) and ((self.max_bytes and total_bytes > self.max_bytes) or
+                                     (self.max_files and len(kept) - index > self.max_files)):
+            accessed, size, path = kept[index]
+            if accessed > now - STORAGE_GRACE_SECONDS:
+                logger.warning(f"Storage {self.name} is over quota but every remaining file is in use")
+                break
+            if self._delete(path, size, "quota"):
+                evicted["quota_files"] += 1
+                evicted["quota_bytes"] += size
+                total_bytes -= size
+            index += 1
+        kept = kept[index:]
+
+        self.files = len(kept)
+        self.bytes = total_bytes
+        self.oldest_access = kept[0][0] if kept else None
+        self.last_sweep_at = now
+        self.last_sweep_seconds = time.time() - started
+        STORAGE_SWEEP_SECONDS.labels(self.name).observe(self.last_sweep_seconds)
+        if evicted["ttl_files"] or evicted["quota_files"]:
+            logger.info(f"Storage {self.name}: evicted {evicted['ttl_files']} expired and "
+                        f"{evicted['quota_files']} over-quota files ({evicted['ttl_bytes'] + evicted['quota_bytes']} bytes)")
+        return evicted
+
+    def _delete(self, path: str, size: int, reason: str) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Another worker process got there first
+            return True
+        except OSError as e:
+            logger.warning(f"Could not delete {path}: {str(e)}")
+            return False
+        _forget_access(path)
+        _delete_derived(path)
+        self.evicted_files += 1
+        self.evicted_bytes += size
+        STORAGE_EVICTED_FILES.labels(self.name, reason).inc()
+        STORAGE_EVICTED_BYTES.labels(self.name, reason).inc(size)
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "pattern": self.pattern,
+            "ttl_days": round(self.ttl_seconds / DAY, 3) if self.ttl_seconds else None,
+            "max_bytes": self.max_bytes or None,
+            "max_files": self.max_files or None,
+            "files": self.files,
+            "bytes": self.bytes,
+            "oldest_access": self.oldest_access,
+            "last_sweep_at": self.last_sweep_at,
+            "last_sweep_seconds": round(self.last_sweep_seconds, 3) if self.last_sweep_seconds is not None else None,
+            "evicted_files": self.evicted_files,
+            "evicted_bytes": self.evicted_bytes,
+        }
+
+
+def _delete_derived(path: str):
+    """
+    Delete files derived from a removed one and stored beside it (<stem>.w320.webp variants, <stem>.norm.jpg)
+
+    They were made from the old content, so a file regenerated under the same name must not be served with them.
+    """
+    directory, name = os.path.split(path)
+    prefix = os.path.splitext(name)[0] + "."
+    try:
+        with os.scandir(directory) as entries:
+            derived = [entry.path for entry in entries if entry.name.startswith(prefix) and entry.name != name]
+    except OSError:
+        return
+    for derived_path in derived:
+        try:
+            os.remove(derived_path)
+            _forget_access(derived_path)
+        except OSError:
+            pass
+
+
+# Last time each path's access was written to disk, to throttle utime calls
+_access_memo: Dict[str, float] = {}
+_access_lock = threading.Lock()
+
+
+def record_access(path: str):
+    """
+    Mark a file as used so the janitor keeps it
+
+    The access time lives in the file's atime (set explicitly, so noatime/relatime mounts
+    don't matter) and is written at most once per ACCESS_RESOLUTION_SECONDS per file.
+    The mtime is preserved so ETags and Last-Modified stay stable.
+    """
+    now = time.time()
+    with _access_lock:
+        if now - _access_memo.get(path, 0.0) < ACCESS_RESOLUTION_SECONDS:
+            return
+        if len(_access_memo) >= _ACCESS_MEMO_SIZE:
+            _access_memo.clear()
+        _access_memo[path] = now
+    try:
+        stat = os.stat(path)
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+    except OSError:
+        pass
+
+
+def _forget_access(path: str):
+    with _access_lock:
+        _access_memo.pop(path, None)
+
+
+class Janitor:
+    """Runs every policy's sweep on a background thread."""
+
+    def __init__(self, policies: List[StoragePolicy], interval_seconds: float = JANITOR_INTERVAL_SECONDS,
+                 lock_path: str = ".storage_janitor.lock"):
+        """
+        Initialize the janitor
+
+        Args:
+            policies: Policies to enforce
+            interval_seconds: Pause between sweeps
+            lock_path: Lock file that keeps worker processes from sweeping at the same time
+        """
+        self.policies = {policy.name: policy for policy in policies}
+        self.interval_seconds = interval_seconds
+        self.lock_path = lock_path
+        self.sweeps = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._sweep_lock = threading.Lock()
+
+    def start(self):
+        """Start sweeping in the background (first sweep runs immediately)."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="storage-janitor", daemon=True)
+        self._thread.start()
+        logger.info(f"Storage janitor started for {', '.join(self.policies)} every {self.interval_seconds:.0f}s")
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Storage sweep failed: {str(e)}")
+            self._stop.wait(self.interval_seconds)
+
+    def sweep(self, names: Optional[List[str]] = None) -> Optional[Dict[str, Dict[str, int]]]:
+        """
+        Sweep the given policies (all by default) once
+
+        Returns:
+            Evictions per policy, or None if another process or thread is already sweeping
+        """
+        if not self._sweep_lock.acquire(blocking=False):
+            return None
+        try:
+            with _try_file_lock(self.lock_path) as acquired:
+                if not acquired:
+                    return None
+                results = {}
+                for name, policy in self.policies.items():
+                    if names is None or name in names:
+                        results[name] = policy.sweep()
+                self.sweeps += 1
+                return results
+        finally:
+            self._sweep_lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self._thread is not None,
+            "interval_seconds": self.interval_seconds,
+            "grace_seconds": STORAGE_GRACE_SECONDS,
+            "sweeps": self.sweeps,
+            "directories": {name: policy.to_dict() for name, policy in self.policies.items()},
+        }
+
+    def collect(self):
+        """Metrics collector: usage and quotas as of the last sweep."""
+        policies = list(self.policies.values())
+        yield ("storage_bytes", "gauge", "Bytes stored per directory as of the last janitor sweep",
+               [({"directory": p.name}, p.bytes) for p in policies])
+        yield ("storage_files", "gauge", "Files stored per directory as of the last janitor sweep",
+               [({"directory": p.name}, p.files) for p in policies])
+        yield ("storage_quota_bytes", "gauge", "Byte quota per directory (0: unlimited)",
+               [({"directory": p.name}, p.max_bytes) for p in policies])
+        yield ("storage_oldest_access_age_seconds", "gauge", "Age of the least recently accessed file per directory",
+               [({"directory": p.name}, (time.time() - p.oldest_access) if p.oldest_access else 0) for p in policies])
+
+
+@contextmanager
+def _try_file_lock(path: str):
+    """Non-blocking exclusive lock file; yields False when another process holds it (True where fcntl is unavailable)."""
+    try:
+        import fcntl
+    except ImportError:
+        yield True
+        return
+    with open(path, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def default_policies() -> List[StoragePolicy]:
+    """
+    The app's storage layout with its default limits (each overridable from the environment)
+
+    With a remote blob backend the policies apply to the local copies in BLOB_CACHE_DIR; the bucket's
+    own lifecycle rules govern the objects themselves.
+    """
+    root = BLOB_ROOT if BLOB_BACKEND == "local" else BLOB_CACHE_DIR
+    return [
+        StoragePolicy.from_env("models", os.path.join(root, "uploads", "models"), ttl_days=30, max_bytes=5 * 1024 ** 3),
+        StoragePolicy.from_env("clothes", os.path.join(root, "uploads", "clothes"), ttl_days=30, max_bytes=5 * 1024 ** 3),
+        # Outfit photos are only read while they are analysed
+        StoragePolicy.from_env("outfits", os.path.join(root, "uploads", "outfits"), ttl_days=7, max_bytes=1024 ** 3),
+        StoragePolicy.from_env("results", os.path.join(root, "results"),
+                               ttl_days=float(os.environ.get("RESULT_EXPIRY_DAYS", "7")), max_bytes=4 * 1024 ** 3),
+        StoragePolicy.from_env("generated", os.path.join(root, "generated"), ttl_days=30, max_bytes=2 * 1024 ** 3),
+        # Fashion-advice uploads are deleted after the request; this catches any a crash left behind
+        StoragePolicy.from_env("temp", ".", ttl_days=1 / 24, max_bytes=0, pattern="temp_advice_*", recursive=False),
+    ]
+
+
+janitor = Janitor(default_policies())
+REGISTRY.register_collector(janitor.collect)
@@ -0,0 +1,152 @@
+"""
+Tests for the batch try-on endpoint: the concurrency bound, NDJSON streaming and upload reference resolution
+Runs offline against a temporary blob store and stand-in jobs; no server or API key required
+"""
+
+import json
+import asyncio
+import tempfile
+import threading
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import api
+import blob_store
+from blob_store import LocalBlobStore
+from job_queue import SUCCEEDED, FAILED
+
+DIGEST = "cd" * 32
+
+
+class _Jobs:
+    """Stand-in for submit_tryon_job and the job queue: each cloth takes as long as its name says."""
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self.submitted = []
+        self.loop_threads = set()
+
+    async def submit(self, model_path, cloth_path, category, params, budget=None, detached=False):
+        self.loop_threads.add(threading.current_thread())
+        self.submitted.append((model_path, cloth_path, category, params))
+        if cloth_path == "rejected.png":
+            raise HTTPException(status_code=404, detail="Cloth image not found")
+        return SimpleNamespace(cloth_path=cloth_path, status=None, result=None, error=None)
+
+    async def wait(self, job):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(float(job.cloth_path.split("s")[0]) if job.cloth_path[0].isdigit() else 0)
+        finally:
+            self.running -= 1
+        if job.cloth_path == "broken.png":
+            job.status, job.error = FAILED, "Segmind API error"
+        else:
+            job.status, job.result = SUCCEEDED, {"result": f"out_{job.cloth_path}"}
+        return job
+
+
+def _batch(body, jobs):
+    saved = api.submit_tryon_job, api.job_queue
+    api.submit_tryon_job, api.job_queue = jobs.submit, jobs
+    try:
+        response = TestClient(api.app).post("/api/tryon/batch", json=body)
+    finally:
+        api.submit_tryon_job, api.job_queue = saved
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_batch_streams_items_as_they_finish():
+    jobs = _Jobs()
+    lines = _batch({"models": ["model.png"], "clothes": ["0.3s.png", "0.1s.png", "broken.png", "rejected.png"],
+                    "categories": ["Upper body", "Lower body", "Dress", "Upper body"], "seed": 7}, jobs)
+
+    # Quickest first, whatever the request order; the summary comes last
+    indices = [line.get("index") for line in lines]
+    assert set(indices[:2]) == {2, 3} and indices[2:] == [1, 0, None]
+    by_index = {line["index"]: line for line in lines[:-1]}
+    assert by_index[0]["status"] == "succeeded" and by_index[0]["result"] == "out_0.3s.png"
+    assert by_index[1]["clothing_category"] == "Lower body"
+    assert by_index[2]["status"] == "failed" and by_index[2]["error"] == "Segmind API error"
+    assert by_index[3]["status"] == "failed" and by_index[3]["error"] == "Cloth image not found"
+    assert all("elapsed_seconds" in line for line in lines[:-1])
+    assert lines[-1] == {"done": True, "total": 4, "succeeded": 2, "failed": 2}
+    assert {params["seed"] for _, _, _, params in jobs.submitted} == {7}
+
+
+def test_batch_concurrency_is_bounded():
+    saved = api.TRYON_BATCH_CONCURRENCY
+    api.TRYON_BATCH_CONCURRENCY = 3
+    try:
+        clothes = [f"0.0{n}s.png" for n in range(1, 10)]
+        jobs = _Jobs()
+        lines = _batch({"models": ["a.png", "b.png"], "clothes": clothes, "concurrency": 2}, jobs)
+        assert len(lines) == 19 and jobs.peak == 2
+
+        # A larger request is capped by TRYON_BATCH_CONCURRENCY
+        jobs = _Jobs()
+        _batch({"models": ["a.png", "b.png"], "clothes": clothes, "concurrency": 50}, jobs)
+        assert jobs.peak == 3
+    finally:
+        api.TRYON_BATCH_CONCURRENCY = saved
+
+
+def test_refs_are_resolved_once_off_the_event_loop():
+    with tempfile.TemporaryDirectory() as tmp:
+        saved_store = blob_store.store
+        saved_resolve = api.resolve_upload_ref
+        blob_store.store = LocalBlobStore(tmp, shard_levels=1)
+        lookups = []
+
+        def resolve(kind, ref):
+            lookups.append((kind, ref, threading.current_thread()))
+            return saved_resolve(kind, ref)
+
+        api.resolve_upload_ref = resolve
+        try:
+            blob_store.store.put_bytes(f"uploads/models/{DIGEST}.png", b"model")
+            blob_store.store.put_bytes(f"uploads/models/{DIGEST}.norm.jpg", b"normalized")
+            jobs = _Jobs()
+            lines = _batch({"models": [DIGEST, "uploads/models/other.png", DIGEST],
+                            "clothes": ["0.01s.png", "0.02s.png"]}, jobs)
+        finally:
+            api.resolve_upload_ref = saved_resolve
+            blob_store.store = saved_store
+
+        # Each distinct ref is looked up once, on a pool thread rather than the loop serving the request
+        assert sorted((kind, ref) for kind, ref, _ in lookups) == [
+            ("clothes", "0.01s.png"), ("clothes", "0.02s.png"),
+            ("models", DIGEST), ("models", "uploads/models/other.png")]
+        assert not {thread for _, _, thread in lookups} & jobs.loop_threads
+        # Content ids become the stored original's key, not its normalized copy
+        assert {model for model, _, _, _ in jobs.submitted} == {f"uploads/models/{DIGEST}.png", "uploads/models/other.png"}
+        assert len(lines) == 7
+
+
+def test_invalid_batches_are_rejected_before_any_work():
+    jobs = _Jobs()
+    saved = api.submit_tryon_job
+    api.submit_tryon_job = jobs.submit
+    try:
+        client = TestClient(api.app)
+        for body in ({"models": [], "clothes": ["a.png"]}, {"models": ["a.png"], "clothes": "a.png"},
+                     {"models": ["a.png"], "clothes": ["a.png", "b.png"], "categories": ["Dress"]},
+                     {"models": [1], "clothes": ["a.png"]}, {"models": ["a.png"], "clothes": ["b.png"], "concurrency": "x"}):
+            assert client.post("/api/tryon/batch", json=body).status_code == 400, body
+    finally:
+        api.submit_tryon_job = saved
+    assert jobs.submitted == []
+
+
+if __name__ == "__main__":
+    test_batch_streams_items_as_they_finish()
+    test_batch_concurrency_is_bounded()
+    test_refs_are_resolved_once_off_the_event_loop()
+    test_invalid_batches_are_rejected_before_any_work()
+    print("✅ Batch try-on tests passed")
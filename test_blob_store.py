@@ -0,0 +1,115 @@
+"""
+Tests for the blob storage backends
+Local and memory backends run offline; the S3 backend runs against moto's local S3 server when boto3 and moto are installed
+"""
+
+import os
+import shutil
+import tempfile
+
+from blob_store import LocalBlobStore, MemoryBlobStore, S3BlobStore, make_key, validate_key
+
+DIGEST = "ab" + "0" * 62
+
+
+def _exercise(store):
+    """Behaviour every backend shares."""
+    path = store.put_bytes("results/one.png", b"first")
+    with open(path, "rb") as f:
+        assert f.read() == b"first"
+    assert store.stat("results/one.png")[0] == 5
+    assert store.stat("results/missing.png") is None
+
+    store.put_bytes(f"uploads/models/{DIGEST}.png", b"model")
+    assert [name for name, _, _ in store.list("uploads/models", DIGEST)] == [f"{DIGEST}.png"]
+    assert sorted(name for name, _, _ in store.list("results")) == ["one.png"]
+
+    # Moving a stored blob's local copy to a new key consumes the old blob
+    store.put_file("results/two.png", store.local_path("results/one.png"))
+    assert not store.exists("results/one.png")
+    assert store.localize("results/two.png") == store.local_path("results/two.png")
+
+    store.delete("results/two.png")
+    assert store.local_path("results/two.png") is None
+
+
+def test_keys_are_validated():
+    assert make_key("./results", "a.png") == "results/a.png"
+    assert make_key("", "a.png") == "a.png"
+    for namespace, name in (("uploads/..", "api.py"), ("uploads/../..", "etc"), ("results/../uploads", "a.png"),
+                            ("uploads", "../.env"), ("uploads", "..")):
+        try:
+            make_key(namespace, name)
+        except ValueError:
+            continue
+        raise AssertionError(f"{namespace!r} + {name!r} was accepted")
+    for bad in ("", "/etc/passwd", "results/../secret", "a//b", "a\\b"):
+        try:
+            validate_key(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad!r} was accepted")
+
+
+def test_local_store_shards_and_reads_legacy_flat_files():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LocalBlobStore(tmp, shard_levels=1)
+        _exercise(store)
+
+        # Content-addressed names shard on their digest
+        path = store.local_path(f"uploads/models/{DIGEST}.png")
+        assert path == os.path.join(tmp, "uploads", "models", "ab", f"{DIGEST}.png")
+        assert store.key_for_path(path) == f"uploads/models/{DIGEST}.png"
+
+        # Files written before sharding are still found where they are
+        os.makedirs(os.path.join(tmp, "generated"))
+        with open(os.path.join(tmp, "generated", "old.png"), "wb") as f:
+            f.write(b"legacy")
+        assert store.local_path("generated/old.png") == os.path.join(tmp, "generated", "old.png")
+        assert [name for name, _, _ in store.list("generated")] == ["old.png"]
+
+
+def test_memory_store():
+    store = MemoryBlobStore(cache_dir=tempfile.mkdtemp())
+    try:
+        _exercise(store)
+        assert set(store.blobs) == {f"uploads/models/{DIGEST}.png"}
+    finally:
+        shutil.rmtree(store.cache.root, ignore_errors=True)
+
+
+def test_s3_store_against_local_stand_in():
+    try:
+        import boto3
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        print("boto3/moto not installed; skipping the S3 backend test")
+        return
+
+    server = ThreadedMotoServer(port=0)
+    server.start()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        host, port = server.get_host_and_port()
+        client = boto3.client("s3", endpoint_url=f"http://{host}:{port}", region_name="us-east-1",
+                              aws_access_key_id="test", aws_secret_access_key="test")
+        client.create_bucket(Bucket="tryon")
+        store = S3BlobStore(bucket="tryon", prefix="test", cache_dir=cache_dir, client=client)
+        _exercise(store)
+
+        # A second node with an empty local cache reads the same objects
+        other = S3BlobStore(bucket="tryon", prefix="test", cache_dir=tempfile.mkdtemp(), client=client)
+        with open(other.local_path(f"uploads/models/{DIGEST}.png"), "rb") as f:
+            assert f.read() == b"model"
+        shutil.rmtree(other.cache.root, ignore_errors=True)
+    finally:
+        server.stop()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_keys_are_validated()
+    test_local_store_shards_and_reads_legacy_flat_files()
+    test_memory_store()
+    test_s3_store_against_local_stand_in()
+    print("✅ Blob store tests passed")
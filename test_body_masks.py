@@ -0,0 +1,36 @@
+"""
+Tests for the vectorized, cached alpha masks of the local try-on compositor
+Runs offline; no server or API key required
+"""
+
+import numpy as np
+
+import body_masks
+from benchmark_masks import loop_body_mask, loop_blend_mask, CATEGORIES
+
+
+def test_masks_match_the_per_pixel_versions():
+    for size in [(1, 1), (7, 5), (64, 80), (97, 131), (333, 777)]:
+        for category in CATEGORIES:
+            assert np.array_equal(np.array(body_masks.body_mask(size, category)),
+                                  np.array(loop_body_mask(size, category))), (size, category, "body")
+            assert np.array_equal(np.array(body_masks.blend_mask(size, category)),
+                                  np.array(loop_blend_mask(size, category))), (size, category, "blend")
+
+
+def test_masks_are_cached_by_size_and_region():
+    body_masks.clear_cache()
+    first = body_masks.body_mask((120, 160), "Upper body")
+    assert body_masks.body_mask([120, 160], "Upper body") is first
+    # Any category other than upper or lower body gets the dress silhouette
+    assert body_masks.body_mask((120, 160), "Dress") is body_masks.body_mask((120, 160), "Full dress")
+    assert body_masks.body_mask((160, 120), "Upper body") is not first
+    info = body_masks.cache_info()["body"]
+    assert info.hits == 2 and info.misses == 3
+    assert first.mode == "L" and first.size == (120, 160)
+
+
+if __name__ == "__main__":
+    test_masks_match_the_per_pixel_versions()
+    test_masks_are_cached_by_size_and_region()
+    print("✅ Body mask tests passed")
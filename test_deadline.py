@@ -0,0 +1,182 @@
+"""
+Tests for request deadlines and cancellation of work nobody is waiting for
+Runs offline; no server or API key required
+"""
+
+import time
+import asyncio
+import threading
+
+import deadline
+from deadline import Budget, Cancelled, DeadlineExceeded, DeadlineMiddleware
+from job_queue import JobQueue, CANCELLED
+from singleflight import SingleFlight
+
+
+def _raises(exception, fn, *args):
+    try:
+        fn(*args)
+    except exception:
+        return
+    raise AssertionError(f"expected {exception.__name__}")
+
+
+def test_budget_clamps_timeouts_and_cuts_sleeps_short():
+    assert deadline.clamp(180) == 180 and deadline.remaining() is None
+
+    with deadline.attached(Budget(0.5)):
+        assert deadline.clamp(180) <= 0.5
+        # A backoff that would outlast the deadline gives up at once instead of sleeping
+        started = time.monotonic()
+        _raises(DeadlineExceeded, deadline.sleep, 5)
+        assert time.monotonic() - started < 0.1
+
+    budget = Budget()
+    fired = []
+    budget.on_cancel(lambda: fired.append(1))
+    threading.Timer(0.05, budget.cancel).start()
+    started = time.monotonic()
+    _raises(Cancelled, budget.sleep, 5)
+    assert fired == [1] and time.monotonic() - started < 1
+
+    expired = Budget(0)
+    with deadline.attached(expired):
+        _raises(DeadlineExceeded, deadline.check)
+
+    assert deadline.budget_from("2").remaining() <= 2
+    assert deadline.budget_from("junk").remaining() > 2
+    assert deadline.budget_from("100000").remaining() <= deadline.REQUEST_TIMEOUT_MAX_SECONDS
+    shared = Budget.derive(Budget(1))
+    shared.extend(Budget(10))
+    assert shared.remaining() > 9
+    shared.extend(None)
+    assert shared.remaining() is None
+
+
+def _scope(timeout=None):
+    headers = [(b"content-length", b"2")]
+    if timeout:
+        headers.append((b"x-request-timeout", timeout.encode()))
+    return {"type": "http", "method": "POST", "path": "/api/tryon", "headers": headers}
+
+
+def _receive(disconnect_after):
+    """A client that sends its body, then disconnects after disconnect_after seconds."""
+    messages = [{"type": "http.request", "body": b"{}"}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(disconnect_after)
+        return {"type": "http.disconnect"}
+    return receive
+
+
+def test_middleware_cancels_on_disconnect_and_answers_504_past_the_deadline():
+    async def scenario():
+        seen = {}
+
+        async def slow_app(scope, receive, send):
+            seen["budget"] = deadline.current()
+            await receive()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                seen["cancelled"] = True
+                raise
+
+        responses = []
+
+        async def send(message):
+            responses.append(message)
+
+        started = time.monotonic()
+        await DeadlineMiddleware(slow_app)(_scope(), _receive(0.05), send)
+        assert time.monotonic() - started < 1
+        assert seen["cancelled"] and seen["budget"].cancelled
+        assert responses[0]["status"] == deadline.CLIENT_CLOSED_REQUEST
+
+        responses.clear()
+        seen.clear()
+        started = time.monotonic()
+        await DeadlineMiddleware(slow_app)(_scope("0.1"), _receive(30), send)
+        assert time.monotonic() - started < 1
+        assert seen["cancelled"] and responses[0]["status"] == 504
+
+    asyncio.run(scenario())
+
+
+def test_job_queue_cancels_jobs_once_their_last_waiter_leaves():
+    async def scenario():
+        queue = JobQueue(workers=1, max_pending=10, state_dir="")
+        await queue.start()
+        try:
+            calls = []
+
+            def work():
+                calls.append(1)
+                deadline.sleep(5)
+                return {"result": "out.png"}
+
+            running = queue.submit("tryon", work, key="a")
+            queued = queue.submit("tryon", work, key="b")
+            waiters = [asyncio.ensure_future(queue.wait(job)) for job in (running, running, queued)]
+            await asyncio.sleep(0.05)
+
+            # One of two waiters leaving keeps the job going
+            waiters[0].cancel()
+            await asyncio.sleep(0.05)
+            assert not running.budget.cancelled
+
+            started = time.monotonic()
+            for waiter in waiters[1:]:
+                waiter.cancel()
+            await asyncio.sleep(0.05)
+            assert queued.status == CANCELLED
+            while not running.done:
+                await asyncio.sleep(0.01)
+            assert running.status == CANCELLED and time.monotonic() - started < 1
+            assert calls == [1] and queue.stats()["cancelled"] == 2
+
+            # A cancelled job is no longer joined by identical submissions; detached jobs outlive their waiters
+            fresh = queue.submit("tryon", lambda: {"result": "x.png"}, key="a", detached=True)
+            assert fresh is not running
+            waiter = asyncio.ensure_future(queue.wait(fresh))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await queue.wait(fresh, timeout=1)
+            assert fresh.result == {"result": "x.png"}
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_singleflight_cancels_the_computation_when_every_caller_has_gone():
+    async def scenario():
+        flight = SingleFlight("test", enabled=True)
+        outcome = {}
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                outcome["budget_cancelled"] = deadline.current().cancelled
+                raise
+
+        callers = [asyncio.ensure_future(flight.do("k", slow)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.sleep(0.01)
+        assert outcome == {"budget_cancelled": True} and flight.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_budget_clamps_timeouts_and_cuts_sleeps_short()
+    test_middleware_cancels_on_disconnect_and_answers_504_past_the_deadline()
+    test_job_queue_cancels_jobs_once_their_last_waiter_leaves()
+    test_singleflight_cancels_the_computation_when_every_caller_has_gone()
+    print("✅ Deadline tests passed")
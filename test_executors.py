@@ -0,0 +1,110 @@
+"""
+Tests for the bulkhead executors: queue limits, rejection and pool sizing per server process
+Runs offline; no server or API key required
+"""
+
+import os
+import sys
+import asyncio
+import threading
+import contextvars
+import subprocess
+
+from executors import Bulkhead, BulkheadFull
+
+REQUEST_ID = contextvars.ContextVar("request_id", default=None)
+
+
+def test_full_pool_rejects_until_work_drains():
+    async def scenario():
+        pool = Bulkhead("test", workers=2, queue_limit=1)
+        release = threading.Event()
+        running = []
+
+        def blocked(n):
+            running.append(n)
+            release.wait(5)
+            return n
+
+        try:
+            # Two run and one waits; the fourth is turned away without being queued
+            tasks = [asyncio.ensure_future(pool.run(blocked, n)) for n in range(3)]
+            await asyncio.sleep(0.05)
+            assert sorted(running) == [0, 1] and pool.in_flight == 3
+            try:
+                await pool.run(blocked, 3)
+            except BulkheadFull as e:
+                assert "test pool is busy" in str(e)
+            else:
+                raise AssertionError("a full pool accepted more work")
+            assert pool.stats()["rejected"] == 1 and 3 not in running
+
+            release.set()
+            assert await asyncio.gather(*tasks) == [0, 1, 2]
+            stats = pool.stats()
+            assert (stats["in_flight"], stats["completed"], stats["kind"]) == (0, 3, "thread")
+
+            # Room again once drained, and failures free their slot too
+            assert await pool.run(lambda: "again") == "again"
+            try:
+                await pool.run(lambda: 1 / 0)
+            except ZeroDivisionError:
+                pass
+            assert pool.in_flight == 0
+        finally:
+            release.set()
+            pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_thread_pools_carry_the_callers_context():
+    async def scenario():
+        pool = Bulkhead("context", workers=1, queue_limit=0)
+        try:
+            REQUEST_ID.set("abc")
+            assert await pool.run(REQUEST_ID.get) == "abc"
+            # A zero queue limit still admits one item per worker
+            assert await pool.run(threading.current_thread) is not threading.current_thread()
+        finally:
+            pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_process_pools_run_work_in_another_process():
+    async def scenario():
+        pool = Bulkhead("process", workers=1, queue_limit=0, processes=True)
+        try:
+            assert await pool.run(os.getpid) != os.getpid()
+            assert pool.stats()["kind"] == "process"
+        finally:
+            pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def _cpu_pool_size(**env) -> int:
+    environ = {k: v for k, v in os.environ.items() if k not in ("WEB_CONCURRENCY", "CPU_POOL_SIZE")}
+    environ.update(env)
+    output = subprocess.check_output([sys.executable, "-c", "import executors; print(executors.CPU_POOL_SIZE)"],
+                                     env=environ, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return int(output)
+
+
+def test_cpu_pool_is_split_between_server_processes():
+    cpus = os.cpu_count() or 2
+    assert _cpu_pool_size() == max(1, cpus // 2)
+    assert _cpu_pool_size(WEB_CONCURRENCY="2") == max(1, cpus // 4)
+    # Never below one worker, however many server processes there are
+    assert _cpu_pool_size(WEB_CONCURRENCY=str(cpus * 4)) == 1
+    # An explicit size wins
+    assert _cpu_pool_size(WEB_CONCURRENCY="4", CPU_POOL_SIZE="3") == 3
+
+
+if __name__ == "__main__":
+    test_full_pool_rejects_until_work_drains()
+    test_thread_pools_carry_the_callers_context()
+    test_process_pools_run_work_in_another_process()
+    test_cpu_pool_is_split_between_server_processes()
+    print("✅ Executor tests passed")
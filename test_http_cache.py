@@ -0,0 +1,70 @@
+"""
+Tests for validators and cache headers on served images
+Runs offline; no server or API key required
+"""
+
+import os
+import asyncio
+import tempfile
+
+from starlette.requests import Request
+
+import http_cache
+from executors import BulkheadFull
+from result_cache import file_sha256
+
+DIGEST = "ab" * 32
+
+
+def _request(headers=None):
+    raw = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw})
+
+
+def _serve(path, headers=None):
+    return asyncio.run(http_cache.cached_file_response(_request(headers), path))
+
+
+def test_only_self_hashed_names_are_immutable():
+    assert http_cache.is_content_addressed(f"{DIGEST}.png")
+    assert http_cache.is_content_addressed(f"{DIGEST}.w320.webp")
+    # Results are keyed by their inputs, so a regenerated result reuses the name with new bytes
+    assert not http_cache.is_content_addressed(f"tryon_{DIGEST}.png")
+    assert not http_cache.is_content_addressed(f"prompt_{DIGEST}.png")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        upload, result = os.path.join(tmp, f"{DIGEST}.png"), os.path.join(tmp, f"tryon_{DIGEST}.png")
+        for path in (upload, result):
+            with open(path, "wb") as f:
+                f.write(b"image bytes")
+        assert "immutable" in _serve(upload).headers["cache-control"]
+        response = _serve(result)
+        assert "must-revalidate" in response.headers["cache-control"]
+        assert response.headers["etag"] == f'"{file_sha256(result)}"'
+        assert _serve(result, {"If-None-Match": response.headers["etag"]}).status_code == 304
+
+
+def test_etag_falls_back_to_a_weak_validator_when_the_disk_pool_is_full():
+    async def busy(*args):
+        raise BulkheadFull("busy")
+
+    original = http_cache.disk_pool.run
+    http_cache.disk_pool.run = busy
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fresh.png")
+            with open(path, "wb") as f:
+                f.write(b"0123456789")
+            response = _serve(path, {"Range": "bytes=0-3", "If-Range": '"x"'})
+            assert response.headers["etag"].startswith('W/"') and response.status_code == 200
+            # Once the digest is known it is served without going to the pool
+            file_sha256(path)
+            assert _serve(path).headers["etag"] == f'"{file_sha256(path)}"'
+    finally:
+        http_cache.disk_pool.run = original
+
+
+if __name__ == "__main__":
+    test_only_self_hashed_names_are_immutable()
+    test_etag_falls_back_to_a_weak_validator_when_the_disk_pool_is_full()
+    print("✅ HTTP cache tests passed")
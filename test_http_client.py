@@ -0,0 +1,150 @@
+"""
+Tests for the shared outbound HTTP client against a local stub server
+Runs offline; no server or API key required
+"""
+
+import asyncio
+import threading
+import time
+
+from aiohttp import web
+
+import deadline
+import http_client
+from deadline import Budget, Cancelled, DeadlineExceeded
+from http_client import UpstreamError, request_blocking
+
+
+class _App:
+    """An event loop on its own thread, like the server's, running the shared session and a stub upstream."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.peers = []
+        self.runner = None
+        self.url = None
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(5)
+
+    async def _echo(self, request):
+        # The client's port tells whether a connection was reused
+        self.peers.append(request.transport.get_extra_info("peername")[1])
+        return web.json_response({"path": request.path, "cookie": request.cookies.get("session")})
+
+    async def _slow(self, request):
+        await asyncio.sleep(2)
+        return web.json_response({})
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_get("/echo", self._echo)
+        app.router.add_get("/slow", self._slow)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{self.runner.addresses[0][1]}"
+        await http_client.startup()
+
+    async def _stop(self):
+        await http_client.shutdown()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def __enter__(self):
+        self.thread.start()
+        self.call(self._start())
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.call(self._stop())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(5)
+            self.loop.close()
+
+
+def _raises(exception, fn, *args, **kwargs):
+    try:
+        fn(*args, **kwargs)
+    except exception as e:
+        return e
+    raise AssertionError(f"expected {exception.__name__}")
+
+
+def test_worker_threads_share_the_apps_session():
+    with _App() as app:
+        session = http_client._session
+        first = request_blocking("GET", f"{app.url}/echo", cookies={"session": "a"})
+        second = request_blocking("GET", f"{app.url}/echo")
+        assert first.status_code == 200 and first.json() == {"path": "/echo", "cookie": "a"}
+        # Cookies are per request, and both calls went over one kept-alive connection of the shared session
+        assert second.json()["cookie"] is None
+        assert http_client._session is session and app.peers[0] == app.peers[1]
+
+        # Several threads at once are all bridged onto the loop
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(request_blocking("GET", f"{app.url}/echo")))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert [response.status_code for response in results] == [200] * 4
+
+        # The loop thread itself must await request() rather than block on it
+        async def on_loop():
+            return _raises(RuntimeError, request_blocking, "GET", f"{app.url}/echo")
+        assert "event loop thread" in str(app.call(on_loop()))
+
+
+def test_timeouts_and_deadlines():
+    with _App() as app:
+        started = time.monotonic()
+        error = _raises(UpstreamError, request_blocking, "GET", f"{app.url}/slow", timeout=0.2)
+        assert "/slow failed" in str(error) and time.monotonic() - started < 1
+
+        # A sooner request deadline cuts the timeout and is reported as such
+        with deadline.attached(Budget(0.2)):
+            _raises(DeadlineExceeded, request_blocking, "GET", f"{app.url}/slow", timeout=30)
+
+        # Cancelling the budget abandons the call on the loop
+        budget = Budget(30)
+        threading.Timer(0.1, budget.cancel).start()
+        started = time.monotonic()
+        with deadline.attached(budget):
+            _raises(Cancelled, request_blocking, "GET", f"{app.url}/slow")
+        assert time.monotonic() - started < 1
+
+        # Connection failures are upstream errors too
+        stopped_url = f"http://127.0.0.1:{app.runner.addresses[0][1]}"
+        app.call(app.runner.cleanup())
+        app.runner = None
+        _raises(UpstreamError, request_blocking, "GET", f"{stopped_url}/echo", timeout=1)
+
+
+def test_shutdown_closes_the_session_and_later_calls_use_their_own():
+    with _App() as app:
+        session = http_client._session
+        request_blocking("GET", f"{app.url}/echo")
+        app.call(http_client.shutdown())
+        assert session.closed and http_client._session is None and http_client._loop is None
+
+        # Without a running app each call gets a one-off session, so connections are not reused
+        assert request_blocking("GET", f"{app.url}/echo").status_code == 200
+        assert request_blocking("GET", f"{app.url}/echo").status_code == 200
+        assert len(set(app.peers)) == 3
+
+        # Starting again gives a fresh shared session
+        app.call(http_client.startup())
+        assert http_client._session is not session and not http_client._session.closed
+
+
+if __name__ == "__main__":
+    test_worker_threads_share_the_apps_session()
+    test_timeouts_and_deadlines()
+    test_shutdown_closes_the_session_and_later_calls_use_their_own()
+    print("✅ HTTP client tests passed")
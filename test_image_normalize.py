@@ -0,0 +1,124 @@
+"""
+Tests for one-time image normalization: orientation, working resolution, reuse and temp-file handling
+Runs offline; no server or API key required
+"""
+
+import os
+import time
+import tempfile
+import threading
+
+from PIL import Image
+
+import image_normalize
+from image_normalize import ImageTooLarge, ensure_normalized, normalize_image, normalized_path_for, open_normalized
+
+
+def _save(path, size, color=(200, 30, 30), mode="RGB", **params):
+    Image.new(mode, size, color).save(path, **params)
+    return path
+
+
+def test_exif_orientation_is_applied():
+    with tempfile.TemporaryDirectory() as tmp:
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Stored sideways: rotate 90 degrees clockwise to display
+        path = _save(os.path.join(tmp, "phone.jpg"), (80, 40), exif=exif)
+
+        output = normalize_image(path)
+        assert output == os.path.join(tmp, "phone.norm.jpg")
+        with Image.open(output) as img:
+            assert img.size == (40, 80) and img.mode == "RGB"
+            assert 0x0112 not in img.getexif()
+
+
+def test_output_is_bounded_to_the_working_resolution():
+    with tempfile.TemporaryDirectory() as tmp:
+        bound = image_normalize.WORKING_MAX_DIMENSION
+        with Image.open(normalize_image(_save(os.path.join(tmp, "wide.jpg"), (bound * 3, bound)))) as img:
+            assert img.size == (bound, bound // 3)
+        # Small images are not scaled up; transparency is flattened onto white
+        small = _save(os.path.join(tmp, "small.png"), (30, 20), (0, 0, 0, 0), mode="RGBA")
+        with Image.open(normalize_image(small)) as img:
+            assert img.size == (30, 20) and min(img.getpixel((5, 5))) > 245
+
+        saved = image_normalize.MAX_DECODE_PIXELS
+        image_normalize.MAX_DECODE_PIXELS = 100
+        try:
+            normalize_image(small)
+        except ImageTooLarge:
+            pass
+        else:
+            raise AssertionError("an image over the decode limit was normalized")
+        finally:
+            image_normalize.MAX_DECODE_PIXELS = saved
+
+
+def test_normalized_copies_are_reused_until_stale():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = _save(os.path.join(tmp, "model.png"), (64, 64))
+        output = ensure_normalized(path)
+        assert output == normalized_path_for(path) == normalized_path_for(output)
+        # Normalizing a normalized copy is a no-op
+        assert normalize_image(output) == output
+
+        written = os.stat(output).st_mtime_ns
+        assert ensure_normalized(path) == output and os.stat(output).st_mtime_ns == written
+        with open_normalized(path) as img:
+            assert img.size == (64, 64)
+
+        # A source changed after its copy was made is normalized again
+        _save(path, (32, 32))
+        later = time.time() + 5
+        os.utime(path, (later, later))
+        with Image.open(ensure_normalized(path)) as img:
+            assert img.size == (32, 32)
+
+
+def test_concurrent_and_failed_writes_leave_no_temp_files():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = _save(os.path.join(tmp, "cloth.jpg"), (900, 1200))
+        errors = []
+
+        def normalize():
+            try:
+                normalize_image(path)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=normalize) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert sorted(os.listdir(tmp)) == ["cloth.jpg", "cloth.norm.jpg"]
+        with Image.open(os.path.join(tmp, "cloth.norm.jpg")) as img:
+            img.load()
+
+        # A write that fails part-way removes its temp file
+        os.remove(os.path.join(tmp, "cloth.norm.jpg"))
+        save = Image.Image.save
+
+        def failing_save(img, fp, *args, **kwargs):
+            save(img, fp, *args, **kwargs)
+            raise OSError("disk full")
+
+        Image.Image.save = failing_save
+        try:
+            normalize_image(path)
+        except OSError:
+            pass
+        else:
+            raise AssertionError("the failed write was not reported")
+        finally:
+            Image.Image.save = save
+        assert os.listdir(tmp) == ["cloth.jpg"]
+
+
+if __name__ == "__main__":
+    test_exif_orientation_is_applied()
+    test_output_is_bounded_to_the_working_resolution()
+    test_normalized_copies_are_reused_until_stale()
+    test_concurrent_and_failed_writes_leave_no_temp_files()
+    print("✅ Image normalization tests passed")
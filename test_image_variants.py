@@ -0,0 +1,121 @@
+"""
+Tests for served-image variants (format negotiation and width snapping)
+Runs offline against temporary files; no server or API key required
+"""
+
+import io
+import os
+import tempfile
+
+from PIL import Image
+
+import image_variants
+from image_variants import negotiate_format, snap_width, variant_name, render_variant
+from blob_store import LocalBlobStore
+from result_cache import ResultCache
+from storage import StoragePolicy
+
+DIGEST = "ab" + "0" * 62
+
+
+def test_negotiate_format():
+    browser = "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
+    assert negotiate_format(browser, "a.png") == "webp"
+    assert negotiate_format(browser, "a.webp") is None
+    # PNG is kept unless JPEG is explicitly preferred (it would drop transparency)
+    assert negotiate_format("image/*", "a.png") is None
+    assert negotiate_format("image/jpeg, image/png;q=0.5", "a.png") == "jpeg"
+    assert negotiate_format("image/webp;q=0", "a.png") is None
+    assert negotiate_format(None, "a.png") is None
+    assert negotiate_format(browser, "notes.txt") is None
+
+
+def test_widths_snap_up_to_the_configured_set():
+    assert snap_width(None) is None and snap_width(0) is None
+    assert snap_width(300) == 320
+    assert snap_width(320) == 320
+    assert snap_width(10000) == image_variants.VARIANT_WIDTHS[-1]
+    assert variant_name(f"tryon_{DIGEST}.png", 320, "webp") == f"tryon_{DIGEST}.w320.webp"
+    assert variant_name("a.png", 640, None) == "a.w640.png"
+
+
+def test_render_variant_downscales_and_never_upscales():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "a.png")
+        Image.new("RGBA", (800, 400), (200, 30, 30, 128)).save(path)
+
+        content, changed = render_variant(path, 320, "webp")
+        assert changed
+        with Image.open(io.BytesIO(content)) as img:
+            assert img.format == "WEBP" and img.size == (320, 160)
+
+        content, changed = render_variant(path, None, "jpeg")
+        with Image.open(io.BytesIO(content)) as img:
+            assert img.format == "JPEG" and img.mode == "RGB" and img.size == (800, 400)
+
+        assert render_variant(path, 1280, None) == (b"", False)
+
+
+def test_result_cache_ignores_and_evicts_variants():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LocalBlobStore(tmp, shard_levels=1)
+        source = os.path.join(tmp, "source.png")
+        with open(source, "wb") as f:
+            f.write(b"x" * 10)
+        cache = ResultCache(directory="results", max_bytes=10, store=store)
+        cache.put(DIGEST, source)
+        store.put_bytes(f"results/tryon_{DIGEST}.w320.webp", b"variant")
+
+        # A restart indexes the entry but not its variant
+        cache = ResultCache(directory="results", max_bytes=10, store=store)
+        assert cache.stats()["entries"] == 1
+
+        with open(source, "wb") as f:
+            f.write(b"y" * 10)
+        cache.put("cd" + "0" * 62, source)
+        assert not store.exists(f"results/tryon_{DIGEST}.png")
+        assert not store.exists(f"results/tryon_{DIGEST}.w320.webp")
+
+
+def test_variants_go_when_their_entry_is_replaced_or_removed():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LocalBlobStore(tmp, shard_levels=1)
+        source = os.path.join(tmp, "source.png")
+        with open(source, "wb") as f:
+            f.write(b"x" * 10)
+        cache = ResultCache(directory="results", max_bytes=1000, store=store)
+        variant = f"results/tryon_{DIGEST}.w320.webp"
+
+        cache.put(DIGEST, source, move=False)
+        store.put_bytes(variant, b"old variant")
+        cache.put(DIGEST, source, move=False)
+        assert store.exists(f"results/tryon_{DIGEST}.png") and not store.exists(variant)
+
+        # The entry disappears (janitor, another worker); the next lookup drops its variants too
+        store.put_bytes(variant, b"old variant")
+        store.delete(f"results/tryon_{DIGEST}.png")
+        assert cache.get(DIGEST) is None and not store.exists(variant)
+
+
+def test_janitor_removes_derived_files_with_their_source():
+    with tempfile.TemporaryDirectory() as tmp:
+        names = [f"tryon_{DIGEST}.png", f"tryon_{DIGEST}.w320.webp", f"tryon_{DIGEST}.jpg", "other.png"]
+        for name in names:
+            with open(os.path.join(tmp, name), "wb") as f:
+                f.write(b"x")
+        policy = StoragePolicy("results", tmp, max_files=3)
+        policy._delete(os.path.join(tmp, f"tryon_{DIGEST}.w320.webp"), 1, "quota")
+        # Removing a variant leaves its source alone
+        assert sorted(os.listdir(tmp)) == sorted([names[0], names[2], names[3]])
+        policy._delete(os.path.join(tmp, names[0]), 1, "quota")
+        assert os.listdir(tmp) == ["other.png"]
+
+
+if __name__ == "__main__":
+    test_negotiate_format()
+    test_widths_snap_up_to_the_configured_set()
+    test_render_variant_downscales_and_never_upscales()
+    test_result_cache_ignores_and_evicts_variants()
+    test_variants_go_when_their_entry_is_replaced_or_removed()
+    test_janitor_removes_derived_files_with_their_source()
+    print("✅ Image variant tests passed")
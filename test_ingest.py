@@ -0,0 +1,139 @@
+"""
+Tests for upload ingestion: the streaming size cap, content-hash deduplication and image type checks
+Runs offline against a temporary blob store; no server or API key required
+"""
+
+import io
+import os
+import asyncio
+import hashlib
+import tempfile
+from functools import partial
+
+from fastapi.testclient import TestClient
+from PIL import Image
+from starlette.datastructures import UploadFile
+
+import api
+import ingest
+from blob_store import LocalBlobStore
+from ingest import ingest_upload, UploadTooLarge, UnsupportedImage
+
+
+def _png(color=(200, 30, 30)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class _Upload(UploadFile):
+    """UploadFile that counts its reads, to show an oversized upload is not read to the end."""
+
+    def __init__(self, data: bytes, filename: str):
+        super().__init__(io.BytesIO(data), filename=filename)
+        self.reads = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        self.reads += 1
+        return await super().read(size)
+
+
+def _in_temp_store(test):
+    """Run test(tmp) with ingest writing to a temporary upload directory and blob store."""
+    saved = ingest.store, ingest.UPLOAD_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        ingest.store = LocalBlobStore(tmp, shard_levels=1)
+        ingest.UPLOAD_DIR = os.path.join(tmp, "incoming")
+        try:
+            test(tmp)
+        finally:
+            ingest.store, ingest.UPLOAD_DIR = saved
+
+
+def _stored_files(tmp):
+    return sorted(os.path.relpath(os.path.join(root, name), tmp)
+                  for root, _, names in os.walk(tmp) for name in names)
+
+
+def test_uploads_over_the_cap_stop_streaming():
+    def test(tmp):
+        saved_chunk = ingest.CHUNK_SIZE
+        ingest.CHUNK_SIZE = 1024
+        try:
+            upload = _Upload(b"\x89PNG\r\n\x1a\n" + b"0" * 20 * 1024, "big.png")
+            try:
+                asyncio.run(ingest_upload(upload, "models", max_bytes=4 * 1024))
+            except UploadTooLarge as e:
+                assert "4096 byte limit" in str(e)
+            else:
+                raise AssertionError("an oversized upload was accepted")
+            # Gave up after the chunk that crossed the limit, and left nothing behind
+            assert upload.reads == 5
+            assert _stored_files(tmp) == []
+        finally:
+            ingest.CHUNK_SIZE = saved_chunk
+
+        # The upload endpoints answer 413
+        saved_ingest = api.ingest_upload
+        api.ingest_upload = partial(ingest_upload, max_bytes=1024)
+        try:
+            response = TestClient(api.app).post("/api/upload/model", files={"file": ("big.png", _png() + b"0" * 2048)})
+            assert response.status_code == 413
+        finally:
+            api.ingest_upload = saved_ingest
+
+    _in_temp_store(test)
+
+
+def test_identical_content_is_stored_once():
+    def test(tmp):
+        data = _png()
+        digest = hashlib.sha256(data).hexdigest()
+
+        first = asyncio.run(ingest_upload(_Upload(data, "front.png"), "clothes"))
+        # Same bytes under another name (and a misleading extension) land on the same blob
+        second = asyncio.run(ingest_upload(_Upload(data, "copy.jpg"), "clothes"))
+        other = asyncio.run(ingest_upload(_Upload(_png((10, 10, 200)), "other.png"), "clothes"))
+
+        assert first["key"] == second["key"] == f"uploads/clothes/{digest}.png"
+        assert (first["duplicate"], second["duplicate"], other["duplicate"]) == (False, True, False)
+        assert first["path"] == second["path"] and first["size"] == second["size"] == len(data)
+        assert other["key"] != first["key"]
+        # One original and one normalized copy per distinct content; temp files are gone
+        assert len([name for name in _stored_files(tmp) if name.endswith(".png")]) == 2
+        assert len([name for name in _stored_files(tmp) if name.endswith(".norm.jpg")]) == 2
+        assert os.path.exists(first["normalized_path"])
+        assert not [name for name in _stored_files(tmp) if ".incoming_" in name]
+
+        response = TestClient(api.app).post("/api/upload/cloth", files={"file": ("again.png", data)})
+        assert response.status_code == 200
+        assert response.json()["filename"] == first["key"] and response.json()["duplicate"] is True
+
+    _in_temp_store(test)
+
+
+def test_non_images_are_rejected():
+    def test(tmp):
+        for data, filename in ((b"name,size\nshirt,M\n", "sizes.csv"), (b"MZ\x90\x00", "setup.exe"), (b"%PDF-1.7", "")):
+            try:
+                asyncio.run(ingest_upload(_Upload(data, filename), "models"))
+            except UnsupportedImage:
+                continue
+            raise AssertionError(f"{filename!r} was accepted")
+        assert _stored_files(tmp) == []
+
+        # A recognised image extension is trusted when the content has no known signature
+        webp = asyncio.run(ingest_upload(_Upload(b"not really", "photo.webp"), "models"))
+        assert webp["key"].endswith(".webp") and webp["normalized_path"] is None
+
+        response = TestClient(api.app).post("/api/upload/model", files={"file": ("notes.txt", b"hello")})
+        assert response.status_code == 415
+
+    _in_temp_store(test)
+
+
+if __name__ == "__main__":
+    test_uploads_over_the_cap_stop_streaming()
+    test_identical_content_is_stored_once()
+    test_non_images_are_rejected()
+    print("✅ Ingest tests passed")
@@ -0,0 +1,181 @@
+"""
+Tests for the asynchronous job queue: submission, polling, cancellation, coalescing, deadlines and shared snapshots
+Runs offline; no server or API key required
+"""
+
+import os
+import time
+import asyncio
+import tempfile
+import threading
+
+import deadline
+import job_queue
+from deadline import Budget
+from job_queue import JobQueue, JobQueueFull, QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED
+from upstream_guard import UpstreamUnavailable
+
+
+def test_submit_poll_and_cancel():
+    async def scenario():
+        queue = JobQueue(workers=1, max_pending=2, state_dir="")
+        await queue.start()
+        try:
+            release = threading.Event()
+
+            def blocked():
+                release.wait(5)
+                return {"result": "first.png"}
+
+            first = queue.submit("tryon", blocked)
+            await asyncio.sleep(0.05)
+            assert first.status == RUNNING and queue.get(first.id) is first
+
+            # Work behind a busy worker stays queued and can be polled, then cancelled before it starts
+            calls = []
+            second = queue.submit("tryon", lambda: calls.append(1))
+            third = queue.submit("tryon", lambda: calls.append(1))
+            assert queue.get(second.id).to_dict()["status"] == QUEUED
+            try:
+                queue.submit("tryon", lambda: None)
+            except JobQueueFull:
+                pass
+            else:
+                raise AssertionError("a full queue accepted another job")
+            queue.cancel(second, "test")
+            assert second.status == CANCELLED and second.error == "Cancelled: test"
+
+            release.set()
+            await queue.wait(first, timeout=1)
+            await queue.wait(third, timeout=1)
+            assert first.to_dict()["result"] == {"result": "first.png"}
+            assert third.status == SUCCEEDED and calls == [1]
+
+            # Failures keep the message, and an unavailable upstream maps to 503 with its retry hint
+            def unavailable():
+                raise UpstreamUnavailable("circuit open", retry_after=7)
+
+            failed = await queue.wait(queue.submit("tryon", unavailable), timeout=1)
+            assert failed.status == FAILED and failed.error == "circuit open"
+            assert failed.error_status == 503 and failed.retry_after == 7
+
+            stats = queue.stats()
+            assert (stats["completed"], stats["failed"], stats["cancelled"]) == (2, 1, 1)
+            assert queue.get("0" * 32) is None
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_followers_share_one_job_and_its_latest_deadline():
+    async def scenario():
+        queue = JobQueue(workers=1, max_pending=10, state_dir="")
+        await queue.start()
+        try:
+            calls = []
+
+            def work():
+                calls.append(1)
+                deadline.sleep(0.3)
+                return {"result": "out.png"}
+
+            job = queue.submit("tryon", work, key="a", budget=Budget(0.2))
+            # A later requester with more time joins the same job and moves its deadline out
+            joined = queue.submit("tryon", work, key="a", budget=Budget(5), detached=True)
+            assert joined is job and job.detached
+            assert job.budget.remaining() > 1
+
+            waiters = [asyncio.ensure_future(queue.wait(job)) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            assert job.followers == 3
+
+            # Detached work keeps going after every waiter has left
+            for waiter in waiters[:2]:
+                waiter.cancel()
+            await asyncio.sleep(0.01)
+            assert job.followers == 1 and not job.budget.cancelled
+            await waiters[2]
+            assert job.status == SUCCEEDED and calls == [1] and job.followers == 0
+            assert queue.stats()["coalesced"] == 1
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_jobs_fail_with_504_once_their_budget_expires():
+    async def scenario():
+        queue = JobQueue(workers=1, max_pending=10, state_dir="")
+        await queue.start()
+        try:
+            started = time.monotonic()
+
+            def slow():
+                deadline.sleep(0.05)
+                deadline.sleep(5)
+                return {"result": "late.png"}
+
+            job = await queue.wait(queue.submit("tryon", slow, budget=Budget(0.2)), timeout=2)
+            assert job.status == FAILED and job.error_status == 504
+            assert job.result is None and time.monotonic() - started < 1
+
+            # A budget already spent while queued stops the job at its first check
+            spent = Budget(0.01)
+            await asyncio.sleep(0.02)
+            job = await queue.wait(queue.submit("tryon", lambda: deadline.check(), budget=spent), timeout=1)
+            assert job.status == FAILED and job.error_status == 504
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_other_processes_read_persisted_snapshots():
+    async def scenario():
+        with tempfile.TemporaryDirectory() as state_dir:
+            owner = JobQueue(workers=1, max_pending=10, retention_seconds=0, state_dir=state_dir)
+            reader = JobQueue(workers=1, max_pending=10, state_dir=state_dir)
+            await owner.start()
+            try:
+                writes = []
+                write_snapshots = owner._write_snapshots
+
+                def counting(snapshots):
+                    writes.append(len(snapshots))
+                    write_snapshots(snapshots)
+
+                owner._write_snapshots = counting
+                job = owner.submit("tryon", lambda: {"result": "out.png"})
+                await owner.wait(job, timeout=1)
+                await asyncio.sleep(job_queue.JOB_STATE_FLUSH_SECONDS * 3)
+                # Queued, running and succeeded landed within one flush window: a single write
+                assert writes == [1]
+
+                restored = reader.get(job.id)
+                assert restored is not None and not restored.local
+                assert restored.status == SUCCEEDED and restored.result == {"result": "out.png"}
+                assert [event["stage"] for event in restored.stages] == [event["stage"] for event in job.stages]
+                snapshots = [snapshot async for snapshot in reader.stream(restored)]
+                assert len(snapshots) == 1 and snapshots[0]["status"] == SUCCEEDED
+
+                # Snapshots of jobs past retention go with them
+                await owner._prune()
+                assert owner.get(job.id) is None and reader.get(job.id) is None
+                assert os.listdir(state_dir) == []
+
+                # Stopping writes whatever has not been flushed yet
+                pending = owner.submit("tryon", lambda: None)
+            finally:
+                await owner.stop()
+            assert reader.get(pending.id).status in (QUEUED, RUNNING, SUCCEEDED)
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_submit_poll_and_cancel()
+    test_followers_share_one_job_and_its_latest_deadline()
+    test_jobs_fail_with_504_once_their_budget_expires()
+    test_other_processes_read_persisted_snapshots()
+    print("✅ Job queue tests passed")
@@ -0,0 +1,64 @@
+"""
+Tests for the load-test harness: the Segmind stand-in and the load generator's reporting
+Runs offline; no server or API key required
+"""
+
+import io
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from mock_segmind import MockConfig, create_app
+from load_test import Results, parse_mix, percentile
+
+
+def test_stand_in_serves_images_and_injects_failures():
+    client = TestClient(create_app(MockConfig(latency="fixed", latency_median=0, image_size=64, seed=1)))
+    headers = {"x-api-key": "test"}
+    body = {"model_image": "bW9kZWw=", "cloth_image": "Y2xvdGg=", "category": "Upper body"}
+
+    response = client.post("/v1/try-on-diffusion", json=body, headers=headers)
+    assert response.status_code == 200 and response.headers["content-type"] == "image/png"
+    assert Image.open(io.BytesIO(response.content)).size == (64, 64)
+    assert client.post("/v1/sdxl1.0-txt2img", json={"prompt": "x", "base64": True}, headers=headers).json()["image"]
+    assert client.post("/v1/try-on-diffusion", json={"model_image": "x"}, headers=headers).status_code == 400
+    assert client.post("/v1/try-on-diffusion", json=body).status_code == 401
+
+    limited = TestClient(create_app(MockConfig(latency="fixed", latency_median=0, rate_429=1.0, retry_after=3)))
+    response = limited.post("/v1/try-on-diffusion", json=body, headers=headers)
+    assert response.status_code == 429 and response.headers["retry-after"] == "3"
+    assert limited.get("/stats").json()["calls"] == {"try-on-diffusion 429": 1}
+
+    failing = TestClient(create_app(MockConfig(latency="fixed", latency_median=0, rate_5xx=1.0)))
+    assert failing.post("/v1/sdxl1.0-txt2img", json={"prompt": "x"}, headers=headers).status_code >= 500
+
+
+def test_latency_distributions_center_on_the_median():
+    assert MockConfig(latency="fixed", latency_median=2.0).sample_latency() == 2.0
+    uniform = MockConfig(latency="uniform", latency_median=2.0, latency_spread=0.5, seed=1)
+    assert all(1.5 <= uniform.sample_latency() <= 2.5 for _ in range(100))
+    lognormal = MockConfig(latency_median=2.0, latency_spread=0.4, seed=1)
+    samples = [lognormal.sample_latency() for _ in range(2001)]
+    assert 1.8 < percentile(samples, 50) < 2.2
+
+
+def test_summary_reports_percentiles_and_error_rates():
+    assert percentile([], 99) == 0.0
+    assert percentile(list(range(1, 101)), 50) == 50 and percentile(list(range(1, 101)), 99) == 99
+    assert parse_mix("tryon=3, upload") == {"tryon": 3.0, "upload": 1.0}
+
+    results = Results()
+    for latency in range(1, 11):
+        results.record("tryon", float(latency), "429" if latency > 8 else None)
+    results.record("upload", 0.5)
+    summary = results.summary(elapsed=2.0)
+    assert summary["tryon"]["error_rate"] == 0.2 and summary["tryon"]["error_kinds"] == {"429": 2}
+    assert summary["tryon"]["p50"] == 5.0 and summary["tryon"]["p99"] == 10.0
+    assert summary["total"]["requests"] == 11 and summary["total"]["throughput"] == 4.5
+
+
+if __name__ == "__main__":
+    test_stand_in_serves_images_and_injects_failures()
+    test_latency_distributions_center_on_the_median()
+    test_summary_reports_percentiles_and_error_rates()
+    print("✅ Load-test harness tests passed")
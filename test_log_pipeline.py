@@ -0,0 +1,107 @@
+"""
+Tests for the queued logging pipeline (sampling, JSON output, drop-on-full)
+Runs offline against a temporary log directory
+"""
+
+import io
+import os
+import json
+import logging
+import tempfile
+
+import tracing
+from log_pipeline import LogPipeline, SamplingFilter
+
+
+def _record(name, level, msg="hello %s", args=("world",)):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_sampling_applies_per_logger_prefix_to_info_only():
+    sampler = SamplingFilter({"hot": 0.0, "hot.keep": 1.0})
+    assert not sampler.filter(_record("hot", logging.INFO))
+    assert not sampler.filter(_record("hot.child", logging.DEBUG))
+    assert sampler.filter(_record("hot.keep.child", logging.INFO))
+    assert sampler.filter(_record("hot", logging.WARNING))
+    assert sampler.filter(_record("cold", logging.INFO))
+
+
+def test_pipeline_writes_json_lines_with_request_ids_and_tracebacks():
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    with tempfile.TemporaryDirectory() as tmp:
+        console = io.StringIO()
+        pipeline = LogPipeline(level="INFO", log_dir=tmp, log_file="server.log", json_output=True,
+                               sample_rates="test_log_pipeline.hot=0", stream=console)
+        pipeline.start()
+        try:
+            logger = logging.getLogger("test_log_pipeline")
+            with tracing.request_span("GET /", "req-42"):
+                logger.info("processed %d items", 3)
+            logging.getLogger("test_log_pipeline.hot").info("sampled out")
+            try:
+                raise ValueError("boom")
+            except ValueError:
+                logger.error("failed", exc_info=True)
+        finally:
+            pipeline.stop()
+            for handler in saved_handlers:
+                root.addHandler(handler)
+            root.setLevel(saved_level)
+
+        with open(os.path.join(tmp, "server.log")) as f:
+            entries = [json.loads(line) for line in f]
+        assert console.getvalue().count("\n") == len(entries) == 2
+        assert entries[0]["message"] == "processed 3 items" and entries[0]["request_id"] == "req-42"
+        assert entries[1]["level"] == "ERROR" and "ValueError: boom" in entries[1]["exception"]
+
+
+def test_full_queue_drops_instead_of_blocking():
+    with tempfile.TemporaryDirectory() as tmp:
+        pipeline = LogPipeline(log_dir=tmp, log_file="", queue_size=1, stream=io.StringIO())
+        # Listener not started: nothing drains the queue
+        pipeline.handler.handle(_record("x", logging.INFO))
+        pipeline.handler.handle(_record("x", logging.ERROR))
+        assert pipeline.queue.qsize() == 1
+        assert pipeline.queue.get_nowait().getMessage() == "hello world"
+
+
+def test_forked_child_restarts_the_listener_on_its_own_file():
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    with tempfile.TemporaryDirectory() as tmp:
+        pipeline = LogPipeline(level="INFO", log_dir=tmp, log_file="server.log", stream=io.StringIO())
+        pipeline.start()
+        try:
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    logging.getLogger("test_log_pipeline").info("from the child")
+                    pipeline.stop()
+                    code = 0
+                finally:
+                    os._exit(code)
+            _, status = os.waitpid(pid, 0)
+            logging.getLogger("test_log_pipeline").info("from the parent")
+        finally:
+            pipeline.stop()
+            for handler in saved_handlers:
+                root.addHandler(handler)
+            root.setLevel(saved_level)
+
+        assert os.waitstatus_to_exitcode(status) == 0
+        with open(os.path.join(tmp, f"server.{pid}.log")) as f:
+            assert "from the child" in f.read()
+        with open(os.path.join(tmp, "server.log")) as f:
+            parent_log = f.read()
+        assert "from the parent" in parent_log and "from the child" not in parent_log
+
+
+if __name__ == "__main__":
+    test_sampling_applies_per_logger_prefix_to_info_only()
+    test_pipeline_writes_json_lines_with_request_ids_and_tracebacks()
+    test_full_queue_drops_instead_of_blocking()
+    if hasattr(os, "fork"):
+        test_forked_child_restarts_the_listener_on_its_own_file()
+    print("✅ Log pipeline tests passed")
@@ -0,0 +1,55 @@
+"""
+Tests for the Prometheus metrics registry
+Runs offline; no server or API key required
+"""
+
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_labelled_counter_and_gauge_render():
+    registry = Registry()
+    uploads = Counter("upload_bytes_read_total", "Bytes received", ("kind",), registry=registry)
+    depth = Gauge("job_queue_depth", "Queued jobs", registry=registry)
+
+    uploads.labels("models").inc(100)
+    uploads.labels(kind="models").inc(50)
+    uploads.labels("clothes").inc(7)
+    depth.set(3)
+
+    text = registry.render()
+    assert "# TYPE upload_bytes_read_total counter" in text
+    assert 'upload_bytes_read_total{kind="models"} 150' in text
+    assert 'upload_bytes_read_total{kind="clothes"} 7' in text
+    assert "job_queue_depth 3" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = Histogram("request_seconds", "Latency", ("route",), registry=registry, buckets=(0.1, 1.0))
+
+    for value in (0.05, 0.5, 0.5, 5.0):
+        latency.labels("/api/tryon").observe(value)
+
+    text = registry.render()
+    assert 'request_seconds_bucket{route="/api/tryon",le="0.1"} 1' in text
+    assert 'request_seconds_bucket{route="/api/tryon",le="1"} 3' in text
+    assert 'request_seconds_bucket{route="/api/tryon",le="+Inf"} 4' in text
+    assert 'request_seconds_count{route="/api/tryon"} 4' in text
+    assert 'request_seconds_sum{route="/api/tryon"} 6.05' in text
+
+
+def test_collectors_are_read_at_scrape_time():
+    registry = Registry()
+    state = {"running": 1}
+    registry.register_collector(lambda: [("job_queue_running", "gauge", "Running jobs", [({}, state["running"])])])
+
+    assert "job_queue_running 1" in registry.render()
+    state["running"] = 2
+    assert "job_queue_running 2" in registry.render()
+
+
+if __name__ == "__main__":
+    test_labelled_counter_and_gauge_render()
+    test_histogram_buckets_are_cumulative()
+    test_collectors_are_read_at_scrape_time()
+    print("✅ Metrics tests passed")
@@ -0,0 +1,103 @@
+"""
+Tests for stage-by-stage progress reporting
+Runs offline; jobs and coalesced computations report stages without any upstream call
+"""
+
+import asyncio
+import threading
+import contextvars
+from functools import partial
+
+import progress
+from job_queue import JobQueue
+from singleflight import SingleFlight
+
+
+def _stages(events):
+    return [event["stage"] for event in events]
+
+
+def test_progress_collects_stages_from_threads_until_finished():
+    async def scenario():
+        tracker = progress.Progress()
+
+        def work():
+            progress.report(progress.ENCODING)
+            progress.report(progress.UPSTREAM_SUBMITTED, attempt=1)
+
+        with progress.reporting_to(tracker):
+            await asyncio.get_running_loop().run_in_executor(None, partial(contextvars.copy_context().run, work))
+        progress.report(progress.SAVED)  # outside the context: ignored
+        asyncio.get_running_loop().call_soon(tracker.finish)
+
+        events = [event async for event in tracker.follow()]
+        assert _stages(events) == [progress.QUEUED, progress.ENCODING, progress.UPSTREAM_SUBMITTED]
+        assert events[2]["attempt"] == 1
+        assert events[0]["at"] <= events[2]["at"]
+
+    asyncio.run(scenario())
+
+
+def test_broadcast_replays_stages_to_late_joiners():
+    first, second = [], []
+    broadcast = progress.Broadcast(lambda stage, detail: first.append(stage))
+    broadcast(progress.ENCODING, {})
+    broadcast.add(lambda stage, detail: second.append(stage))
+    broadcast(progress.SAVED, {})
+    assert first == second == [progress.ENCODING, progress.SAVED]
+
+
+def test_job_records_stages_reported_by_its_worker():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        await queue.start()
+        try:
+            def run():
+                progress.report(progress.UPSTREAM_SUBMITTED)
+                progress.report(progress.UPSTREAM_COMPLETE)
+                return {"worker": threading.current_thread().name}
+
+            job = queue.submit("test", run)
+            snapshots = [snapshot async for snapshot in queue.stream(job)]
+            assert _stages(snapshots[-1]["stages"]) == [progress.QUEUED, progress.UPSTREAM_SUBMITTED,
+                                                        progress.UPSTREAM_COMPLETE]
+            assert snapshots[-1]["status"] == "succeeded"
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_coalesced_callers_all_receive_stages():
+    async def scenario():
+        flight = SingleFlight("test_progress", enabled=True)
+        release = asyncio.Event()
+        received = {"leader": [], "joiner": []}
+
+        async def generate():
+            progress.report(progress.UPSTREAM_SUBMITTED)
+            await release.wait()
+            progress.report(progress.SAVED)
+            return "done"
+
+        async def call(name):
+            with progress.reporting_to(lambda stage, detail: received[name].append(stage)):
+                return await flight.do("key", generate)
+
+        leader = asyncio.create_task(call("leader"))
+        await asyncio.sleep(0)
+        joiner = asyncio.create_task(call("joiner"))
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(leader, joiner) == ["done", "done"]
+        assert received["leader"] == received["joiner"] == [progress.UPSTREAM_SUBMITTED, progress.SAVED]
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_progress_collects_stages_from_threads_until_finished()
+    test_broadcast_replays_stages_to_late_joiners()
+    test_job_records_stages_reported_by_its_worker()
+    test_coalesced_callers_all_receive_stages()
+    print("✅ Progress tests passed")
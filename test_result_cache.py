@@ -0,0 +1,87 @@
+"""
+Tests for the content-addressed try-on result cache
+Runs offline against temporary directories; no server or API key required
+"""
+
+import os
+import shutil
+import tempfile
+
+from blob_store import MemoryBlobStore
+from result_cache import ResultCache, make_tryon_key, make_prompt_key
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_tryon_key_depends_on_content_category_and_params():
+    with tempfile.TemporaryDirectory() as tmp:
+        model = _write(os.path.join(tmp, "model.png"), b"model-bytes")
+        cloth = _write(os.path.join(tmp, "cloth.png"), b"cloth-bytes")
+        renamed = _write(os.path.join(tmp, "other_name.png"), b"model-bytes")
+
+        key = make_tryon_key(model, cloth, "Upper body", {"seed": 1})
+        assert key == make_tryon_key(renamed, cloth, "Upper body", {"seed": 1})
+        assert key != make_tryon_key(model, cloth, "Lower body", {"seed": 1})
+        assert key != make_tryon_key(model, cloth, "Upper body", {"seed": 2})
+
+
+def test_prompt_key_normalizes_text_and_depends_on_style_size_and_seed():
+    key = make_prompt_key("Red  Summer dress", "blurry", "base", 1024, 1024)
+    assert key == make_prompt_key(" red summer DRESS ", "Blurry", "Base", 1024, 1024)
+    assert key != make_prompt_key("red summer dress", "blurry", "base", 1024, 1024, seed=7)
+    assert key != make_prompt_key("red summer dress", "blurry", "anime", 1024, 1024)
+    assert key != make_prompt_key("red summer dress", "blurry", "base", 512, 512)
+    assert key != make_prompt_key("red summer dress", "", "base", 1024, 1024)
+
+
+def test_hit_miss_and_lru_eviction():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResultCache(directory=tmp, max_bytes=25)
+
+        assert cache.get("a") is None
+        path_a = cache.put("a", _write(os.path.join(tmp, "ra.png"), b"x" * 10))
+        path_b = cache.put("b", _write(os.path.join(tmp, "rb.png"), b"x" * 10))
+        assert cache.get("a") == path_a == os.path.join(tmp, "tryon_a.png")
+
+        # "b" is now least recently used and is evicted to make room for "c"
+        cache.put("c", _write(os.path.join(tmp, "rc.png"), b"x" * 10))
+        assert cache.get("b") is None
+        assert os.path.exists(path_a)
+        assert not os.path.exists(path_b)
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
+        assert stats["evictions"] == 1
+        assert stats["bytes"] <= 25
+
+        # A fresh instance picks the entries back up from disk
+        assert set(ResultCache(directory=tmp, max_bytes=25)._entries) == {"a", "c"}
+
+
+def test_cache_in_a_blob_store_namespace():
+    store = MemoryBlobStore()
+    cache = ResultCache(directory="results", max_bytes=100, store=store)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = cache.put("k", _write(os.path.join(tmp, "r.png"), b"result"))
+        assert store.stat("results/tryon_k.png")[0] == 6
+        assert not os.path.exists(os.path.join(tmp, "r.png"))
+
+    # Another process sharing the store finds the entry
+    other = ResultCache(directory="results", max_bytes=100, store=store)
+    with open(other.get("k"), "rb") as f:
+        assert f.read() == b"result"
+    assert other.stats()["hits"] == 1
+    shutil.rmtree(store.cache.root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_tryon_key_depends_on_content_category_and_params()
+    test_prompt_key_normalizes_text_and_depends_on_style_size_and_seed()
+    test_hit_miss_and_lru_eviction()
+    test_cache_in_a_blob_store_namespace()
+    print("✅ Result cache tests passed")
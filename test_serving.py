@@ -0,0 +1,76 @@
+"""
+Tests for serving stored uploads and results over HTTP
+Runs offline against a temporary blob store; no server or API key required
+"""
+
+import io
+import os
+import time
+import tempfile
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import api
+import blob_store
+from blob_store import LocalBlobStore
+
+
+def _with_store(tmp):
+    saved = blob_store.store
+    blob_store.store = LocalBlobStore(tmp, shard_levels=1)
+    return saved
+
+
+def test_uploads_cannot_escape_their_folder():
+    with tempfile.TemporaryDirectory() as tmp:
+        saved = _with_store(tmp)
+        try:
+            with open(os.path.join(tmp, ".env"), "w") as f:
+                f.write("SEGMIND_API_KEY=secret\n")
+            blob_store.store.put_bytes("uploads/models/a.png", b"model bytes")
+            client = TestClient(api.app)
+
+            assert client.get("/uploads/models/a.png").content == b"model bytes"
+            for url in ("/uploads/%2E%2E/.env", "/uploads/%2e%2e/.env", "/uploads/./.env", "/uploads/..%2F..%2Fetc/passwd"):
+                response = client.get(url)
+                assert response.status_code == 404 and b"secret" not in response.content, url
+        finally:
+            blob_store.store = saved
+
+
+def _png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 320), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_variants_are_rendered_again_when_the_result_is_regenerated():
+    with tempfile.TemporaryDirectory() as tmp:
+        saved = _with_store(tmp)
+        try:
+            client = TestClient(api.app)
+            name = "tryon_" + "ab" * 32 + ".png"
+            source = blob_store.store.put_bytes(f"results/{name}", _png((255, 0, 0)))
+
+            def served_color():
+                response = client.get(f"/api/result/{name}?w=320", headers={"Accept": "image/webp"})
+                assert response.status_code == 200 and response.headers["content-type"] == "image/webp"
+                with Image.open(io.BytesIO(response.content)) as img:
+                    assert img.size == (320, 160)
+                    return img.convert("RGB").getpixel((0, 0))
+
+            assert served_color()[0] > 200
+            # Regenerated under the same name after eviction; the stored variant is now older than its source
+            blob_store.store.put_bytes(f"results/{name}", _png((0, 0, 255)))
+            later = time.time() + 5
+            os.utime(source, (later, later))
+            assert served_color()[2] > 200
+        finally:
+            blob_store.store = saved
+
+
+if __name__ == "__main__":
+    test_uploads_cannot_escape_their_folder()
+    test_variants_are_rendered_again_when_the_result_is_regenerated()
+    print("✅ Serving tests passed")
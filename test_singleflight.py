@@ -0,0 +1,97 @@
+"""
+Tests for request coalescing of identical in-flight work
+Runs offline; no server or API key required
+"""
+
+import time
+import asyncio
+
+from singleflight import SingleFlight
+from job_queue import JobQueue, SUCCEEDED
+
+
+def test_concurrent_identical_calls_share_one_computation():
+    async def scenario():
+        flight = SingleFlight("test", enabled=True)
+        calls = []
+
+        async def compute(value):
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            return {"value": value}
+
+        results = await asyncio.gather(*(flight.do("red shirt", lambda: compute("red")) for _ in range(5)),
+                                       flight.do("blue shirt", lambda: compute("blue")))
+        assert calls == ["red", "blue"]
+        assert results[:5] == [{"value": "red"}] * 5
+        assert results[5] == {"value": "blue"}
+        assert flight.stats() == {"enabled": True, "in_flight": 0, "leaders": 2, "shared": 4}
+
+        # Once finished, the same key starts a fresh computation
+        await flight.do("red shirt", lambda: compute("red"))
+        assert calls == ["red", "blue", "red"]
+
+    asyncio.run(scenario())
+
+
+def test_errors_are_shared_and_cancelling_one_caller_keeps_the_work_running():
+    async def scenario():
+        flight = SingleFlight("test", enabled=True)
+
+        async def fail():
+            await asyncio.sleep(0.02)
+            raise ValueError("upstream down")
+
+        outcomes = await asyncio.gather(flight.do("k", fail), flight.do("k", fail), return_exceptions=True)
+        assert [str(outcome) for outcome in outcomes] == ["upstream down", "upstream down"]
+
+        async def slow():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        first = asyncio.ensure_future(flight.do("s", slow))
+        second = asyncio.ensure_future(flight.do("s", slow))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "done"
+
+    asyncio.run(scenario())
+
+
+def test_job_queue_coalesces_submissions_with_the_same_key():
+    async def scenario():
+        queue = JobQueue(workers=2, max_pending=10, state_dir="")
+        await queue.start()
+        try:
+            calls = []
+
+            def work():
+                calls.append(1)
+                time.sleep(0.05)
+                return {"result": "out.png"}
+
+            first = queue.submit("tryon", work, key="abc")
+            second = queue.submit("tryon", work, key="abc")
+            other = queue.submit("tryon", work, key="def")
+            assert second is first and other is not first
+
+            await queue.wait(first)
+            await queue.wait(other)
+            assert first.status == SUCCEEDED and len(calls) == 2
+            assert queue.stats()["coalesced"] == 1
+
+            # A finished job is not reused
+            third = queue.submit("tryon", work, key="abc")
+            assert third is not first
+            await queue.wait(third)
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_concurrent_identical_calls_share_one_computation()
+    test_errors_are_shared_and_cancelling_one_caller_keeps_the_work_running()
+    test_job_queue_coalesces_submissions_with_the_same_key()
+    print("✅ Singleflight tests passed")
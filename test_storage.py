@@ -0,0 +1,95 @@
+"""
+Tests for the storage janitor's TTL and quota eviction
+Runs offline against temporary directories; no server or API key required
+"""
+
+import os
+import time
+import tempfile
+
+import storage
+from storage import StoragePolicy, Janitor, record_access
+
+
+def _write(directory, name, size, accessed):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (accessed, accessed))
+    return path
+
+
+def test_ttl_then_quota_evicts_least_recently_accessed_first():
+    with tempfile.TemporaryDirectory() as tmp:
+        now = time.time()
+        _write(tmp, "expired.png", 10, now - 10 * storage.DAY)
+        _write(tmp, "old.png", 10, now - 3 * 3600)
+        _write(tmp, "recent.png", 10, now - 2 * 3600)
+        _write(tmp, "fresh.png", 10, now - 60)
+        _write(tmp, "other.txt", 10, now - 10 * storage.DAY)
+
+        policy = StoragePolicy("test", tmp, pattern="*.png", ttl_seconds=storage.DAY, max_bytes=20)
+        evicted = policy.sweep(now)
+
+        assert evicted == {"ttl_files": 1, "ttl_bytes": 10, "quota_files": 1, "quota_bytes": 10}
+        assert sorted(os.listdir(tmp)) == ["fresh.png", "other.txt", "recent.png"]
+        assert policy.files == 2 and policy.bytes == 20
+
+
+def test_quota_spares_files_inside_the_grace_window():
+    with tempfile.TemporaryDirectory() as tmp:
+        now = time.time()
+        for i in range(3):
+            _write(tmp, f"{i}.png", 10, now - i)
+
+        policy = StoragePolicy("test", tmp, max_files=1)
+        assert policy.sweep(now)["quota_files"] == 0
+        assert len(os.listdir(tmp)) == 3
+
+
+def test_record_access_refreshes_atime_but_keeps_mtime():
+    with tempfile.TemporaryDirectory() as tmp:
+        old = time.time() - 10 * storage.DAY
+        path = _write(tmp, "a.png", 10, old)
+
+        record_access(path)
+        stat = os.stat(path)
+        assert stat.st_mtime == old
+        assert stat.st_atime > old + storage.DAY
+
+        assert StoragePolicy("test", tmp, ttl_seconds=storage.DAY).sweep()["ttl_files"] == 0
+
+
+def test_janitor_sweeps_selected_policies_once_at_a_time():
+    with tempfile.TemporaryDirectory() as tmp:
+        first, second = os.path.join(tmp, "first"), os.path.join(tmp, "second")
+        os.makedirs(first)
+        os.makedirs(second)
+        old = time.time() - 10 * storage.DAY
+        _write(first, "a.png", 10, old)
+        _write(second, "b.png", 10, old)
+
+        janitor = Janitor([StoragePolicy("first", first, ttl_seconds=storage.DAY),
+                           StoragePolicy("second", second, ttl_seconds=storage.DAY)],
+                          lock_path=os.path.join(tmp, "janitor.lock"))
+        assert janitor.sweep(["first"])["first"]["ttl_files"] == 1
+        assert os.listdir(first) == [] and os.listdir(second) == ["b.png"]
+        assert janitor.stats()["directories"]["first"]["evicted_files"] == 1
+
+
+
+def test_every_upload_folder_has_a_policy():
+    folders = {os.path.basename(policy.directory) for policy in storage.default_policies()
+               if os.path.basename(os.path.dirname(policy.directory)) == "uploads"}
+    # Written by the upload endpoints, text-to-tryon and analyze-outfit
+    assert folders == {"models", "clothes", "outfits"}
+    assert "outfits" in storage.janitor.policies
+
+
+if __name__ == "__main__":
+    test_ttl_then_quota_evicts_least_recently_accessed_first()
+    test_quota_spares_files_inside_the_grace_window()
+    test_record_access_refreshes_atime_but_keeps_mtime()
+    test_janitor_sweeps_selected_policies_once_at_a_time()
+    test_every_upload_folder_has_a_policy()
+    print("✅ Storage janitor tests passed")
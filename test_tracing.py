@@ -0,0 +1,129 @@
+"""
+Tests for request-scoped span tracing and the trace file exporter
+Runs offline against a temporary trace file; no server or API key required
+"""
+
+import os
+import json
+import time
+import asyncio
+import tempfile
+import threading
+
+import tracing
+from executors import Bulkhead
+
+
+def _traced_run(trace_format, scenario):
+    """Run scenario with tracing on, returning the exported file's contents."""
+    with tempfile.TemporaryDirectory() as tmp:
+        saved = tracing.exporter, tracing.TRACING_ENABLED
+        tracing.exporter = tracing.FileExporter(os.path.join(tmp, "trace.json"), trace_format)
+        tracing.TRACING_ENABLED = True
+        try:
+            scenario()
+            tracing.exporter.close()
+            with open(os.path.join(tmp, "trace.json")) as f:
+                return f.read()
+        finally:
+            tracing.exporter, tracing.TRACING_ENABLED = saved
+
+
+def test_spans_nest_across_pool_threads_in_chrome_format():
+    def scenario():
+        pool = Bulkhead("trace_test", workers=1, queue_limit=1)
+
+        @tracing.traced("work")
+        def work():
+            tracing.record_span("blob.put", 0.01)
+            return tracing.current_request_id()
+
+        async def handler():
+            with tracing.request_span("POST /api/tryon", "req-1"):
+                assert await pool.run(work) == "req-1"
+
+        asyncio.run(handler())
+        pool.shutdown()
+
+    text = _traced_run("chrome", scenario)
+    assert text.startswith("[\n")
+    events = {event["name"]: event for event in json.loads(text.rstrip().rstrip(",") + "]")}
+    assert set(events) == {"POST /api/tryon", "pool.trace_test", "work", "blob.put"}
+    root = events["POST /api/tryon"]
+    assert root["args"]["request.id"] == "req-1" and root["args"]["parent_id"] is None
+    assert events["pool.trace_test"]["args"]["parent_id"] == root["args"]["span_id"]
+    assert events["work"]["args"]["parent_id"] == events["pool.trace_test"]["args"]["span_id"]
+    assert events["blob.put"]["args"]["parent_id"] == events["work"]["args"]["span_id"]
+    assert events["work"]["tid"] != root["tid"]
+    assert len({event["args"]["trace_id"] for event in events.values()}) == 1
+
+
+def test_errors_are_recorded_in_otlp_format():
+    def scenario():
+        with tracing.request_span("GET /", "req-2"):
+            try:
+                with tracing.span("segmind.attempt", attempt=2):
+                    raise TimeoutError("upstream timed out")
+            except TimeoutError:
+                pass
+
+    lines = _traced_run("otlp", scenario).splitlines()
+    spans = [json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"][0] for line in lines]
+    attempt, root = spans
+    assert attempt["parentSpanId"] == root["spanId"] and attempt["traceId"] == root["traceId"]
+    assert attempt["status"] == {"code": 2, "message": "TimeoutError: upstream timed out"}
+    assert {"key": "attempt", "value": {"intValue": "2"}} in attempt["attributes"]
+    assert int(attempt["endTimeUnixNano"]) >= int(attempt["startTimeUnixNano"])
+
+
+def test_untraced_requests_still_get_ids_but_no_spans():
+    with tracing.request_span("GET /", tracing.request_id_from("bad id\r\n")) as root:
+        assert root is None
+        with tracing.span("anything") as child:
+            assert child is None
+        assert len(tracing.current_request_id()) == 32
+    assert tracing.current_request_id() is None
+    assert tracing.request_id_from("abc-123") == "abc-123"
+
+
+def test_spans_are_written_in_batches_off_the_callers_thread():
+    with tempfile.TemporaryDirectory() as tmp:
+        exporter = tracing.FileExporter(os.path.join(tmp, "trace.json"), "otlp", queue_size=3)
+        batches = []
+        release = threading.Event()
+        write = exporter._write
+
+        def blocked_write(spans):
+            batches.append((threading.current_thread().name, len(spans)))
+            release.wait(5)
+            write(spans)
+
+        exporter._write = blocked_write
+        spans = [tracing.Span(f"span.{n}", "t" * 32) for n in range(6)]
+        for span in spans:
+            span.end_ns = span.start_ns
+        # The first span occupies the writer; the queue holds three more and the rest are dropped, without blocking
+        exporter.export(spans[0])
+        while not batches:
+            time.sleep(0.01)
+        started = time.monotonic()
+        for span in spans[1:]:
+            exporter.export(span)
+        assert time.monotonic() - started < 0.5
+        assert exporter.dropped == 2
+
+        release.set()
+        exporter.close()
+        assert batches == [("trace-writer", 1), ("trace-writer", 3)]
+        assert exporter.exported == 4
+        with open(os.path.join(tmp, "trace.json")) as f:
+            names = [json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["name"] for line in f]
+        assert names == ["span.0", "span.1", "span.2", "span.3"]
+
+
+if __name__ == "__main__":
+    test_spans_nest_across_pool_threads_in_chrome_format()
+    test_errors_are_recorded_in_otlp_format()
+    test_untraced_requests_still_get_ids_but_no_spans()
+    test_spans_are_written_in_batches_off_the_callers_thread()
+    print("✅ Tracing tests passed")
@@ -0,0 +1,107 @@
+"""
+Tests for the adaptive upstream concurrency limiter and circuit breaker
+Runs offline; no server or API key required
+"""
+
+import time
+import asyncio
+
+from upstream_guard import (AdaptiveLimiter, CircuitBreaker, UpstreamGuard, UpstreamUnavailable,
+                            parse_retry_after, CLOSED, OPEN, HALF_OPEN)
+
+
+async def _unavailable(awaitable):
+    """Await it and return the UpstreamUnavailable it raised."""
+    try:
+        await awaitable
+    except UpstreamUnavailable as e:
+        return e
+    raise AssertionError("expected UpstreamUnavailable")
+
+
+def test_limit_grows_additively_and_halves_on_429_with_retry_after():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=2, max_limit=4, latency_tolerance=0)
+        for _ in range(20):
+            await limiter.acquire(timeout=1)
+            limiter.release("ok", latency=0.01)
+        assert limiter.limit == 4
+
+        await limiter.acquire(timeout=1)
+        limiter.release("throttled", retry_after=0.3)
+        assert limiter.limit == 2
+        started = time.monotonic()
+        await limiter.acquire(timeout=1)
+        assert time.monotonic() - started >= 0.25
+        limiter.release("ok", latency=0.01)
+
+        # A Retry-After longer than the caller will wait fails fast instead of holding a worker
+        await limiter.acquire(timeout=1)
+        limiter.release("throttled", retry_after=30)
+        assert (await _unavailable(limiter.acquire(timeout=1))).retry_after > 29
+
+    asyncio.run(scenario())
+
+
+def test_callers_queue_for_slots_and_slow_responses_cut_the_limit():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=1, max_limit=1, latency_tolerance=2.0)
+        await limiter.acquire(timeout=1)
+        waiter = asyncio.ensure_future(limiter.acquire(timeout=1))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        limiter.release("ok", latency=0.01)
+        await asyncio.wait_for(waiter, 1)
+        await _unavailable(limiter.acquire(timeout=0.05))
+        limiter.release("ok", latency=0.01)
+
+        limiter = AdaptiveLimiter(initial=10, max_limit=10, latency_tolerance=2.0)
+        for _ in range(5):
+            await limiter.acquire(timeout=1)
+            limiter.release("ok", latency=1.0, endpoint="/v1/try-on-diffusion")
+        await limiter.acquire(timeout=1)
+        limiter.release("ok", latency=5.0, endpoint="/v1/try-on-diffusion")
+        assert limiter.limit == 9
+
+    asyncio.run(scenario())
+
+
+def test_breaker_opens_fails_fast_and_closes_after_a_successful_probe():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    guard = UpstreamGuard("test", AdaptiveLimiter(initial=4, max_limit=4), breaker, queue_timeout=1)
+
+    async def call(result, retry_after=None):
+        await guard.acquire()
+        guard.release(result, latency=0.01, retry_after=retry_after)
+
+    asyncio.run(call(500))
+    asyncio.run(call("error"))
+    assert breaker.state == OPEN
+    asyncio.run(_unavailable(call(200)))
+    assert guard.rejected == 1
+
+    time.sleep(0.15)
+    asyncio.run(guard.acquire())
+    assert breaker.state == HALF_OPEN
+    asyncio.run(_unavailable(call(200)))  # only one probe at a time
+    guard.release(200, latency=0.01)
+    assert breaker.state == CLOSED and guard.limiter.in_flight == 0
+
+    # 429s mean the upstream is up: they throttle without tripping the breaker
+    for _ in range(3):
+        asyncio.run(call(429, retry_after="0"))
+    assert breaker.state == CLOSED and guard.throttled == 3
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after(None) is None and parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+if __name__ == "__main__":
+    test_limit_grows_additively_and_halves_on_429_with_retry_after()
+    test_callers_queue_for_slots_and_slow_responses_cut_the_limit()
+    test_breaker_opens_fails_fast_and_closes_after_a_successful_probe()
+    test_parse_retry_after()
+    print("✅ Upstream guard tests passed")
@@ -0,0 +1,56 @@
+"""
+Tests for deferred warm-up and readiness reporting
+Runs offline; no server or API key required
+"""
+
+import time
+
+import warmup
+from warmup import Readiness, READY, PENDING, DEGRADED
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_warm_up_waits_for_the_first_response_and_then_runs_in_order():
+    readiness = Readiness()
+    order = []
+    readiness.warm_up("first", lambda: order.append("first"))
+    readiness.warm_up("second", lambda: order.append("second"), exercise=lambda _: order.append("exercised"))
+    time.sleep(0.1)
+    assert order == [] and readiness.components["first"].status == PENDING and not readiness.is_ready()
+
+    readiness.begin()
+    _wait_for(readiness.is_ready)
+    assert order == ["first", "second", "exercised"]
+    assert readiness.components["second"].status == READY
+
+
+def test_a_component_that_keeps_failing_is_degraded_instead_of_blocking_readiness():
+    attempts = warmup.WARMUP_ATTEMPTS, warmup.WARMUP_RETRY_SECONDS
+    warmup.WARMUP_ATTEMPTS, warmup.WARMUP_RETRY_SECONDS = 2, 0.01
+    try:
+        readiness = Readiness()
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            raise OSError("model download failed")
+
+        readiness.warm_up("image_analyzer", flaky)
+        readiness.begin()
+        _wait_for(readiness.is_ready)
+        component = readiness.to_dict()["components"]["image_analyzer"]
+        assert component["status"] == DEGRADED and "download" in component["error"] and len(calls) == 2
+    finally:
+        warmup.WARMUP_ATTEMPTS, warmup.WARMUP_RETRY_SECONDS = attempts
+
+
+if __name__ == "__main__":
+    test_warm_up_waits_for_the_first_response_and_then_runs_in_order()
+    test_a_component_that_keeps_failing_is_degraded_instead_of_blocking_readiness()
+    print("✅ Warm-up tests passed")
@@ -0,0 +1,317 @@
+"""
+Request-scoped span tracing for the try-on API
+Spans propagate through context variables from the HTTP handler into job workers, pools and the Segmind client,
+and are queued for a background thread that writes them to a local trace file
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Tracing settings (see .env.example)
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "False").lower() in ("1", "true", "yes")
+# "chrome": Trace Event Format (open in Perfetto or chrome://tracing); "otlp": OTLP/JSON, one export request per line
+TRACE_FORMAT = os.environ.get("TRACE_FORMAT", "chrome").lower()
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces/trace.json")
+TRACE_SAMPLE_RATIO = float(os.environ.get("TRACE_SAMPLE_RATIO", "1.0"))
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", "10000"))
+# Spans written (and flushed) together by the trace writer
+TRACE_BATCH_SIZE = 256
+SERVICE_NAME = "virtual-tryon-api"
+
+TRACE_SPANS_DROPPED = Counter("trace_spans_dropped_total", "Finished spans discarded because the trace queue was full")
+
+# Client-supplied request ids are echoed back, so keep them short and header-safe
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+class Span:
+    """A timed operation within a trace."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error", "thread_id")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, start_ns: Optional[int] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes or {})
+        self.error: Optional[str] = None
+        self.thread_id = threading.get_ident()
+
+    def set(self, **attributes):
+        """Add attributes to the span."""
+        self.attributes.update(attributes)
+
+    def child(self, name: str, **attributes) -> "Span":
+        return Span(name, self.trace_id, self.span_id, attributes=attributes)
+
+    def end(self, end_ns: Optional[int] = None):
+        self.end_ns = end_ns or time.time_ns()
+        exporter.export(self)
+
+
+# Queued by close() to stop the writer once everything before it is written
+_STOP = None
+
+
+class FileExporter:
+    """
+    Appends finished spans to a trace file; safe to call from any thread
+
+    export() only enqueues the span; a writer thread (one per process, started on first use) formats
+    whatever has queued up, writes it in one go and flushes once per batch. A full queue drops the span
+    (counted in metrics) rather than blocking the caller.
+    """
+
+    def __init__(self, path: str = TRACE_FILE, format: str = TRACE_FORMAT, queue_size: int = TRACE_QUEUE_SIZE):
+        self.path = path
+        self.format = format
+        self.exported = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._writer: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._atexit = False
+        # Guards starting and stopping the writer
+        self._lock = threading.Lock()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        if self.format == "chrome" and self._file.tell() == 0:
+            # JSON array format; viewers accept the array left open, so events can be appended as they finish
+            self._file.write("[\n")
+
+    def export(self, span: Span):
+        if self._writer is None or self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+            TRACE_SPANS_DROPPED.inc()
+
+    def _start(self):
+        with self._lock:
+            if self._writer is not None and self._pid == os.getpid():
+                return
+            if self._pid is not None and self._pid != os.getpid():
+                # A forked child inherits neither the writer thread nor a usable queue; start afresh
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._file = None
+            self._pid = os.getpid()
+            self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+            self._writer.start()
+            if not self._atexit:
+                # Spans still queued at interpreter exit are written rather than lost with the daemon thread
+                atexit.register(self.close)
+                self._atexit = True
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < TRACE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            spans = [span for span in batch if span is not _STOP]
+            if spans:
+                self._write(spans)
+            for _ in batch:
+                self._queue.task_done()
+            if _STOP in batch:
+                return
+
+    def _write(self, spans: List[Span]):
+        format_span = self._chrome_event if self.format == "chrome" else self._otlp_request
+        try:
+            if self._file is None:
+                self._open()
+            self._file.write("".join(format_span(span) for span in spans))
+            self._file.flush()
+            self.exported += len(spans)
+        except Exception as e:
+            # Never let the writer die: close() waits for it
+            logger.warning(f"Could not write {len(spans)} spans to {self.path}: {str(e)}")
+
+    @staticmethod
+    def _chrome_event(span: Span) -> str:
+        args = {"trace_id": span.trace_id, "span_id": span.span_id, "parent_id": span.parent_id, **span.attributes}
+        if span.error:
+            args["error"] = span.error
+        event = {
+            "name": span.name,
+            "cat": span.name.split(".", 1)[0],
+            "ph": "X",
+            "ts": span.start_ns / 1000,
+            "dur": (span.end_ns - span.start_ns) / 1000,
+            "pid": os.getpid(),
+            "tid": span.thread_id,
+            "args": args,
+        }
+        return json.dumps(event, default=str) + ",\n"
+
+    @staticmethod
+    def _otlp_value(value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def _otlp_request(self, span: Span) -> str:
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 2 if span.parent_id is None else 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [{"key": key, "value": self._otlp_value(value)} for key, value in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        request = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+                                        {"key": "process.pid", "value": {"intValue": str(os.getpid())}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": [otlp_span]}],
+        }]}
+        return json.dumps(request) + "\n"
+
+    def close(self):
+        """Write every span queued so far, stop the writer and close the file (a later span starts them again)."""
+        with self._lock:
+            if self._writer is not None and self._pid == os.getpid():
+                self._queue.put(_STOP)
+                self._writer.join()
+            self._writer = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+exporter = FileExporter()
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def request_id_from(header: Optional[str]) -> str:
+    """Use the client's X-Request-ID when it is well-formed, otherwise mint one."""
+    if header and _REQUEST_ID.match(header):
+        return header
+    return uuid.uuid4().hex
+
+
+@contextmanager
+def request_span(name: str, request_id: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Bind a request id to this context and, when tracing is on and the request is sampled, open its root span
+
+    Yields:
+        The root span, or None when the request is not traced
+    """
+    id_token = _request_id.set(request_id)
+    try:
+        if not TRACING_ENABLED or random.random() >= TRACE_SAMPLE_RATIO:
+            yield None
+            return
+        root = Span(name, uuid.uuid4().hex, attributes={"request.id": request_id, **attributes})
+        with _activate(root):
+            yield root
+    finally:
+        _request_id.reset(id_token)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Time a block as a child of the current span (a no-op outside a traced request)
+
+    Yields:
+        The span, to add attributes with span.set(...), or None when not tracing
+    """
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    with _activate(parent.child(name, **attributes)) as child:
+        yield child
+
+
+def traced(name: str):
+    """Decorator that runs a (synchronous) function inside span(name)."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def _activate(active: Span) -> Iterator[Span]:
+    token = _current.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        active.end()
+
+
+@contextmanager
+def attached(parent: Optional[Span]):
+    """Make parent the current span in a context that did not inherit it (e.g. a coroutine handed to another thread's loop)."""
+    token = _current.set(parent)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def record_span(name: str, duration: float, **attributes):
+    """Record an already finished operation of duration seconds, ending now, under the current span."""
+    parent = _current.get()
+    if parent is None:
+        return
+    end_ns = time.time_ns()
+    finished = Span(name, parent.trace_id, parent.span_id, start_ns=end_ns - int(duration * 1e9), attributes=attributes)
+    finished.end(end_ns)
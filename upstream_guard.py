@@ -0,0 +1,364 @@
+"""
+Adaptive concurrency limiting and circuit breaking for upstream APIs
+Each guarded upstream gets an AIMD concurrency limit that honours Retry-After, and a breaker that fails calls fast while the upstream is down
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import defaultdict, deque
+from email.utils import parsedate_to_datetime
+from statistics import median
+from typing import Any, Dict, List, Optional, Union
+
+from metrics import REGISTRY, Counter
+
+logger = logging.getLogger(__name__)
+
+# Segmind limits (see .env.example)
+SEGMIND_MAX_CONCURRENCY = int(os.environ.get("SEGMIND_MAX_CONCURRENCY", "8"))
+SEGMIND_INITIAL_CONCURRENCY = int(os.environ.get("SEGMIND_INITIAL_CONCURRENCY", "4"))
+SEGMIND_RATE_PER_MINUTE = float(os.environ.get("SEGMIND_RATE_PER_MINUTE", "0"))
+SEGMIND_LATENCY_TOLERANCE = float(os.environ.get("SEGMIND_LATENCY_TOLERANCE", "2.0"))
+SEGMIND_QUEUE_TIMEOUT = float(os.environ.get("SEGMIND_QUEUE_TIMEOUT", "30"))
+SEGMIND_BREAKER_FAILURES = int(os.environ.get("SEGMIND_BREAKER_FAILURES", "5"))
+SEGMIND_BREAKER_RESET_SECONDS = float(os.environ.get("SEGMIND_BREAKER_RESET_SECONDS", "30"))
+
+# Pause after a 429 that carries no usable Retry-After
+DEFAULT_RETRY_AFTER = 5.0
+# Recent latencies per endpoint that "slow" is judged against
+LATENCY_WINDOW = 50
+
+UPSTREAM_REJECTED = Counter("upstream_rejected_total", "Upstream calls failed fast without being sent",
+                            ("upstream", "reason"))
+UPSTREAM_THROTTLED = Counter("upstream_throttled_total", "429 responses received from an upstream", ("upstream",))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_guards: List["UpstreamGuard"] = []
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling an upstream whose circuit is open or that has no capacity within the wait budget."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date); None when absent or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit shared by every caller of one upstream
+
+    Healthy responses raise the limit by about one per limit's worth of calls; a 429 halves it and
+    holds back new calls for its Retry-After, and a response slower than `latency_tolerance` times
+    its endpoint's recent median trims it by 10%. Cuts happen at most once per typical response
+    time, so a burst of bad responses from one window counts once. Usable from any event loop.
+    """
+
+    def __init__(self, initial: int, max_limit: int, min_limit: int = 1, rate_per_minute: float = 0.0,
+                 latency_tolerance: float = 2.0):
+        """
+        Initialize the limiter
+
+        Args:
+            initial: Starting concurrency limit
+            max_limit: Ceiling, e.g. the provider's published concurrency limit
+            min_limit: Floor the limit never drops below
+            rate_per_minute: Published request rate limit; calls are spaced to stay under it (0: none)
+            latency_tolerance: Responses slower than this multiple of the recent median cut the limit (0: off)
+        """
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._next_start = 0.0
+        self._last_cut = 0.0
+        self._latencies: Dict[str, deque] = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self._waiters: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, now: float) -> Optional[float]:
+        """Take a slot and return 0, or return seconds until one may be free (None: until a call finishes)."""
+        wait = max(self._paused_until, self._next_start) - now
+        if wait > 0:
+            return wait
+        if self.in_flight >= int(self.limit):
+            return None
+        self.in_flight += 1
+        self._next_start = now + self.interval
+        return 0.0
+
+    async def acquire(self, timeout: float):
+        """
+        Wait for a slot (release() must follow)
+
+        Raises:
+            UpstreamUnavailable: If no slot frees up within timeout, or a Retry-After pause outlasts it
+        """
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        while True:
+            released = None
+            with self._lock:
+                now = time.monotonic()
+                wait = self._try_acquire(now)
+                if wait == 0.0:
+                    return
+                if wait is None:
+                    released = loop.create_future()
+                    self._waiters.append((loop, released))
+            remaining = deadline - now
+            if wait is not None and wait > remaining:
+                self._forget(released)
+                raise UpstreamUnavailable(f"Upstream calls are held back for another {wait:.1f}s", retry_after=wait)
+            try:
+                if released is not None:
+                    await asyncio.wait_for(released, remaining)
+                else:
+                    await asyncio.sleep(wait)
+            except asyncio.TimeoutError:
+                raise UpstreamUnavailable(f"No upstream capacity within {timeout:g}s ({self.in_flight} calls in flight)",
+                                          retry_after=DEFAULT_RETRY_AFTER)
+            finally:
+                self._forget(released)
+
+    def _forget(self, released: Optional[asyncio.Future]):
+        if released is None:
+            return
+        with self._lock:
+            self._waiters = [waiter for waiter in self._waiters if waiter[1] is not released]
+
+    def release(self, outcome: str, latency: float = 0.0, endpoint: str = "", retry_after: Optional[float] = None):
+        """
+        Return a slot and adjust the limit
+
+        Args:
+            outcome: "ok", "throttled" (429) or anything else for calls that tell nothing about capacity
+            latency: Seconds the call took
+            endpoint: Endpoint the call went to; latency is judged against the same endpoint's history
+            retry_after: Retry-After of a 429, in seconds
+        """
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            now = time.monotonic()
+            history = self._latencies[endpoint]
+            if outcome == "throttled":
+                self._cut(now, 0.5, history)
+                pause = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+                self._paused_until = max(self._paused_until, now + pause)
+            elif outcome == "ok":
+                typical = median(history) if len(history) >= 5 else None
+                history.append(latency)
+                if typical and self.latency_tolerance and latency > self.latency_tolerance * typical:
+                    self._cut(now, 0.9, history)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            waiters, self._waiters = self._waiters, []
+        # Every waiter re-checks; the limit may have moved either way
+        for loop, released in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, released)
+            except RuntimeError:
+                pass  # that caller's loop has closed
+
+    def _cut(self, now: float, factor: float, history: deque):
+        cooldown = median(history) if history else 1.0
+        if now - self._last_cut < cooldown:
+            return
+        self._last_cut = now
+        self.limit = max(self.min_limit, self.limit * factor)
+
+    def paused_for(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast after `failure_threshold` consecutive failures; after `reset_timeout`
+    one probe call goes through, and its outcome closes the circuit or opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raises:
+            UpstreamUnavailable: While the circuit is open, or while the half-open probe is in flight
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                self.state = HALF_OPEN
+                return
+            retry_after = remaining if self.state == OPEN else DEFAULT_RETRY_AFTER
+            raise UpstreamUnavailable(f"Upstream circuit is {self.state.replace('_', '-')} after "
+                                      f"{self.failures} consecutive failures", retry_after=max(1.0, retry_after))
+
+    def record(self, success: Optional[bool]):
+        """Record a call's outcome; None for calls abandoned before a response (a half-open probe is retried)."""
+        with self._lock:
+            if success is None:
+                if self.state == HALF_OPEN:
+                    # Let the next caller probe straight away
+                    self.state, self.opened_at = OPEN, time.monotonic() - self.reset_timeout
+                return
+            if success:
+                if self.state != CLOSED:
+                    logger.info("Upstream circuit closed")
+                self.state, self.failures = CLOSED, 0
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning(f"Upstream circuit opened after {self.failures} consecutive failures")
+                self.state, self.opened_at = OPEN, time.monotonic()
+
+
+class UpstreamGuard:
+    """The limiter and breaker for one upstream; http_client.request(..., guard=...) calls acquire() and release()."""
+
+    def __init__(self, name: str, limiter: AdaptiveLimiter, breaker: CircuitBreaker,
+                 queue_timeout: float = SEGMIND_QUEUE_TIMEOUT):
+        """
+        Initialize the guard
+
+        Args:
+            name: Upstream name used in metrics and errors
+            limiter: Concurrency limiter for the upstream
+            breaker: Circuit breaker for the upstream
+            queue_timeout: Longest a call waits for a slot (or a Retry-After pause) before failing fast
+        """
+        self.name = name
+        self.limiter = limiter
+        self.breaker = breaker
+        self.queue_timeout = queue_timeout
+        self.throttled = 0
+        self.rejected = 0
+        _guards.append(self)
+
+    async def acquire(self, max_wait: Optional[float] = None):
+        """
+        Wait until a call may be sent
+
+        Args:
+            max_wait: Give up sooner than queue_timeout (e.g. when the caller's deadline is closer)
+
+        Raises:
+            UpstreamUnavailable: If the circuit is open or no slot frees up in time
+        """
+        try:
+            self.breaker.before_call()
+        except UpstreamUnavailable:
+            self._reject("circuit_open")
+            raise
+        try:
+            await self.limiter.acquire(self.queue_timeout if max_wait is None else min(self.queue_timeout, max_wait))
+        except UpstreamUnavailable:
+            self.breaker.record(None)
+            self._reject("no_capacity")
+            raise
+        except BaseException:
+            self.breaker.record(None)
+            raise
+
+    def release(self, result: Union[int, str, None], latency: float = 0.0, endpoint: str = "",
+                retry_after: Optional[str] = None):
+        """
+        Report how an acquired call went
+
+        Args:
+            result: HTTP status, "error" for connection failures and timeouts, or None if the call was abandoned
+            latency: Seconds the call took
+            endpoint: Path the call went to
+            retry_after: The response's Retry-After header
+        """
+        if result == 429:
+            self.throttled += 1
+            UPSTREAM_THROTTLED.labels(self.name).inc()
+            self.limiter.release("throttled", latency, endpoint, parse_retry_after(retry_after))
+            self.breaker.record(True)
+        elif result is None:
+            self.limiter.release("abandoned")
+            self.breaker.record(None)
+        elif result == "error" or result >= 500:
+            self.limiter.release("failed")
+            self.breaker.record(False)
+        else:
+            self.limiter.release("ok", latency, endpoint)
+            self.breaker.record(True)
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        UPSTREAM_REJECTED.labels(self.name, reason).inc()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limiter.limit, 2),
+            "max_limit": self.limiter.max_limit,
+            "in_flight": self.limiter.in_flight,
+            "paused_seconds": round(self.limiter.paused_for(), 1),
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+        }
+
+
+# Segmind try-on and text-to-image share the account's limits, so they share one guard
+segmind = UpstreamGuard(
+    "segmind",
+    AdaptiveLimiter(SEGMIND_INITIAL_CONCURRENCY, SEGMIND_MAX_CONCURRENCY, rate_per_minute=SEGMIND_RATE_PER_MINUTE,
+                    latency_tolerance=SEGMIND_LATENCY_TOLERANCE),
+    CircuitBreaker(SEGMIND_BREAKER_FAILURES, SEGMIND_BREAKER_RESET_SECONDS),
+)
+
+
+def stats() -> Dict[str, Any]:
+    return {guard.name: guard.stats() for guard in _guards}
+
+
+def _collect():
+    yield ("upstream_concurrency_limit", "gauge", "Current adaptive concurrency limit of an upstream",
+           [({"upstream": guard.name}, guard.limiter.limit) for guard in _guards])
+    yield ("upstream_in_flight", "gauge", "Calls in progress to an upstream",
+           [({"upstream": guard.name}, guard.limiter.in_flight) for guard in _guards])
+    yield ("upstream_circuit_open", "gauge", "1 while an upstream's circuit breaker is open or half-open",
+           [({"upstream": guard.name}, int(guard.breaker.state != CLOSED)) for guard in _guards])
+
+
+REGISTRY.register_collector(_collect)
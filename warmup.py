@@ -0,0 +1,178 @@
+"""
+Background warm-up and readiness tracking for slow-to-load components
+Components load (and run a dummy inference) one at a time on a background thread once the process has answered its
+first request; /ready reports when all of them can serve
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+# Warm-up settings (see .env.example)
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "True").lower() in ("1", "true", "yes")
+# Warm-up waits for the first response to go out, or this long after startup if no request comes
+WARMUP_DELAY_SECONDS = float(os.environ.get("WARMUP_DELAY_SECONDS", "5"))
+# Tries per component before giving up and leaving it to load on first use; waits double between tries
+WARMUP_ATTEMPTS = int(os.environ.get("WARMUP_ATTEMPTS", "3"))
+WARMUP_RETRY_SECONDS = float(os.environ.get("WARMUP_RETRY_SECONDS", "10"))
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+LAZY = "lazy"
+# Warm-up gave up; the component no longer holds back readiness and loads (or fails) on first use
+DEGRADED = "degraded"
+
+COMPONENT_READY = Gauge("component_ready", "1 once a component has loaded and can serve, else 0", ("component",))
+COMPONENT_LOAD_SECONDS = Gauge("component_load_seconds", "How long a component took to load and warm up", ("component",))
+
+
+class Component:
+    """Load state of one component."""
+
+    def __init__(self, name: str, required: bool = True):
+        self.name = name
+        self.required = required
+        self.status = PENDING
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status in (READY, DEGRADED) or not self.required
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "status": self.status,
+            "required": self.required,
+            "error": self.error,
+            "load_seconds": round(self.finished_at - self.started_at, 3) if self.started_at and self.finished_at else None,
+        }
+
+
+class Readiness:
+    """Registry of components whose readiness gates traffic to this process."""
+
+    def __init__(self):
+        self.components: Dict[str, Component] = {}
+        self._lock = threading.Lock()
+        self._queue: List[Tuple[str, Callable[[], Any], Optional[Callable[[Any], Any]]]] = []
+        self._go = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+    def register(self, name: str, required: bool = True) -> Component:
+        with self._lock:
+            component = self.components.get(name)
+            if component is None:
+                component = Component(name, required)
+                self.components[name] = component
+                COMPONENT_READY.labels(name).set(0)
+            return component
+
+    def mark(self, name: str, status: str, error: Optional[str] = None):
+        """Record a component's state transition."""
+        component = self.register(name)
+        now = time.time()
+        if status == LOADING:
+            component.started_at = now
+            component.finished_at = None
+            component.error = None
+        elif status in (READY, FAILED, DEGRADED):
+            component.started_at = component.started_at or now
+            component.finished_at = now
+            component.error = error
+            COMPONENT_LOAD_SECONDS.labels(name).set(now - component.started_at)
+        component.status = status
+        COMPONENT_READY.labels(name).set(1 if status == READY else 0)
+
+    def warm_up(self, name: str, load: Callable[[], Any], exercise: Optional[Callable[[Any], Any]] = None,
+                required: bool = True):
+        """
+        Queue a component to load on the background warm-up thread
+
+        Loading starts once begin() is called (after the first response) or WARMUP_DELAY_SECONDS have passed,
+        so warm-up never competes with the process answering its first request. If warm-up is disabled the
+        component loads on first use instead.
+
+        Args:
+            name: Component name reported by /ready
+            load: Builds (or returns the already built) component
+            exercise: Optional dummy inference run on the loaded component to initialize kernels and buffers
+            required: Whether the process is unready until this component is ready (or has been given up on)
+        """
+        if not WARMUP_ENABLED:
+            self.register(name, required=False).status = LAZY
+            return
+        self.register(name, required)
+        with self._lock:
+            self._queue.append((name, load, exercise))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="warmup", daemon=True)
+                self._worker.start()
+
+    def begin(self):
+        """Let warm-up start now; called once the first response has gone out."""
+        self._go.set()
+
+    @property
+    def begun(self) -> bool:
+        return self._go.is_set()
+
+    def _run(self):
+        self._go.wait(WARMUP_DELAY_SECONDS)
+        self._go.set()
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._worker = None
+                    return
+                name, load, exercise = self._queue.pop(0)
+            self._load(name, load, exercise)
+
+    def _load(self, name: str, load: Callable[[], Any], exercise: Optional[Callable[[Any], Any]]):
+        """Load one component, retrying with backoff, and mark it degraded if every attempt fails."""
+        delay = WARMUP_RETRY_SECONDS
+        for attempt in range(1, WARMUP_ATTEMPTS + 1):
+            self.mark(name, LOADING)
+            try:
+                component = load()
+                if exercise is not None:
+                    exercise(component)
+            except Exception as e:
+                if attempt < WARMUP_ATTEMPTS:
+                    logger.warning(f"Warm-up of {name} failed (attempt {attempt}/{WARMUP_ATTEMPTS}), "
+                                   f"retrying in {delay:.0f}s: {str(e)}")
+                    self.mark(name, FAILED, str(e))
+                    time.sleep(delay)
+                    delay *= 2
+                    continue
+                logger.error(f"Warm-up of {name} failed {WARMUP_ATTEMPTS} times; it will load on first use: {str(e)}")
+                self.mark(name, DEGRADED, str(e))
+                return
+            self.mark(name, READY)
+            logger.info(f"{name} warmed up in {self.components[name].to_dict()['load_seconds']}s")
+            return
+
+    def is_ready(self) -> bool:
+        with self._lock:
+            components = list(self.components.values())
+        return all(component.ready for component in components)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            components = dict(self.components)
+        return {
+            "ready": all(component.ready for component in components.values()),
+            "components": {name: component.to_dict() for name, component in components.items()},
+        }
+
+
+readiness = Readiness()